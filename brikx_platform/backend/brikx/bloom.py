@@ -0,0 +1,149 @@
+# brikx/bloom.py
+"""
+Bloom filter als snelle voorfilter voor "al eerder gezien?".
+
+Een miss is definitief (nooit gezien), een hit betekent "misschien" en moet nog
+tegen de echte bron (StateStore / Supabase) gecontroleerd worden. Omdat de meeste
+URL's in een digest-mail al bekend zijn, scheelt dit vooral bij nieuwe listings
+de trage lookup.
+
+- Persistent op schijf (atomisch weggeschreven), met vrije metadata (versie/watermark)
+  zodat de eigenaar kan bepalen of het filter nog bij de bron past
+- Altijd opnieuw op te bouwen uit de bron: BloomFilter.build(items)
+- observe() houdt het gemeten false-positive percentage bij
+"""
+import hashlib
+import json
+import math
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Any, Iterable
+
+MAGIC = b"BRKXBLM1"
+HEADER = struct.Struct("<8sQIQI")  # magic, bits, hashes, count, meta-lengte
+
+
+class BloomFilter:
+    def __init__(self, capacity: int = 100_000, error_rate: float = 0.001):
+        capacity = max(1, int(capacity))
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self.meta: dict[str, Any] = {}
+        self.checks = 0           # aantal "misschien" antwoorden dat tegen de bron is gecontroleerd
+        self.false_positives = 0  # waarvan de bron "bestaat niet" zei
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, items: Iterable[str], error_rate: float = 0.001, headroom: float = 2.0) -> "BloomFilter":
+        """Bouw een filter uit de bron; headroom laat ruimte voor groei voordat het filter vol raakt."""
+        items = list(items)
+        bf = cls(capacity=max(1000, int(len(items) * headroom)), error_rate=error_rate)
+        bf.add_many(items)
+        return bf
+
+    def _positions(self, item: str) -> list[int]:
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item: str) -> None:
+        with self._lock:
+            self._add(item)
+
+    def add_many(self, items: Iterable[str]) -> None:
+        with self._lock:
+            for item in items:
+                self._add(item)
+
+    def _add(self, item: str) -> None:
+        new = False
+        for pos in self._positions(item):
+            byte, bit = divmod(pos, 8)
+            if not self._bits[byte] & (1 << bit):
+                self._bits[byte] |= 1 << bit
+                new = True
+        if new:
+            self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self._bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def saturated(self) -> bool:
+        """Meer items dan de capaciteit: het fp-percentage loopt op, opnieuw bouwen."""
+        return self.count > self.capacity
+
+    def estimated_fp_rate(self) -> float:
+        """Theoretisch fp-percentage bij het huidige aantal items."""
+        return (1.0 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def observe(self, present: bool) -> None:
+        """Registreer de uitkomst van de echte lookup na een "misschien" van het filter."""
+        with self._lock:
+            self.checks += 1
+            if not present:
+                self.false_positives += 1
+
+    @property
+    def measured_fp_rate(self) -> float | None:
+        return self.false_positives / self.checks if self.checks else None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "items": self.count,
+            "capacity": self.capacity,
+            "estimated_fp_rate": round(self.estimated_fp_rate(), 6),
+            "checks": self.checks,
+            "false_positives": self.false_positives,
+            "measured_fp_rate": self.measured_fp_rate,
+        }
+
+    # ---- Persistentie ----
+    def save(self, path: str | os.PathLike) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = json.dumps({**self.meta, "capacity": self.capacity, "error_rate": self.error_rate}).encode("utf-8")
+        tmp = path.with_name(path.name + ".tmp")
+        with self._lock:
+            with open(tmp, "wb") as f:
+                f.write(HEADER.pack(MAGIC, self.num_bits, self.num_hashes, self.count, len(meta)))
+                f.write(meta)
+                f.write(self._bits)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str | os.PathLike) -> "BloomFilter | None":
+        """Laad een filter; None als het bestand ontbreekt of onleesbaar is (dan opnieuw bouwen)."""
+        try:
+            with open(path, "rb") as f:
+                magic, num_bits, num_hashes, count, meta_len = HEADER.unpack(f.read(HEADER.size))
+                if magic != MAGIC:
+                    return None
+                meta = json.loads(f.read(meta_len).decode("utf-8"))
+                bits = bytearray(f.read())
+        except (OSError, ValueError, struct.error):
+            return None
+        if len(bits) != (num_bits + 7) // 8:
+            return None
+        bf = cls.__new__(cls)
+        bf.capacity = int(meta.pop("capacity", count or 1))
+        bf.error_rate = float(meta.pop("error_rate", 0.001))
+        bf.num_bits = num_bits
+        bf.num_hashes = num_hashes
+        bf._bits = bits
+        bf.count = count
+        bf.meta = meta
+        bf.checks = 0
+        bf.false_positives = 0
+        bf._lock = threading.Lock()
+        return bf
@@ -1,16 +1,28 @@
 ﻿import argparse
 import logging
 import sys
-import yaml
-
-from .publisher import run_pipeline
 
 def main():
     parser = argparse.ArgumentParser(description="Brikx – Funda → WordPress")
     parser.add_argument("--config", required=True, help="Pad naar config.yaml")
     parser.add_argument("--log-level", default="INFO", help="DEBUG/INFO/WARNING/ERROR")
+    parser.add_argument("--profile-startup", action="store_true", help="Toon importtijd per module na de run")
+    parser.add_argument("--list-unverified", action="store_true",
+                        help="Toon listings waarvan de publicatie onbekend is (mogelijk geplaatst) en stop")
+    parser.add_argument("--resolve-unverified", metavar="URL",
+                        help="Handel een onbekende publicatie af: met --posted als verwerkt, anders opnieuw proberen")
+    parser.add_argument("--posted", action="store_true", help="Met --resolve-unverified: de post staat in WordPress")
     args = parser.parse_args()
 
+    profiler = None
+    if args.profile_startup:
+        from .startup_profile import ImportProfiler
+        profiler = ImportProfiler().start()
+
+    # Pas na het parsen importeren: --help en configfouten blijven snel
+    import yaml
+    from .publisher import run_pipeline
+
     logging.basicConfig(
         level=getattr(logging, args.log_level.upper(), logging.INFO),
         format="%(levelname)s %(name)s: %(message)s"
@@ -22,8 +34,30 @@ def main():
     with open(args.config, "r", encoding="utf-8") as f:
         cfg = yaml.safe_load(f)
 
+    if args.list_unverified or args.resolve_unverified:
+        _unverified(cfg, args)
+        return
+
     try:
         run_pipeline(cfg)
     except Exception as e:
         log.exception("Fout tijdens run: %s", e)
         sys.exit(1)
+    finally:
+        if profiler:
+            profiler.stop()
+            print(profiler.report(), file=sys.stderr)
+
+
+def _unverified(cfg: dict, args) -> None:
+    from .state_store import StateStore, extract_funda_id, normalize_url
+
+    path = (cfg.get("state") or {}).get("processed_store", "state/processed.json")
+    with StateStore(path) as store:
+        if args.resolve_unverified:
+            url = normalize_url(args.resolve_unverified)
+            store.resolve_unverified(url, extract_funda_id(url), posted=args.posted)
+            print(f"{url}: {'verwerkt' if args.posted else 'vrijgegeven voor een volgende run'}")
+            return
+        for item in store.unverified():
+            print(f"{item['url']}\t{item['listing_id'] or '-'}")
@@ -0,0 +1,109 @@
+# brikx/disk_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+# Sentinel voor get(): onderscheidt "niet in cache" van een gecachte None
+MISSING = object()
+_DEFAULT = object()
+
+
+def default_cache_dir() -> Path:
+    """Map voor persistente caches (env BRIKX_CACHE_DIR of backend/state/cache)."""
+    env = os.getenv("BRIKX_CACHE_DIR")
+    return Path(env) if env else Path(__file__).resolve().parent.parent / "state" / "cache"
+
+
+def make_key(*parts: Any) -> str:
+    """Stabiele cache-key (sha256) uit willekeurige JSON-serialiseerbare onderdelen."""
+    blob = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    Kleine persistente key/value cache op SQLite.
+    - Waarden worden als JSON opgeslagen (None mag, voor negatieve caching)
+    - TTL per cache of per entry; verlopen entries tellen als miss
+    - max_entries: bij overschrijding worden de minst recent gebruikte entries verwijderd
+    - Thread-safe binnen een proces; WAL mode zodat meerdere processen kunnen lezen/schrijven
+    """
+    def __init__(self, path: str | os.PathLike, ttl: float | None = None, max_entries: int | None = None):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache(accessed_at)")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return default
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return default
+            self._db.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = _DEFAULT) -> None:
+        ttl = self.ttl if ttl is _DEFAULT else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        blob = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, blob, expires_at, now),
+            )
+            self._evict(now)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM cache")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def _evict(self, now: float) -> None:
+        if not self.max_entries:
+            return
+        count = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        # Eerst verlopen entries, daarna LRU tot 90% van de limiet (voorkomt evictie bij elke set)
+        self._db.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        target = int(self.max_entries * 0.9)
+        self._db.execute(
+            "DELETE FROM cache WHERE key IN ("
+            " SELECT key FROM cache ORDER BY accessed_at ASC"
+            " LIMIT max(0, (SELECT COUNT(*) FROM cache) - ?))",
+            (target,),
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -1,14 +1,71 @@
 # brikx/geocode.py
+import threading
+
 import requests
 
-def geocode_place(place: str, countrycodes: str = "nl", language: str = "nl"):
+from .disk_cache import DiskCache, MISSING, default_cache_dir, make_key
+from .ratelimit import TokenBucket
+
+# Nominatim usage policy: maximaal 1 request per seconde, voor het hele proces
+NOMINATIM_LIMITER = TokenBucket(rate=1.0, capacity=1.0)
+
+# Gevonden coördinaten veranderen zelden; "niets gevonden" korter bewaren
+GEOCODE_TTL = 180 * 86400
+GEOCODE_NEGATIVE_TTL = 7 * 86400
+GEOCODE_MAX_ENTRIES = 50_000
+
+_cache: DiskCache | None = None
+_cache_lock = threading.Lock()
+
+
+def geocode_cache() -> DiskCache:
+    """Gedeelde persistente geocode-cache (lazy aangemaakt in de cache-map)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiskCache(default_cache_dir() / "geocode.sqlite", ttl=GEOCODE_TTL, max_entries=GEOCODE_MAX_ENTRIES)
+        return _cache
+
+
+def normalize_query(q: str) -> str:
+    """Cache-key normalisatie: lowercase, enkele spaties, geen losse komma's."""
+    parts = [" ".join(p.split()) for p in q.lower().split(",")]
+    return ", ".join(p for p in parts if p)
+
+
+def cached_lookup(provider: str, query: str, fetch, *key_parts):
+    """
+    Zoek (lat, lon) op via de cache; bij een miss wordt fetch() aangeroepen.
+    None-resultaten worden negatief gecachet (korte TTL); exceptions niet.
+    """
+    cache = geocode_cache()
+    key = make_key(provider, normalize_query(query), *key_parts)
+    hit = cache.get(key, MISSING)
+    if hit is not MISSING:
+        return tuple(hit) if hit else None
+    result = fetch()
+    if result:
+        cache.set(key, list(result))
+    else:
+        cache.set(key, None, ttl=GEOCODE_NEGATIVE_TTL)
+    return result
+
+
+def geocode_place(place: str, countrycodes: str = "nl", language: str = "nl", use_cache: bool = True):
     """
     Geocodeer een plaatsnaam met Nominatim.
     Retourneert (lat, lon) als floats of None als niets gevonden is.
+    Resultaten worden gecachet; requests worden beperkt tot 1 per seconde.
     """
     if not place:
         return None
+    if use_cache:
+        return cached_lookup("nominatim", place, lambda: _nominatim_search(place, countrycodes, language),
+                             countrycodes, language)
+    return _nominatim_search(place, countrycodes, language)
+
 
+def _nominatim_search(place: str, countrycodes: str, language: str):
     params = {
         "q": place,
         "format": "json",
@@ -20,6 +77,7 @@ def geocode_place(place: str, countrycodes: str = "nl", language: str = "nl"):
 
     headers = {"User-Agent": "BrikxBot/0.1 (+contact)"}
 
+    NOMINATIM_LIMITER.acquire()
     r = requests.get("https://nominatim.openstreetmap.org/search", params=params, headers=headers, timeout=20)
     r.raise_for_status()
     data = r.json()
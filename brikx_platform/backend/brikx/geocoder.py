@@ -0,0 +1,274 @@
+# brikx/geocoder.py
+"""
+Eén geocoder voor de hele pipeline, met een configureerbare provider-keten:
+
+  offline         PC6-postcode of losse plaatsnaam uit de lokale centroid-index (geen netwerk)
+  geoapify        Geoapify geocode API (gecachet)
+  nominatim       OpenStreetMap Nominatim (gecachet, max. 1 req/s)
+  offline_coarse  PC4- of plaats-centroid uit de index, als laatste redmiddel
+
+De offline index is een gesorteerd binair bestand met vaste recordgrootte dat via
+mmap wordt doorzocht (binary search), zodat opzoeken microseconden kost en het
+bestand niet in het geheugen geladen hoeft te worden. Bouwen vanuit een CSV
+(bijv. een PDOK/CBS postcode-export met postcode, plaats, lat, lon):
+
+  python -m brikx.geocoder build postcodes.csv state/nl_centroids.idx
+"""
+import csv
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from pathlib import Path
+from typing import Iterable
+
+from .disk_cache import default_cache_dir
+
+log = logging.getLogger("brikx.geocoder")
+
+DEFAULT_PROVIDERS = ["offline", "geoapify", "nominatim", "offline_coarse"]
+
+INDEX_MAGIC = b"BRKXGEO1"
+KEY_SIZE = 48
+_HEADER = struct.Struct("<8sII")          # magic, aantal records, key size
+_RECORD = struct.Struct(f"<{KEY_SIZE}sdd")  # key, lat, lon
+
+PC6_RE = re.compile(r"\b(\d{4})\s?([A-Za-z]{2})\b")
+PC4_RE = re.compile(r"^\s*(\d{4})\s*$")
+
+
+def default_index_path() -> Path:
+    env = os.getenv("BRIKX_GEOCODE_INDEX")
+    return Path(env) if env else default_cache_dir().parent / "nl_centroids.idx"
+
+
+def _place_key(place: str) -> str:
+    return "plaats:" + " ".join(place.lower().replace("-", " ").split())
+
+
+def _postcode_keys(postcode: str) -> tuple[str | None, str | None]:
+    """(pc6-key, pc4-key) voor een postcode zoals '1234 AB' of '1234'."""
+    if not postcode:
+        return None, None
+    m = PC6_RE.search(postcode)
+    if m:
+        return f"pc6:{m.group(1)}{m.group(2).upper()}", f"pc4:{m.group(1)}"
+    m = PC4_RE.match(postcode)
+    if m:
+        return None, f"pc4:{m.group(1)}"
+    return None, None
+
+
+def _encode_key(key: str) -> bytes:
+    return key.encode("utf-8")[:KEY_SIZE].ljust(KEY_SIZE, b"\0")
+
+
+class CentroidIndex:
+    """Read-only, memory-mapped centroid index (zie build_centroid_index)."""
+    def __init__(self, path: str | os.PathLike):
+        self.path = Path(path)
+        self._fh = open(self.path, "rb")
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, key_size = _HEADER.unpack_from(self._mm, 0)
+        if magic != INDEX_MAGIC or key_size != KEY_SIZE:
+            self.close()
+            raise ValueError(f"Geen geldige centroid-index: {self.path}")
+
+    def lookup(self, key: str) -> tuple[float, float] | None:
+        needle = _encode_key(key)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = _HEADER.size + mid * _RECORD.size
+            current = self._mm[offset:offset + KEY_SIZE]
+            if current < needle:
+                lo = mid + 1
+            elif current > needle:
+                hi = mid
+            else:
+                _, lat, lon = _RECORD.unpack_from(self._mm, offset)
+                return lat, lon
+        return None
+
+    def close(self) -> None:
+        try:
+            self._mm.close()
+        finally:
+            self._fh.close()
+
+
+def build_centroid_index(rows: Iterable[dict], out_path: str | os.PathLike) -> int:
+    """
+    Schrijf een index uit rijen met 'postcode' en/of 'plaats' plus 'lat'/'lon'.
+    PC4- en plaats-centroids worden (indien niet expliciet aanwezig) gemiddeld
+    uit de PC6-rijen afgeleid. Retourneert het aantal records.
+    """
+    exact: dict[str, tuple[float, float]] = {}
+    sums: dict[str, list[float]] = {}
+
+    def _add_mean(key: str, lat: float, lon: float):
+        acc = sums.setdefault(key, [0.0, 0.0, 0])
+        acc[0] += lat
+        acc[1] += lon
+        acc[2] += 1
+
+    for row in rows:
+        try:
+            lat, lon = float(row["lat"]), float(row["lon"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        pc6, pc4 = _postcode_keys((row.get("postcode") or "").strip())
+        place = (row.get("plaats") or row.get("woonplaats") or row.get("place") or "").strip()
+        if pc6:
+            exact[pc6] = (lat, lon)
+            _add_mean(pc4, lat, lon)
+            if place:
+                _add_mean(_place_key(place), lat, lon)
+        elif pc4:
+            exact[pc4] = (lat, lon)
+        elif place:
+            exact[_place_key(place)] = (lat, lon)
+
+    records = {k: (acc[0] / acc[2], acc[1] / acc[2]) for k, acc in sums.items()}
+    records.update(exact)  # expliciete centroids winnen van afgeleide gemiddelden
+
+    encoded = sorted((_encode_key(k), v) for k, v in records.items())
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_suffix(out_path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(INDEX_MAGIC, len(encoded), KEY_SIZE))
+        for key, (lat, lon) in encoded:
+            f.write(_RECORD.pack(key, lat, lon))
+    os.replace(tmp_path, out_path)
+    return len(encoded)
+
+
+class Geocoder:
+    """
+    Geocoder met provider-keten; de eerste provider met een resultaat wint.
+
+      geo = Geocoder()  # of Geocoder(providers=["offline", "nominatim"], index_path="...")
+      geo.geocode("Noordeinde 6, Landsmeer", postcode="1121 AB", place="Landsmeer")
+    """
+    def __init__(self, providers: list[str] | None = None, index_path: str | os.PathLike | None = None):
+        self.providers = list(providers or DEFAULT_PROVIDERS)
+        unknown = [p for p in self.providers if p not in _PROVIDERS]
+        if unknown:
+            raise ValueError(f"Onbekende geocode provider(s): {', '.join(unknown)}")
+        self.index_path = Path(index_path) if index_path else default_index_path()
+        self._index: CentroidIndex | None = None
+        self._index_loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def index(self) -> CentroidIndex | None:
+        with self._lock:
+            if not self._index_loaded:
+                self._index_loaded = True
+                if self.index_path.exists():
+                    try:
+                        self._index = CentroidIndex(self.index_path)
+                        log.info("Offline geocode-index geladen: %s (%d records)", self.index_path, self._index.count)
+                    except Exception as e:
+                        log.warning("Offline geocode-index onbruikbaar (%s): %s", self.index_path, e)
+                else:
+                    log.debug("Geen offline geocode-index op %s", self.index_path)
+            return self._index
+
+    def geocode(self, query: str | None = None, postcode: str | None = None,
+                place: str | None = None) -> tuple[float, float] | None:
+        for name in self.providers:
+            try:
+                result = _PROVIDERS[name](self, query, postcode, place)
+            except Exception as e:
+                log.debug("Geocode provider %s faalde voor %r: %s", name, query, e)
+                continue
+            if result:
+                log.debug("Geocode %r via %s: %s", query or postcode or place, name, result)
+                return result
+        return None
+
+    # ---- providers ----
+    def _offline(self, query, postcode, place):
+        if not self.index:
+            return None
+        pc6, _ = _postcode_keys(postcode or "")
+        if not pc6 and query:
+            pc6, _ = _postcode_keys(query)
+        if pc6:
+            hit = self.index.lookup(pc6)
+            if hit:
+                return hit
+        # Alleen een plaatsnaam (geen straat): de plaats-centroid is dan het beste antwoord
+        if query and "," not in query and not any(ch.isdigit() for ch in query):
+            return self.index.lookup(_place_key(query))
+        if not query and place:
+            return self.index.lookup(_place_key(place))
+        return None
+
+    def _offline_coarse(self, query, postcode, place):
+        if not self.index:
+            return None
+        _, pc4 = _postcode_keys(postcode or "")
+        if not pc4 and query:
+            _, pc4 = _postcode_keys(query)
+        if pc4:
+            hit = self.index.lookup(pc4)
+            if hit:
+                return hit
+        if not place and query and "," in query:
+            place = query.rsplit(",", 1)[-1]
+        return self.index.lookup(_place_key(place)) if place else None
+
+    def _nominatim(self, query, postcode, place):
+        from .geocode import geocode_place
+        return geocode_place(query) if query else None
+
+    def _geoapify(self, query, postcode, place):
+        from .map_fetcher import geocode_address
+        return geocode_address(query) if query else None
+
+
+_PROVIDERS = {
+    "offline": Geocoder._offline,
+    "offline_coarse": Geocoder._offline_coarse,
+    "nominatim": Geocoder._nominatim,
+    "geoapify": Geocoder._geoapify,
+}
+
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m brikx.geocoder", description="Offline geocode-index beheer")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="Bouw de centroid-index uit een CSV (postcode/plaats, lat, lon)")
+    b.add_argument("csv_file")
+    b.add_argument("out", nargs="?", default=str(default_index_path()))
+    b.add_argument("--delimiter", default=None, help="CSV scheidingsteken (standaard: automatisch)")
+    q = sub.add_parser("lookup", help="Test een query tegen de keten")
+    q.add_argument("query")
+    q.add_argument("--postcode")
+    q.add_argument("--place")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        with open(args.csv_file, newline="", encoding="utf-8-sig") as f:
+            sample = f.read(4096)
+            f.seek(0)
+            delimiter = args.delimiter or csv.Sniffer().sniff(sample, delimiters=",;\t").delimiter
+            reader = csv.DictReader(f, delimiter=delimiter)
+            rows = ({(k or "").strip().lower(): v for k, v in row.items()} for row in reader)
+            n = build_centroid_index(rows, args.out)
+        print(f"{n} records geschreven naar {args.out}")
+        return 0
+
+    print(Geocoder().geocode(args.query, postcode=args.postcode, place=args.place))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
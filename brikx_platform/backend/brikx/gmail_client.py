@@ -1,21 +1,37 @@
 ﻿# brikx/gmail_client.py
 import base64
+import logging
 import re
-from typing import List, Dict, Any, Optional
+import time
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
 from email.header import decode_header, make_header
 from html import unescape
 from urllib.parse import urlparse
 
-from bs4 import BeautifulSoup
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
+# googleapiclient, google-auth en bs4 zijn zwaar om te importeren: pas laden bij gebruik
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
 
+log = logging.getLogger("brikx.gmail")
+
+# Archiveren/labelen (modify_messages) vereist gmail.modify; zonder die scope blijft
+# alles werken behalve het archiveren, en dat wordt luid gelogd.
+MODIFY_SCOPE = "https://www.googleapis.com/auth/gmail.modify"
 SCOPES = [
     "https://www.googleapis.com/auth/gmail.readonly",
-    # "https://www.googleapis.com/auth/gmail.modify"  # Temporarily disabled - needs Google Cloud Console update
+    # MODIFY_SCOPE,  # Temporarily disabled - needs Google Cloud Console update
 ]
 
+# Gmail batch endpoint accepteert maximaal 100 requests per HTTP call
+BATCH_SIZE = 100
+# messages.list geeft maximaal 500 IDs per pagina
+LIST_PAGE_SIZE = 500
+# messages.batchModify accepteert maximaal 1000 IDs per call
+MODIFY_BATCH_SIZE = 1000
+# Batch-entries met deze status (rate limit / serverfout) worden opnieuw geprobeerd
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+FETCH_RETRIES = 3
+
 # Detail-URL’s (met ID) – pakt /detail/koop/.../<id>/ en /koop/.../<id>/
 DETAIL_URL_RE = re.compile(
     r"https?://(?:www\.)?funda\.nl/(?:detail/koop|koop)/[^\s\"'()>]+/\d+/?",
@@ -25,6 +41,15 @@ PRICE_RE = re.compile(r"€\s?[\d\.\,]+")
 # ook 'm2' naast 'm²'
 SURF_RE  = re.compile(r"(\d{2,5})\s?m(?:²|2)\b", re.IGNORECASE)
 
+class HistoryExpiredError(Exception):
+    """startHistoryId is verlopen (Gmail geeft 404); doe een volledige zoekactie."""
+
+
+def _http_status(exc: Exception) -> Optional[int]:
+    """HTTP-status van een googleapiclient HttpError (None voor andere fouten)."""
+    status = getattr(getattr(exc, "resp", None), "status", None)
+    return int(status) if status is not None else None
+
 def _canonical(url: str) -> str:
     url = url.split("?", 1)[0].split("#", 1)[0]
     return url.rstrip("/").rstrip(").,]>")
@@ -39,6 +64,10 @@ def _decode_subject(message: Dict[str, Any]) -> str:
     except Exception:
         return subj_raw
 
+def message_sender(message: Dict[str, Any]) -> str:
+    headers = message.get("payload", {}).get("headers", [])
+    return next((h.get("value") or "" for h in headers if h.get("name", "").lower() == "from"), "")
+
 def _collect_parts_text(payload: Dict[str, Any]) -> str:
     chunks: List[str] = []
 
@@ -57,6 +86,7 @@ def _collect_parts_text(payload: Dict[str, Any]) -> str:
         text = _decode_data(data)
 
         if "text/html" in mime and text:
+            from bs4 import BeautifulSoup
             soup = BeautifulSoup(text, "lxml")
             text = soup.get_text(" ", strip=True)
         elif "text/plain" in mime and text:
@@ -89,10 +119,14 @@ class GmailClient:
         self.token_file = token_file
         self.user_id = user_id
         self.oauth_port = oauth_port
-        self.creds: Optional[Credentials] = None
+        self.creds: Optional["Credentials"] = None
+        self._svc = None
+        self._label_ids: Optional[Dict[str, str]] = None  # label-naam -> label-ID, lazy gevuld
+        self.failed_ids: List[str] = []  # niet-opgehaalde IDs van de laatste get_messages()
         self._ensure_creds()
 
     def _ensure_creds(self):
+        from google.oauth2.credentials import Credentials
         try:
             self.creds = Credentials.from_authorized_user_file(self.token_file, SCOPES)
         except Exception:
@@ -103,27 +137,148 @@ class GmailClient:
                 from google.auth.transport.requests import Request
                 self.creds.refresh(Request())
             else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
                 flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, SCOPES)
                 self.creds = flow.run_local_server(port=self.oauth_port, open_browser=True)
             with open(self.token_file, "w", encoding="utf-8") as f:
                 f.write(self.creds.to_json())
 
     def _service(self):
-        return build("gmail", "v1", credentials=self.creds)
+        # Discovery service één keer per instantie bouwen
+        if self._svc is None:
+            from googleapiclient.discovery import build
+            self._svc = build("gmail", "v1", credentials=self.creds, cache_discovery=False)
+        return self._svc
+
+    def _label_id(self, label_name: str, create: bool = True) -> Optional[str]:
+        """Resolve label-naam naar ID via de cache; maakt het label aan als het ontbreekt."""
+        if self._label_ids is None:
+            labels = self._service().users().labels().list(userId=self.user_id).execute()
+            self._label_ids = {l["name"]: l["id"] for l in labels.get("labels", [])}
+        label_id = self._label_ids.get(label_name)
+        if label_id or not create:
+            return label_id
+
+        try:
+            label_obj = self._service().users().labels().create(
+                userId=self.user_id,
+                body={'name': label_name, 'labelListVisibility': 'labelShow', 'messageListVisibility': 'show'}
+            ).execute()
+        finally:
+            # Labelset is gewijzigd (of door een ander proces aangemaakt): cache opnieuw laden
+            self._label_ids = None
+        return label_obj['id']
 
     def search_messages(self, query: str, max_results: int = 10) -> List[Dict[str, Any]]:
+        """
+        Zoek berichten en haal ze volledig op.
+        IDs worden gepagineerd via nextPageToken opgehaald; de berichten zelf
+        via de Gmail batch endpoint (max. 100 per HTTP round trip).
+        """
         service = self._service()
-        resp = service.users().messages().list(
-            userId=self.user_id, q=query, maxResults=max_results
-        ).execute()
-        ids = resp.get("messages", []) or []
-        out: List[Dict[str, Any]] = []
-        for m in ids:
-            msg = service.users().messages().get(
-                userId=self.user_id, id=m["id"], format="full"
+        ids: List[str] = []
+        page_token: Optional[str] = None
+        while len(ids) < max_results:
+            resp = service.users().messages().list(
+                userId=self.user_id,
+                q=query,
+                maxResults=min(max_results - len(ids), LIST_PAGE_SIZE),
+                pageToken=page_token,
             ).execute()
-            out.append(msg)
-        return out
+            ids.extend(m["id"] for m in (resp.get("messages") or []))
+            page_token = resp.get("nextPageToken")
+            if not page_token:
+                break
+        return self.get_messages(ids[:max_results])
+
+    def get_messages(self, message_ids: List[str], fmt: str = "full") -> List[Dict[str, Any]]:
+        """
+        Haal berichten op via batch requests, in dezelfde volgorde als message_ids.
+        Entries die op 429/5xx falen gaan (met backoff) in een volgende batch opnieuw mee.
+        Verwijderde berichten (404) worden overgeslagen; IDs die ook na de retries niet
+        op te halen waren staan daarna in self.failed_ids.
+        """
+        service = self._service()
+        results: Dict[str, Dict[str, Any]] = {}
+        errors: Dict[str, Exception] = {}
+
+        def _callback(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+            else:
+                results[request_id] = response
+
+        pending = list(dict.fromkeys(message_ids))  # batch request IDs moeten uniek zijn
+        for attempt in range(FETCH_RETRIES + 1):
+            if attempt:
+                time.sleep(2 ** (attempt - 1))
+            for msg_id in pending:
+                errors.pop(msg_id, None)
+            for start in range(0, len(pending), BATCH_SIZE):
+                batch = service.new_batch_http_request(callback=_callback)
+                for msg_id in pending[start:start + BATCH_SIZE]:
+                    batch.add(
+                        service.users().messages().get(userId=self.user_id, id=msg_id, format=fmt),
+                        request_id=msg_id,
+                    )
+                batch.execute()
+            pending = [i for i, exc in errors.items() if _http_status(exc) in RETRY_STATUSES]
+            if not pending:
+                break
+            if attempt < FETCH_RETRIES:
+                log.warning("Gmail: %d bericht(en) tijdelijk niet op te halen, opnieuw (poging %d)",
+                            len(pending), attempt + 2)
+
+        self.failed_ids = []
+        for msg_id, exc in errors.items():
+            if _http_status(exc) == 404:
+                log.info("Gmail: bericht %s bestaat niet meer, overgeslagen", msg_id)
+            else:
+                log.error("Gmail: bericht %s niet opgehaald: %s", msg_id, exc)
+                self.failed_ids.append(msg_id)
+        return [results[i] for i in dict.fromkeys(message_ids) if i in results]
+
+    # Incrementele sync via history
+    def get_history_id(self) -> str:
+        """Huidige historyId van de mailbox (startpunt voor een volgende incrementele sync)."""
+        profile = self._service().users().getProfile(userId=self.user_id).execute()
+        return str(profile["historyId"])
+
+    def list_added_message_ids(self, start_history_id: str) -> tuple[List[str], str]:
+        """
+        IDs van berichten die sinds start_history_id zijn toegevoegd (users.history.list),
+        plus de nieuwste historyId. Raises HistoryExpiredError als het checkpoint te oud is.
+        """
+        from googleapiclient.errors import HttpError
+        service = self._service()
+        ids: List[str] = []
+        latest = str(start_history_id)
+        page_token: Optional[str] = None
+        while True:
+            try:
+                resp = service.users().history().list(
+                    userId=self.user_id,
+                    startHistoryId=start_history_id,
+                    historyTypes=["messageAdded"],
+                    maxResults=LIST_PAGE_SIZE,
+                    pageToken=page_token,
+                ).execute()
+            except HttpError as e:
+                if getattr(e.resp, "status", None) == 404:
+                    raise HistoryExpiredError(f"historyId {start_history_id} is verlopen") from e
+                raise
+            for record in resp.get("history", []) or []:
+                for added in record.get("messagesAdded", []) or []:
+                    ids.append(added["message"]["id"])
+            latest = str(resp.get("historyId") or latest)
+            page_token = resp.get("nextPageToken")
+            if not page_token:
+                break
+        return list(dict.fromkeys(ids)), latest
+
+    def has_label(self, message: Dict[str, Any], label_name: str) -> bool:
+        label_id = self._label_id(label_name, create=False)
+        return bool(label_id) and label_id in (message.get("labelIds") or [])
 
     # Backwards compat: lijst van detail-URL's
     def extract_funda_urls(self, message: Dict[str, Any]) -> List[str]:
@@ -186,8 +341,7 @@ class GmailClient:
     def archive_message(self, message_id: str) -> bool:
         """Remove INBOX label to archive the message"""
         try:
-            service = self._service()
-            service.users().messages().modify(
+            self._service().users().messages().modify(
                 userId=self.user_id,
                 id=message_id,
                 body={'removeLabelIds': ['INBOX']}
@@ -200,26 +354,8 @@ class GmailClient:
     def add_label(self, message_id: str, label_name: str) -> bool:
         """Add a label to a message (creates label if it doesn't exist)"""
         try:
-            service = self._service()
-            
-            # Get or create label
-            labels = service.users().labels().list(userId=self.user_id).execute()
-            label_id = None
-            for label in labels.get('labels', []):
-                if label['name'] == label_name:
-                    label_id = label['id']
-                    break
-            
-            if not label_id:
-                # Create label
-                label_obj = service.users().labels().create(
-                    userId=self.user_id,
-                    body={'name': label_name, 'labelListVisibility': 'labelShow', 'messageListVisibility': 'show'}
-                ).execute()
-                label_id = label_obj['id']
-            
-            # Add label to message
-            service.users().messages().modify(
+            label_id = self._label_id(label_name)
+            self._service().users().messages().modify(
                 userId=self.user_id,
                 id=message_id,
                 body={'addLabelIds': [label_id]}
@@ -229,11 +365,43 @@ class GmailClient:
             print(f"Failed to add label to message {message_id}: {e}")
             return False
 
+    def modify_messages(self, message_ids: List[str], add: Optional[List[str]] = None,
+                        remove: Optional[List[str]] = None) -> bool:
+        """
+        Voeg labels toe aan / verwijder labels van meerdere berichten via batchModify.
+        Labels worden op naam opgegeven (systeemlabels zoals 'INBOX' werken ook);
+        ontbrekende labels in `add` worden aangemaakt.
+        Archiveren + labelen van N berichten kost zo één call i.p.v. 3N.
+        """
+        if not message_ids or not (add or remove):
+            return True
+        try:
+            add_ids = [self._label_id(name) for name in (add or [])]
+            remove_ids = [i for i in (self._label_id(name, create=False) for name in (remove or [])) if i]
+            body: Dict[str, Any] = {}
+            if add_ids:
+                body['addLabelIds'] = add_ids
+            if remove_ids:
+                body['removeLabelIds'] = remove_ids
+            for start in range(0, len(message_ids), MODIFY_BATCH_SIZE):
+                self._service().users().messages().batchModify(
+                    userId=self.user_id,
+                    body={'ids': message_ids[start:start + MODIFY_BATCH_SIZE], **body}
+                ).execute()
+            return True
+        except Exception as e:
+            if MODIFY_SCOPE not in (getattr(self.creds, "scopes", None) or []):
+                log.error("Gmail: %d bericht(en) niet gelabeld/gearchiveerd: token mist de scope %s "
+                          "(zet hem in SCOPES en verwijder het token om opnieuw in te loggen)",
+                          len(message_ids), MODIFY_SCOPE)
+            else:
+                log.error("Gmail: %d bericht(en) niet gelabeld/gearchiveerd: %s", len(message_ids), e)
+            return False
+
     def trash_message(self, message_id: str) -> bool:
         """Move message to trash"""
         try:
-            service = self._service()
-            service.users().messages().trash(
+            self._service().users().messages().trash(
                 userId=self.user_id,
                 id=message_id
             ).execute()
@@ -0,0 +1,74 @@
+# brikx/json_stream.py
+import json
+from typing import Any, Dict
+
+
+class IncrementalJSONFields:
+    """
+    Incrementele parser voor een JSON-object dat in stukjes binnenkomt (bijv. een LLM-stream).
+    feed() retourneert de top-level velden die sinds de vorige aanroep compleet zijn geworden;
+    een veld is compleet zodra de bijbehorende ',' of afsluitende '}' binnen is.
+    Tekst vóór de eerste '{' (zoals ```json) wordt genegeerd.
+
+      p = IncrementalJSONFields()
+      p.feed('{"available": fal')   # -> {}
+      p.feed('se, "title": "X"')    # -> {"available": False}
+      p.feed('}')                   # -> {"title": "X"}
+    """
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._pair_start = None  # index in _buf waar het huidige key/value paar begint
+
+    def feed(self, chunk: str) -> Dict[str, Any]:
+        new: Dict[str, Any] = {}
+        if self.done or not chunk:
+            return new
+        self._buf += chunk
+        buf = self._buf
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._pair_start = i + 1
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete_pair(buf[self._pair_start:i], new)
+                    self.done = True
+                    i += 1
+                    break
+            elif ch == "," and self._depth == 1:
+                self._complete_pair(buf[self._pair_start:i], new)
+                self._pair_start = i + 1
+            i += 1
+        self._pos = i
+        return new
+
+    def _complete_pair(self, segment: str, new: Dict[str, Any]) -> None:
+        if not segment.strip():
+            return
+        try:
+            pair = json.loads("{" + segment + "}")
+        except ValueError:
+            return  # onvolledig/ongeldig paar: laat de eindparse het oplossen
+        self.fields.update(pair)
+        new.update(pair)
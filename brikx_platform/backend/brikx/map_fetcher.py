@@ -1,11 +1,23 @@
 ﻿import os
+import json
 import time
 import logging
+import tempfile
+import threading
 import requests
 from urllib.parse import quote
 
+from .geocode import cached_lookup
+
 log = logging.getLogger("brikx.map")
 
+MAP_STYLE = "osm-bright"
+MAX_DOWNLOAD_BYTES = int(os.getenv("BRIKX_MAX_DOWNLOAD_BYTES", str(10 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+_SESSION: requests.Session | None = None
+_SESSION_LOCK = threading.Lock()
+
 def _parse_size(size: str) -> tuple[int, int]:
     try:
         w, h = size.lower().split("x")
@@ -13,21 +25,107 @@ def _parse_size(size: str) -> tuple[int, int]:
     except Exception:
         return 800, 500
 
-def _download_url(url: str, out_path: str) -> str | None:
-    headers = {
-        "User-Agent": "BrikxBot/0.1 (+contact)",
-        "Accept": "image/png,image/*;q=0.8,*/*;q=0.5",
-    }
-    r = requests.get(url, headers=headers, timeout=30)
-    if r.status_code != 200:
+def _session() -> requests.Session:
+    """Gedeelde Session met connection pool (ook gebruikt door de tile renderer threads)."""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            s = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            s.headers.update({
+                "User-Agent": "BrikxBot/0.1 (+contact)",
+                "Accept": "image/png,image/*;q=0.8,*/*;q=0.5",
+            })
+            _SESSION = s
+        return _SESSION
+
+def _meta_path(out_path: str) -> str:
+    return out_path + ".meta.json"
+
+def _read_meta(out_path: str) -> dict:
+    try:
+        with open(_meta_path(out_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_meta(out_path: str, meta: dict) -> None:
+    tmp = _meta_path(out_path) + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, _meta_path(out_path))
+    except OSError as e:
+        log.debug("Kon meta voor %s niet schrijven: %s", out_path, e)
+
+def _download_url(
+    url: str,
+    out_path: str,
+    max_bytes: int = MAX_DOWNLOAD_BYTES,
+    revalidate: bool = True,
+) -> str | None:
+    """
+    Download url gestreamd naar out_path (tempfile + atomische rename).
+    - Weigert responses groter dan max_bytes (Content-Length én daadwerkelijk gelezen bytes)
+    - Bestaat out_path al en zijn er ETag/Last-Modified bekend (sidecar .meta.json),
+      dan wordt conditioneel gevraagd; bij 304 blijft het bestaande bestand staan
+    """
+    headers = {}
+    if revalidate and os.path.isfile(out_path) and os.path.getsize(out_path) > 0:
+        meta = _read_meta(out_path)
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with _session().get(url, headers=headers, timeout=30, stream=True) as r:
+        if r.status_code == 304:
+            # Alleen geldig als wij conditioneel vroegen en de cache er (nog) staat
+            if headers and os.path.isfile(out_path) and os.path.getsize(out_path) > 0:
+                log.debug("Niet gewijzigd (304): %s", out_path)
+                os.utime(out_path)
+                return out_path
+            raise requests.HTTPError(f"Onverwachte 304 zonder bruikbare cache: {url}", response=r)
+        if r.status_code != 200:
+            try:
+                log.debug("Geoapify response text: %s", r.text[:500])
+            except Exception:
+                pass
+        r.raise_for_status()
+
+        length = r.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise ValueError(f"Response te groot ({length} bytes > {max_bytes}): {url}")
+
+        out_dir = os.path.dirname(out_path) or "."
+        os.makedirs(out_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=out_dir, prefix=".dl-", suffix=".part")
         try:
-            log.debug("Geoapify response text: %s", r.text[:500])
-        except Exception:
-            pass
-    r.raise_for_status()
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    with open(out_path, "wb") as f:
-        f.write(r.content)
+            written = 0
+            with os.fdopen(fd, "wb") as f:
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > max_bytes:
+                        raise ValueError(f"Response te groot (> {max_bytes} bytes): {url}")
+                    f.write(chunk)
+            # mkstemp maakt 0600; kaarten worden o.a. vanuit public/maps geserveerd
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, out_path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+        meta = {k: v for k, v in (("etag", r.headers.get("ETag")),
+                                  ("last_modified", r.headers.get("Last-Modified"))) if v}
+        if meta:
+            _write_meta(out_path, meta)
+        elif os.path.exists(_meta_path(out_path)):
+            os.remove(_meta_path(out_path))
     return out_path
 
 def download_static_map(
@@ -38,8 +136,11 @@ def download_static_map(
     out_path: str = "map.png",
 ) -> str | None:
     """
-    Maakt een statische kaart via Geoapify met een marker.
+    Maakt een statische kaart met een marker.
     
+    - Standaard lokaal samengesteld uit gecachte tiles (zie tile_renderer);
+      BRIKX_MAP_RENDERER=static forceert de Geoapify static map API
+    - Valt terug op de Geoapify static map API als de tile renderer faalt
     - API key via env: GEOAPIFY_API_KEY
     - Gebruikt marker parameter (eenvoudiger en betrouwbaarder dan geometry)
     - Fallback naar kaart zonder marker als marker faalt
@@ -53,13 +154,22 @@ def download_static_map(
         log.debug("lat/lon zijn (0,0) → sla kaart over.")
         return None
 
+    if os.getenv("BRIKX_MAP_RENDERER", "tiles").lower() != "static":
+        try:
+            from .tile_renderer import render_static_map
+            path = render_static_map(lat, lon, size=size, zoom=zoom, out_path=out_path, style=MAP_STYLE)
+            if path:
+                return path
+        except Exception as e:
+            log.warning("Tile renderer mislukt, val terug op Geoapify static map: %s", e)
+
     api_key = os.getenv("GEOAPIFY_API_KEY")
     if not api_key:
         log.warning("Geen kaartprovider (GEOAPIFY_API_KEY niet gezet). Kaart wordt overgeslagen.")
         return None
 
     w, h = _parse_size(size)
-    style = "osm-bright"
+    style = MAP_STYLE
     base = "https://maps.geoapify.com/v1/staticmap"
     
     # Optie 1: Probeer met marker parameter (eenvoudigste methode)
@@ -100,9 +210,10 @@ def download_static_map(
 
     return None
 
-def geocode_address(address: str) -> tuple[float, float] | None:
+def geocode_address(address: str, use_cache: bool = True) -> tuple[float, float] | None:
     """
     Zoekt coördinaten bij een adres via Geoapify.
+    Resultaten (ook "niet gevonden") worden gecachet in de gedeelde geocode-cache.
     """
     api_key = os.getenv("GEOAPIFY_API_KEY")
     if not api_key:
@@ -110,20 +221,26 @@ def geocode_address(address: str) -> tuple[float, float] | None:
         return None
         
     try:
-        url = "https://api.geoapify.com/v1/geocode/search"
-        params = {
-            "text": address,
-            "apiKey": api_key,
-            "limit": 1
-        }
-        r = requests.get(url, params=params, timeout=10)
-        r.raise_for_status()
-        data = r.json()
-        
-        if data.get("features"):
-            props = data["features"][0]["properties"]
-            return props.get("lat"), props.get("lon")
+        if use_cache:
+            return cached_lookup("geoapify", address, lambda: _geoapify_geocode(address, api_key))
+        return _geoapify_geocode(address, api_key)
     except Exception as e:
         log.error(f"Geocoding failed for '{address}': {e}")
         
     return None
+
+def _geoapify_geocode(address: str, api_key: str) -> tuple[float, float] | None:
+    url = "https://api.geoapify.com/v1/geocode/search"
+    params = {
+        "text": address,
+        "apiKey": api_key,
+        "limit": 1
+    }
+    r = requests.get(url, params=params, timeout=10)
+    r.raise_for_status()
+    data = r.json()
+    
+    if data.get("features"):
+        props = data["features"][0]["properties"]
+        return props.get("lat"), props.get("lon")
+    return None
@@ -0,0 +1,89 @@
+# brikx/map_store.py
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from .disk_cache import DiskCache, default_cache_dir, make_key
+from .map_fetcher import MAP_STYLE, download_static_map
+
+
+class MapStore:
+    """
+    Content-addressed opslag voor kaartafbeeldingen.
+    - Blob-key = hash van (lat, lon afgerond op 5 decimalen, zoom, size, style):
+      dezelfde locatie wordt maar één keer gedownload/gerenderd, ongeacht de naam
+    - Referenties (listing-ID -> blob) en uploads ((doel, blob) -> URL) staan in een
+      klein SQLite-index, zodat ook uploads naar Supabase/WordPress hergebruikt worden
+
+      store = MapStore("state/maps")
+      blob, path = store.get_or_render(lat, lon, ref_id=funda_id)
+      url = store.uploaded_url(blob, "supabase:maps") or upload(...)
+    """
+    def __init__(self, root: str | os.PathLike | None = None):
+        self.root = Path(root) if root else default_cache_dir() / "maps"
+        self.blobs = self.root / "blobs"
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self._index = DiskCache(self.root / "index.sqlite")
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    @staticmethod
+    def blob_key(lat: float, lon: float, zoom: int = 15, size: str = "800x500", style: str = MAP_STYLE) -> str:
+        return make_key("map", round(float(lat), 5), round(float(lon), 5), int(zoom), size.lower(), style)
+
+    def blob_path(self, key: str) -> Path:
+        return self.blobs / key[:2] / f"{key}.png"
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get_or_render(
+        self,
+        lat: float,
+        lon: float,
+        zoom: int = 15,
+        size: str = "800x500",
+        style: str = MAP_STYLE,
+        ref_id: str | None = None,
+    ) -> tuple[str, Path] | None:
+        """Retourneer (blob-key, pad); rendert/downloadt alleen als de blob nog niet bestaat."""
+        key = self.blob_key(lat, lon, zoom, size, style)
+        path = self.blob_path(key)
+        with self._lock_for(key):
+            if not path.exists():
+                if not download_static_map(lat, lon, size=size, zoom=zoom, out_path=str(path)):
+                    return None
+        if ref_id:
+            self.add_ref(ref_id, key)
+        return key, path
+
+    # ---- referenties ----
+    def add_ref(self, ref_id: str, key: str) -> None:
+        self._index.set(f"ref:{ref_id}", key)
+
+    def blob_for(self, ref_id: str) -> str | None:
+        return self._index.get(f"ref:{ref_id}")
+
+    # ---- uploads ----
+    def uploaded_url(self, key: str, target: str) -> str | None:
+        return self._index.get(f"upload:{target}:{key}")
+
+    def record_upload(self, key: str, target: str, url: str) -> None:
+        self._index.set(f"upload:{target}:{key}", url)
+
+    def materialize(self, key: str, dest: str | os.PathLike) -> Path:
+        """Zet een kopie (of hardlink) van de blob op een vaste plek, bijv. public/maps/<id>.png."""
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        src = self.blob_path(key)
+        tmp = dest.with_name(dest.name + ".tmp")
+        try:
+            if tmp.exists():
+                tmp.unlink()
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+        return dest
@@ -0,0 +1,99 @@
+# brikx/media_registry.py
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+
+from .disk_cache import DiskCache, default_cache_dir, make_key
+
+log = logging.getLogger("brikx.media")
+
+# Tekstvelden van een attachment die per listing verschillen
+TEXT_FIELDS = ("alt_text", "caption")
+
+
+def file_digest(path: str | os.PathLike) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class MediaRegistry:
+    """
+    Persistente registry (site, content-hash) -> WordPress media ID.
+    - Dezelfde PNG wordt per site maar één keer geüpload, ook over runs heen
+    - verify=True: een bekend ID wordt (één keer per proces) gecontroleerd met een GET;
+      is de attachment in WordPress verwijderd, dan volgt een nieuwe upload
+    - Bij hergebruik worden afwijkende alt_text/caption op de attachment bijgewerkt; posts
+      die dezelfde kaart delen tonen dus de alt/caption van de laatst gepubliceerde listing
+
+      registry = MediaRegistry()
+      media = registry.upload(wp, "state/maps/blobs/ab/ab12.png", title="Kaart Utrecht")
+    """
+    def __init__(self, path: str | os.PathLike | None = None, verify: bool = True):
+        self.path = Path(path) if path else default_cache_dir() / "wp_media.sqlite"
+        self.verify = verify
+        self._index = DiskCache(self.path)
+        self._verified: set[str] = set()
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    @staticmethod
+    def key(site: str, digest: str) -> str:
+        return make_key("wp-media", site.rstrip("/"), digest)
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def lookup(self, site: str, digest: str) -> dict | None:
+        return self._index.get(self.key(site, digest))
+
+    def record(self, site: str, digest: str, media: dict, **fields) -> None:
+        entry = {"id": media.get("id"), "source_url": media.get("source_url")}
+        entry.update({k: v for k, v in fields.items() if k in TEXT_FIELDS})
+        self._index.set(self.key(site, digest), entry)
+
+    def forget(self, site: str, digest: str) -> None:
+        self._index.delete(self.key(site, digest))
+
+    def upload(self, wp, file_path: str | os.PathLike, **upload_kwargs) -> dict:
+        """Media {'id', 'source_url'} voor dit bestand op deze site; uploadt alleen als hij nog onbekend is."""
+        digest = file_digest(file_path)
+        key = self.key(wp.base, digest)
+        with self._lock_for(key):
+            known = self._index.get(key)
+            if known and known.get("id"):
+                if not self.verify or key in self._verified:
+                    return self._reuse(wp, digest, known, upload_kwargs)
+                try:
+                    exists = wp.get_media(known["id"]) is not None
+                except Exception as e:
+                    # Controle mislukt (netwerk): liever hergebruiken dan dubbel uploaden
+                    log.debug("[%s] Media %s niet te controleren: %s", wp.base, known["id"], e)
+                    exists = True
+                if exists:
+                    self._verified.add(key)
+                    log.info("[%s] Bestaande media hergebruikt: id=%s", wp.base, known["id"])
+                    return self._reuse(wp, digest, known, upload_kwargs)
+                log.info("[%s] Media %s bestaat niet meer, opnieuw uploaden", wp.base, known["id"])
+                self.forget(wp.base, digest)
+
+            media = wp.upload_media(str(file_path), **upload_kwargs)
+            self.record(wp.base, digest, media, **upload_kwargs)
+            self._verified.add(key)
+            return {"id": media.get("id"), "source_url": media.get("source_url")}
+
+    def _reuse(self, wp, digest: str, known: dict, upload_kwargs: dict) -> dict:
+        """Hergebruik een bekende attachment; zet alt_text/caption van deze listing erop als ze afwijken."""
+        changed = {k: v for k, v in upload_kwargs.items() if k in TEXT_FIELDS and v and known.get(k) != v}
+        if changed:
+            try:
+                wp.update_media(known["id"], **changed)
+                self.record(wp.base, digest, known, **{**known, **changed})
+            except Exception as e:
+                log.warning("[%s] Alt/caption van media %s niet bijgewerkt: %s", wp.base, known["id"], e)
+        return {"id": known.get("id"), "source_url": known.get("source_url")}
@@ -0,0 +1,130 @@
+# brikx/perplexity_async.py
+import asyncio
+import logging
+
+import httpx
+
+from .disk_cache import DiskCache, MISSING
+from .perplexity_client import PerplexityBase, _parse_content
+from .ratelimit import TokenBucket, backoff_delay
+
+log = logging.getLogger("brikx.perplexity")
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class AsyncPerplexityClient(PerplexityBase):
+    """
+    Asyncio-variant van PerplexityClient voor het parallel verrijken van batches.
+    - Eén gedeelde HTTP/1.1 keep-alive pool (httpx)
+    - Token bucket limiter, afgestemd op de API tier (requests_per_minute)
+    - Retries op 429/5xx en netwerkfouten met jittered exponential backoff (Retry-After wordt gerespecteerd)
+
+    Gebruik:
+      async with AsyncPerplexityClient(api_key, requests_per_minute=50) as pplx:
+          results = await pplx.extract_many(urls)
+      # results: {url: dict | Exception}
+    """
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "sonar-pro",
+        timeout: float = 60,
+        requests_per_minute: float = 50,
+        max_concurrency: int = 5,
+        max_retries: int = 4,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+        cache: DiskCache | None = None,
+        limiter: TokenBucket | None = None,
+    ):
+        super().__init__(model=model, cache=cache)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = limiter or TokenBucket.per_minute(requests_per_minute)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=self.base,
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            },
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+
+    async def __aenter__(self) -> "AsyncPerplexityClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def _post_completion(self, payload: dict) -> dict:
+        attempt = 0
+        while True:
+            await self.limiter.acquire_async()
+            try:
+                async with self._semaphore:
+                    r = await self._client.post("/chat/completions", json=payload)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                log.warning("Perplexity netwerkfout (%s), retry %d over %.1fs", e, attempt + 1, delay)
+            else:
+                if r.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    r.raise_for_status()
+                    return r.json()
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                retry_after = r.headers.get("retry-after")
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+                log.warning("Perplexity HTTP %s, retry %d over %.1fs", r.status_code, attempt + 1, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _complete(self, key: str | None, payload: dict, refresh: bool) -> dict:
+        cached = self._cached(key, refresh)
+        if cached is not MISSING:
+            return cached
+        data = await self._post_completion(payload)
+        content = (data.get("choices") or [{}])[0].get("message", {}).get("content", "")
+        result = _parse_content(content)
+        self._store(key, result)
+        return result
+
+    async def extract_listing(self, url: str, description_text: str = "", refresh: bool = False) -> dict:
+        key = self._cache_key("listing", url, description_text) if self.cache else None
+        return await self._complete(key, self._listing_payload(url, description_text), refresh)
+
+    async def extract_facts(self, url: str, description_text: str = "", refresh: bool = False) -> dict:
+        key = self._cache_key("facts", url, description_text) if self.cache else None
+        return await self._complete(key, self._facts_payload(url, description_text), refresh)
+
+    async def generate_article(self, facts: dict, refresh: bool = False) -> dict:
+        key = self._article_cache_key(facts) if self.cache else None
+        return await self._complete(key, self._article_payload(facts), refresh)
+
+    async def extract_many(
+        self,
+        urls: list[str],
+        descriptions: dict[str, str] | None = None,
+        refresh: bool = False,
+        facts_only: bool = False,
+    ) -> dict[str, dict | Exception]:
+        """
+        Verrijk meerdere URLs parallel; per URL het resultaat of de opgetreden exception.
+        facts_only=True gebruikt extract_facts() (geen artikel).
+        """
+        descriptions = descriptions or {}
+        extract = self.extract_facts if facts_only else self.extract_listing
+        unique = list(dict.fromkeys(urls))
+        results = await asyncio.gather(
+            *(extract(u, descriptions.get(u, ""), refresh=refresh) for u in unique),
+            return_exceptions=True,
+        )
+        return dict(zip(unique, results))
@@ -1,51 +1,32 @@
+import hashlib
 import json
-import requests
+import re
 
-class PerplexityClient:
-    """
-    Haalt gestructureerde velden + een SEO-vriendelijk artikel op bij Perplexity.
-    Retourneert een dict met o.a.:
-      address, street, house_number, postal_code, place, province,
-      price, surface, description_short, summary_nl, article_nl,
-      goothoogte, nokhoogte, volume, regulations
-    """
-    def __init__(self, api_key: str, model: str = "sonar-pro", timeout: int = 60):
-        self.base = "https://api.perplexity.ai"
-        self.model = model
-        self.timeout = timeout
-        self.s = requests.Session()
-        self.s.headers.update({
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        })
+from typing import Any, Callable, Dict
 
-    def extract_listing(self, url: str, description_text: str = "") -> dict:
-        system = (
-            "Je bent een senior SEO-copywriter voor Architectenbureau Jules Zwijsen. "
-            "Jules Zwijsen is een ervaren architect die particuliere bouwers begeleidt van de eerste schets tot de sleuteloverdracht. "
-            "Je schrijft uitgebreide, hoogwaardige 'Pillar Content' over bouwkavels die de lezer informeert én motiveert om contact op te nemen. "
-            "Je doel is om organisch verkeer te trekken (SEO) én vertrouwen te wekken door de rol van Jules Zwijsen als begeleider centraal te stellen."
-        )
+import requests
 
-        # We vragen om STRIKT JSON – geen extra tekst.
-        user = f"""
-Bezoek en lees de pagina:
-{url}
+from .disk_cache import DiskCache, MISSING, make_key
+from .json_stream import IncrementalJSONFields
+from .state_store import normalize_url
 
-Hier is de volledige omschrijving van de pagina (gebruik dit als primaire bron voor details):
----
-{description_text}
----
+# Verhoog bij elke inhoudelijke wijziging van de prompt; oude cache-entries worden dan genegeerd
+PROMPT_VERSION = 1
 
-Taken:
-1) **Analyse & Feiten**: Extraheer alle harde feiten (adres, prijs, m², bouwregels, bestemmingsplan details).
+SYSTEM_COPYWRITER = (
+    "Je bent een senior SEO-copywriter voor Architectenbureau Jules Zwijsen. "
+    "Jules Zwijsen is een ervaren architect die particuliere bouwers begeleidt van de eerste schets tot de sleuteloverdracht. "
+    "Je schrijft uitgebreide, hoogwaardige 'Pillar Content' over bouwkavels die de lezer informeert én motiveert om contact op te nemen. "
+    "Je doel is om organisch verkeer te trekken (SEO) én vertrouwen te wekken door de rol van Jules Zwijsen als begeleider centraal te stellen."
+)
 
-2) **SEO Strategie**:
-   - Bepaal het beste **Focus Keyword** (bijv. "Bouwkavel [Plaats]", "Villa bouwen [Plaats]" of "Architect bouwkavel [Plaats]").
-   - Bedenk een **SEO Titel** die begint met het focus keyword en vertrouwen wekt (bijv. "Architect Begeleidt u bij...", "Van Kavel tot Droomhuis in...").
+SYSTEM_ANALYST = (
+    "Je bent een nauwkeurige vastgoedanalist. "
+    "Je leest een bouwkavel-advertentie en geeft uitsluitend de harde feiten terug als JSON, zonder verdere tekst."
+)
 
-3) **Schrijf het Artikel (HTML)** - FOCUS OP BEGELEIDING DOOR JULES ZWIJSEN:
-   - **Lengte**: Minimaal **800 woorden** voor autoriteit en SEO.
+# Schrijfopdracht voor het artikel; gedeeld door de gecombineerde prompt en generate_article()
+ARTICLE_BRIEF = """   - **Lengte**: Minimaal **800 woorden** voor autoriteit en SEO.
    - **Structuur**:
      - **Intro (100 woorden)**:
        * Gebruik focus keyword in eerste zin
@@ -93,7 +74,115 @@ Taken:
 
    - **Toon**: Persoonlijk (ik/mijn), toegankelijk, deskundig maar niet afstandelijk
    - **Keyword Dichtheid**: Focus keyword 8-12 keer (natuurlijk verwerkt)
-   - **Extra Keywords**: "architect bouwkavel", "begeleiding nieuwbouw", "bouwvergunning", "bestemmingsplan"
+   - **Extra Keywords**: "architect bouwkavel", "begeleiding nieuwbouw", "bouwvergunning", "bestemmingsplan\""""
+
+# Signalen dat een kavel niet meer te koop is (titel/samenvatting)
+UNAVAILABLE_PHRASES = [
+    'niet meer beschikbaar',
+    'niet gevonden',
+    'pagina niet gevonden',
+    'verkocht',
+    'verwijderd',
+    'offline gehaald',
+    'geen resultaten',
+]
+
+
+def unavailable_reason(data: dict) -> str | None:
+    """
+    Retourneer waarom een kavel niet meer beschikbaar lijkt (of None).
+    Kijkt naar het expliciete 'available'-veld van extract_facts() en naar
+    UNAVAILABLE_PHRASES in titel, samenvatting en (legacy) artikel.
+    """
+    available = data.get("available")
+    if available is False or str(available).strip().lower() in ("false", "nee", "no", "0"):
+        return data.get("unavailable_reason") or "niet meer beschikbaar"
+    for field in ("title", "summary_nl", "article_nl"):
+        text = (data.get(field) or "")
+        if not isinstance(text, str):
+            continue
+        text = text.lower()
+        for phrase in UNAVAILABLE_PHRASES:
+            if phrase in text:
+                return phrase
+    return None
+
+
+def _parse_content(content: str) -> dict:
+    """Haal het JSON-object uit het antwoord van het model."""
+    # Strip markdown code blocks if present (```json ... ``` or ``` ... ```)
+    # Probeer JSON te vinden in de output (ook als er tekst omheen staat)
+    json_match = re.search(r'\{.*\}', content, re.DOTALL)
+    if json_match:
+        content = json_match.group(0)
+    elif content and "```" in content:
+         # Fallback voor code blocks als regex faalt
+         parts = content.split("```")
+         for p in parts:
+             if p.strip().startswith("json"):
+                 content = p.strip()[4:].strip()
+                 break
+             elif p.strip().startswith("{"):
+                 content = p.strip()
+                 break
+
+    try:
+        return json.loads(content) if content else {}
+    except Exception as e:
+        # Fallback: geef ruwe tekst terug in één veld, zodat app niet crasht
+        return {"article_nl": content or None, "error": str(e)}
+
+
+class PerplexityBase:
+    """
+    Gedeelde prompt- en cachelogica voor de sync en async Perplexity clients.
+    Retourneert een dict met o.a.:
+      address, street, house_number, postal_code, place, province,
+      price, surface, description_short, summary_nl, article_nl,
+      goothoogte, nokhoogte, volume, regulations
+    """
+    base = "https://api.perplexity.ai"
+
+    def __init__(self, model: str = "sonar-pro", cache: DiskCache | None = None):
+        self.model = model
+        self.cache = cache
+
+    def _cache_key(self, kind: str, url: str, description_text: str) -> str:
+        desc_hash = hashlib.sha256((description_text or "").encode("utf-8")).hexdigest()
+        return make_key(kind, normalize_url(url), self.model, PROMPT_VERSION, desc_hash)
+
+    def _cached(self, key: str | None, refresh: bool):
+        if key and not refresh:
+            return self.cache.get(key, MISSING)
+        return MISSING
+
+    def _store(self, key: str | None, result: dict) -> None:
+        # Alleen geslaagde parses cachen; een kapot antwoord moet opnieuw geprobeerd worden
+        if key and "error" not in result:
+            self.cache.set(key, result)
+
+    def _listing_payload(self, url: str, description_text: str) -> dict:
+        system = SYSTEM_COPYWRITER
+
+        # We vragen om STRIKT JSON – geen extra tekst.
+        user = f"""
+Bezoek en lees de pagina:
+{url}
+
+Hier is de volledige omschrijving van de pagina (gebruik dit als primaire bron voor details):
+---
+{description_text}
+---
+
+Taken:
+1) **Analyse & Feiten**: Extraheer alle harde feiten (adres, prijs, m², bouwregels, bestemmingsplan details).
+
+2) **SEO Strategie**:
+   - Bepaal het beste **Focus Keyword** (bijv. "Bouwkavel [Plaats]", "Villa bouwen [Plaats]" of "Architect bouwkavel [Plaats]").
+   - Bedenk een **SEO Titel** die begint met het focus keyword en vertrouwen wekt (bijv. "Architect Begeleidt u bij...", "Van Kavel tot Droomhuis in...").
+
+3) **Schrijf het Artikel (HTML)** - FOCUS OP BEGELEIDING DOOR JULES ZWIJSEN:
+{ARTICLE_BRIEF}
 
 4) **Output**:
    Retourneer STRIKT JSON.
@@ -130,30 +219,196 @@ Retourneer STRIKT JSON met exact deze velden:
                 {"role": "user", "content": user.strip()},
             ],
         }
+        return payload
+
+    def _facts_payload(self, url: str, description_text: str) -> dict:
+        # 'available' staat bewust vooraan: bij streaming is de beschikbaarheid dan als eerste bekend
+        user = f"""
+Bezoek en lees de pagina:
+{url}
+
+Hier is de volledige omschrijving van de pagina (gebruik dit als primaire bron voor details):
+---
+{description_text}
+---
+
+Taken:
+1) Bepaal of de kavel nog te koop is. Is de pagina verkocht, verwijderd, offline of niet gevonden, zet dan "available" op false.
+2) Extraheer alle harde feiten (adres, prijs, m², bouwregels, bestemmingsplan details).
+3) Bepaal het beste **Focus Keyword** (bijv. "Bouwkavel [Plaats]") en een SEO titel die daarmee begint.
+4) Schrijf GEEN artikel.
+
+Retourneer STRIKT JSON met exact deze velden, in deze volgorde:
+{{
+  "available": boolean,
+  "unavailable_reason": string|null,
+  "title": "De geoptimaliseerde SEO titel",
+  "summary_nl": string|null,
+  "focus_keyword": "Het gekozen focus keyword",
+  "seo_description": "Meta description met focus keyword (max 155 tekens)",
+  "address": string|null,
+  "street": string|null,
+  "house_number": string|null,
+  "postal_code": string|null,
+  "place": string|null,
+  "province": string|null,
+  "price": string|null,
+  "surface": string|null,
+  "description_short": string|null,
+  "goothoogte": number|null,
+  "nokhoogte": number|null,
+  "volume": number|null,
+  "regulations": string|null
+}}
+"""
+        return {
+            "model": self.model,
+            "temperature": 0.1,
+            "top_p": 0.9,
+            "messages": [
+                {"role": "system", "content": SYSTEM_ANALYST},
+                {"role": "user", "content": user.strip()},
+            ],
+        }
+
+    def _article_payload(self, facts: dict) -> dict:
+        facts_json = json.dumps(
+            {k: v for k, v in facts.items() if k not in ("article_nl", "error")},
+            ensure_ascii=False, indent=2,
+        )
+        user = f"""
+Hier zijn de gecontroleerde feiten van een bouwkavel (JSON):
+{facts_json}
+
+Gebruik het focus keyword en de titel uit de feiten (of verbeter ze) en schrijf het artikel (HTML) - FOCUS OP BEGELEIDING DOOR JULES ZWIJSEN:
+{ARTICLE_BRIEF}
+
+Retourneer STRIKT JSON met exact deze velden:
+{{
+  "title": "De geoptimaliseerde SEO titel",
+  "focus_keyword": "Het gekozen focus keyword",
+  "seo_description": "Meta description met focus keyword (max 155 tekens)",
+  "article_nl": "De volledige HTML content (800+ woorden, met hoofdstuk over begeleiding door Jules Zwijsen)"
+}}
+"""
+        return {
+            "model": self.model,
+            "temperature": 0.3,
+            "top_p": 0.9,
+            "messages": [
+                {"role": "system", "content": SYSTEM_COPYWRITER},
+                {"role": "user", "content": user.strip()},
+            ],
+        }
+
+    def _article_cache_key(self, facts: dict) -> str:
+        return make_key("article", self.model, PROMPT_VERSION,
+                        {k: v for k, v in facts.items() if k not in ("article_nl", "error")})
+
+
+class PerplexityClient(PerplexityBase):
+    """
+    Haalt gestructureerde velden + een SEO-vriendelijk artikel op bij Perplexity
+    (blokkerend, één request tegelijk). Zie AsyncPerplexityClient voor batches.
+
+    Twee stappen (goedkoop):
+      facts = pplx.extract_facts(url)            # feiten + 'available', geen artikel
+      if not unavailable_reason(facts):
+          article = pplx.generate_article(facts)  # lazy, bijv. bij publiceren
+    extract_listing() doet beide in één call (legacy).
+    """
+    def __init__(self, api_key: str, model: str = "sonar-pro", timeout: int = 60, cache: DiskCache | None = None):
+        super().__init__(model=model, cache=cache)
+        self.timeout = timeout
+        self.s = requests.Session()
+        self.s.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        })
+
+    def _complete(self, key: str | None, payload: dict, refresh: bool) -> dict:
+        cached = self._cached(key, refresh)
+        if cached is not MISSING:
+            return cached
         r = self.s.post(f"{self.base}/chat/completions", json=payload, timeout=self.timeout)
         r.raise_for_status()
         data = r.json()
         content = (data.get("choices") or [{}])[0].get("message", {}).get("content", "")
-        
-        # Strip markdown code blocks if present (```json ... ``` or ``` ... ```)
-        # Probeer JSON te vinden in de output (ook als er tekst omheen staat)
-        import re
-        json_match = re.search(r'\{.*\}', content, re.DOTALL)
-        if json_match:
-            content = json_match.group(0)
-        elif content and "```" in content:
-             # Fallback voor code blocks als regex faalt
-             parts = content.split("```")
-             for p in parts:
-                 if p.strip().startswith("json"):
-                     content = p.strip()[4:].strip()
-                     break
-                 elif p.strip().startswith("{"):
-                     content = p.strip()
-                     break
-        
-        try:
-            return json.loads(content) if content else {}
-        except Exception as e:
-            # Fallback: geef ruwe tekst terug in één veld, zodat app niet crasht
-            return {"article_nl": content or None, "error": str(e)}
+        result = _parse_content(content)
+        self._store(key, result)
+        return result
+
+    def extract_listing(self, url: str, description_text: str = "", refresh: bool = False) -> dict:
+        """
+        Feiten + volledig artikel in één (trage, dure) call.
+        Resultaten worden (indien een cache is ingesteld) op schijf bewaard per
+        genormaliseerde URL, model, promptversie en omschrijving;
+        refresh=True slaat de cache over en overschrijft de entry.
+        """
+        key = self._cache_key("listing", url, description_text) if self.cache else None
+        return self._complete(key, self._listing_payload(url, description_text), refresh)
+
+    def extract_facts(self, url: str, description_text: str = "", refresh: bool = False) -> dict:
+        """
+        Snelle eerste stap: alleen gestructureerde velden + 'available' verdict, geen artikel.
+        Gebruik unavailable_reason() om verkochte/verwijderde kavels over te slaan.
+        """
+        key = self._cache_key("facts", url, description_text) if self.cache else None
+        return self._complete(key, self._facts_payload(url, description_text), refresh)
+
+    def stream_facts(
+        self,
+        url: str,
+        description_text: str = "",
+        should_abort: Callable[[Dict[str, Any]], bool] | None = None,
+        refresh: bool = False,
+    ) -> dict:
+        """
+        Als extract_facts(), maar via de SSE token stream. Velden worden incrementeel
+        geparsed; na elk compleet veld wordt should_abort(velden_tot_nu_toe) aangeroepen.
+        Geeft die True terug, dan wordt de request direct afgebroken en komen de
+        gedeeltelijke velden terug met "aborted": True (niet gecachet).
+        Handig om verkochte kavels af te kappen zodra 'available'/'title' binnen is.
+        """
+        key = self._cache_key("facts", url, description_text) if self.cache else None
+        cached = self._cached(key, refresh)
+        if cached is not MISSING:
+            return cached
+
+        payload = {**self._facts_payload(url, description_text), "stream": True}
+        parser = IncrementalJSONFields()
+        content = ""
+        with self.s.post(f"{self.base}/chat/completions", json=payload, timeout=self.timeout, stream=True) as r:
+            r.raise_for_status()
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    choice = (json.loads(data).get("choices") or [{}])[0]
+                except ValueError:
+                    continue
+                delta = (choice.get("delta") or {}).get("content")
+                if delta is None:
+                    # Sommige chunks bevatten de cumulatieve tekst i.p.v. een delta
+                    full = (choice.get("message") or {}).get("content") or ""
+                    delta = full[len(content):] if full.startswith(content) else ""
+                if not delta:
+                    continue
+                content += delta
+                if parser.feed(delta) and should_abort and should_abort(parser.fields):
+                    return {**parser.fields, "aborted": True}
+
+        result = _parse_content(content)
+        self._store(key, result)
+        return result
+
+    def generate_article(self, facts: dict, refresh: bool = False) -> dict:
+        """
+        Tweede stap (lazy, bijv. bij publiceren): artikel op basis van extract_facts().
+        Retourneert title, focus_keyword, seo_description en article_nl.
+        """
+        key = self._article_cache_key(facts) if self.cache else None
+        return self._complete(key, self._article_payload(facts), refresh)
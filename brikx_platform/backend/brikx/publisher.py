@@ -2,6 +2,8 @@
 import os
 import logging
 import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urlparse, urlparse as _up, urlencode as _urlencode, urlunparse as _urlunparse, parse_qs as _parse_qs
 
@@ -11,18 +13,17 @@ import yaml
 from .gmail_client import GmailClient
 from .state_store import StateStore, extract_funda_id, normalize_url
 from .wordpress_client import WordPressClient
-from .map_fetcher import download_static_map
-from .geocode import geocode_place
-from .funda_parser import parse_funda
+from .map_store import MapStore
+from .media_registry import MediaRegistry
+from .geocoder import Geocoder
+from .disk_cache import DiskCache
 
-try:
-    from .perplexity_client import PerplexityClient
-except Exception:
-    PerplexityClient = None
+# funda_parser (bs4/lxml) en perplexity_client worden pas geladen als die stap aan staat
 
 log = logging.getLogger("brikx.publisher")
 
 TITLE_PREFIX = "Nieuwe bouwgrond te koop: "
+SITE_TIMEOUT = 180  # deadline in seconden per site per listing, gecontroleerd tussen requests (override: wordpress_sites[].timeout_seconds)
 
 
 # --------------------------
@@ -171,6 +172,92 @@ def _resolve_categories(wp: WordPressClient, cats):
             out.append(wp.ensure_category(str(c)))
     return out
 
+def _publish_to_site(wp: WordPressClient, site: dict, title: str, content: str,
+                     featured_media_file: str | None, meta: dict, funda_id: str | None,
+                     media_registry: MediaRegistry | None = None, deadline: float | None = None) -> bool | None:
+    """
+    Publiceer één listing naar één site (draait in een eigen thread).
+    True als de post is aangemaakt, False als er zeker niets is geplaatst, None als dat
+    onbekend is (create_post request verliep zonder antwoord). Elke request is begrensd
+    door de HTTP timeouts van WordPressClient; de deadline (time.monotonic) wordt tussen
+    de stappen gecontroleerd, zodat er na de deadline niets meer gestart wordt.
+    """
+    base = wp.base
+    status = site.get("status", "draft")
+
+    def expired(step: str) -> bool:
+        if deadline is not None and time.monotonic() > deadline:
+            log.warning("[%s] Deadline verstreken vóór %s, site telt als mislukt", base, step)
+            return True
+        return False
+
+    try:
+        me = wp.whoami()
+        log.info("[%s] Ingelogd als: %s (id=%s)", base, me.get("name") or me.get("slug"), me.get("id"))
+    except Exception as e:
+        log.warning("[%s] Inloggen mislukt, sla site over: %s", base, e)
+        return False
+
+    # --------- DEDUPE LAAG 2: WordPress (DISABLED - meta_query werkt niet betrouwbaar) ----------
+    # WordPress meta_query geeft altijd dezelfde post terug ongeacht funda_id
+    # We vertrouwen alleen op processed.json voor deduplicatie
+    # if funda_id:
+    #     try:
+    #         existing = wp.find_post_by_funda_id(funda_id)
+    #         if existing:
+    #             log.info("[%s] Skip: funda_id %s bestaat al (post %s)", base, funda_id, existing.get("id"))
+    #             return True  # we beschouwen dit als 'al aanwezig'
+    #     except Exception as e:
+    #         log.debug("[%s] WP dedupe check niet gelukt: %s", base, e)
+
+    # Categorieën
+    if expired("categorieën"):
+        return False
+    cats_cfg = site.get("category_ids") or site.get("category_names")
+    if not cats_cfg:
+        if "zwijsen.net" in base:
+            cats_cfg = ["vrije kavel"]
+        else:
+            cats_cfg = ["Bouwgrond"]
+    cats = _resolve_categories(wp, cats_cfg)
+
+    # Media upload
+    featured_id = None
+    if featured_media_file and not expired("media upload"):
+        try:
+            media_title = f"Kaart – {meta.get('place') or ''}".strip()
+            if media_registry:
+                media = media_registry.upload(wp, featured_media_file, title=media_title)
+            else:
+                media = wp.upload_media(featured_media_file, title=media_title)
+            featured_id = media.get("id")
+            log.info("[%s] Kaart beschikbaar: media id=%s", base, featured_id)
+        except Exception as e:
+            log.warning("[%s] Upload media mislukt: %s", base, e)
+
+    # Posten
+    if expired("posten"):
+        return False
+    try:
+        # Als jouw WP meta ondersteunt, geef funda_id mee; anders laat meta weg.
+        post = wp.create_post(
+            title=title,
+            content=content,
+            status=status,
+            categories=cats,
+            featured_media=featured_id,
+            meta={"funda_id": funda_id} if funda_id else None,
+        )
+        log.info("[%s] Post aangemaakt: id=%s link=%s", base, post.get("id"), post.get("link"))
+        return True
+    except (requests.Timeout, requests.ConnectionError) as e:
+        # Request is mogelijk wel verwerkt: niet als "niet geplaatst" behandelen
+        log.warning("[%s] Geen antwoord op posten, post is mogelijk aangemaakt: %s", base, e)
+        return None
+    except Exception as e:
+        log.warning("[%s] Posten mislukt: %s", base, e)
+        return False
+
 # --------------------------
 # Google Sheet webhook
 # --------------------------
@@ -224,17 +311,52 @@ def run_pipeline(cfg: dict):
     messages = gmail.search_messages(query=query, max_results=10)
     log.info("Gevonden Gmail-berichten: %s", len(messages))
 
-    store = StateStore(str(state_file))
+    # Claims zodat parallelle pipelines niet dubbel publiceren. Marks van overgeslagen
+    # listings worden gebufferd (flush_every); een mark na publiceren gaat direct naar schijf
+    state_cfg = cfg.get("state", {}) or {}
+    store = StateStore(
+        str(state_file),
+        flush_every=int(state_cfg.get("flush_every", 20)),
+        bloom=bool(state_cfg.get("bloom")),
+    )
+    try:
+        _run_messages(cfg, gmail, messages, store, artifacts, content_cfg, sites, webhook_cfg)
+    finally:
+        store.close()
+
+
+def _run_messages(cfg: dict, gmail: GmailClient, messages: list, store: StateStore, artifacts: Path,
+                  content_cfg: dict, sites: list, webhook_cfg: dict | None):
 
     ppl_cfg = cfg.get("perplexity", {}) or {}
     pplx = None
-    if ppl_cfg.get("enabled") and PerplexityClient:
+    if ppl_cfg.get("enabled"):
         try:
-            pplx = PerplexityClient(api_key=ppl_cfg.get("api_key"), model=ppl_cfg.get("model", "sonar-pro"))
+            from .perplexity_client import PerplexityClient, unavailable_reason
+            cache = None
+            if ppl_cfg.get("cache_file"):
+                cache = DiskCache(
+                    ppl_cfg["cache_file"],
+                    ttl=float(ppl_cfg.get("cache_ttl_days", 30)) * 86400,
+                    max_entries=int(ppl_cfg.get("cache_max_entries", 5000)),
+                )
+            pplx = PerplexityClient(api_key=ppl_cfg.get("api_key"), model=ppl_cfg.get("model", "sonar-pro"), cache=cache)
             log.info("Perplexity ingeschakeld met model: %s", pplx.model)
         except Exception as e:
             log.warning("Perplexity uitgeschakeld: %s", e)
 
+    geo_cfg = cfg.get("geocoding", {}) or {}
+    geocoder = Geocoder(providers=geo_cfg.get("providers"), index_path=geo_cfg.get("index_file"))
+
+    # Kaarten content-addressed onder output_dir: dezelfde locatie wordt niet opnieuw gedownload
+    map_store = MapStore(artifacts)
+
+    # Eén WordPressClient per site voor de hele run: sessie, whoami en categorieën blijven gecachet
+    wp_clients: dict[str, WordPressClient] = {}
+    # (site, content-hash) -> media ID: dezelfde kaart wordt per site één keer geüpload
+    state_cfg = cfg.get("state", {}) or {}
+    media_registry = MediaRegistry(state_cfg.get("media_registry"))
+
     size = cfg.get("maps", {}).get("size", "800x500")
     zoom = int(cfg.get("maps", {}).get("zoom", 15))
 
@@ -254,23 +376,41 @@ def run_pipeline(cfg: dict):
                 except Exception:
                     pass
                 continue
+            if store.is_unverified(url, funda_id):
+                log.warning("Skip (eerdere publicatie onbekend, eerst nakijken: python -m brikx --list-unverified): %s", url)
+                continue
+            if not store.claim(url, funda_id):
+                log.info("Skip (in behandeling door een andere pipeline): %s", url)
+                continue
 
             # --------- Verrijking (Perplexity of Funda parser) ----------
             enrich = None
             if pplx:
                 try:
-                    enrich = pplx.extract_listing(url_raw)
+                    # Stap 1: alleen feiten; het artikel volgt pas vlak voor publiceren
+                    enrich = pplx.extract_facts(url_raw, refresh=bool(ppl_cfg.get("refresh")))
                     for k in ("title","street","house_number","postal_code","place","province","address",
-                              "price","surface","description_short","summary_nl","article_nl"):
+                              "price","surface","description_short","summary_nl"):
                         if enrich.get(k):
                             meta[k] = enrich[k]
                 except Exception as e:
                     log.warning("Perplexity verrijking mislukt voor %s: %s", url_raw, e)
 
+                reason = unavailable_reason(enrich or {})
+                if reason:
+                    log.info("Skip (niet beschikbaar: %s): %s", reason, url)
+                    try:
+                        post_to_google_sheet(meta, meta.get("url"), webhook_cfg, status="verkocht")
+                    except Exception:
+                        pass
+                    store.mark_processed(url, funda_id)
+                    continue
+
             # Use Funda parser as fallback if Perplexity didn't provide address/province
             if not meta.get("address") or not meta.get("province"):
                 try:
                     log.info("Gebruik Funda parser als fallback voor %s", url_raw)
+                    from .funda_parser import parse_funda
                     funda_data = parse_funda(url_raw)
                     for k in ("title","street","house_number","postal_code","place","province","address","price","surface"):
                         if funda_data.get(k) and not meta.get(k):
@@ -311,7 +451,7 @@ def run_pipeline(cfg: dict):
                 if q:
                     q = _normalize_geocode_query(q)
                     try:
-                        latlon = geocode_place(q)
+                        latlon = geocoder.geocode(q, postcode=meta.get("postal_code"), place=meta.get("place"))
                         if latlon:
                             lat, lon = latlon
 
@@ -321,95 +461,79 @@ def run_pipeline(cfg: dict):
             # --------- Kaart ----------
             featured_media_file = None
             if lat is not None and lon is not None:
-                map_path = artifacts / f"map_{lat:.5f}_{lon:.5f}.png"
                 try:
-                    dl_path = download_static_map(lat, lon, size=size, zoom=zoom, out_path=str(map_path))
+                    stored = map_store.get_or_render(lat, lon, zoom=zoom, size=size, ref_id=funda_id or url)
+                    dl_path = str(stored[1]) if stored else None
                     if dl_path and os.path.exists(dl_path):
                         featured_media_file = dl_path
-                        log.info("Kaart gedownload: %s", dl_path)
+                        log.info("Kaart beschikbaar: %s", dl_path)
                     else:
                         log.warning("Kaart download overslagen of mislukt (geen provider/geen bestand).")
                 except Exception as e:
                     log.warning("Kaart genereren mislukt: %s", e)
 
+            # --------- Artikel (stap 2, alleen voor beschikbare kavels) ----------
+            if pplx and enrich and "error" not in enrich:
+                try:
+                    article = pplx.generate_article(enrich, refresh=bool(ppl_cfg.get("refresh")))
+                    if article.get("article_nl") and "error" not in article:
+                        meta["article_nl"] = article["article_nl"]
+                except Exception as e:
+                    log.warning("Artikel genereren mislukt voor %s: %s", url_raw, e)
+
             # --------- Content ----------
             content = _render_content(meta, content_cfg)
 
             # --------- Publiceren naar sites ----------
+            # Sites publiceren parallel; een trage of falende site houdt de andere niet op.
+            # Elke site stopt zelf bij zijn deadline, dus we wachten alle threads af: een
+            # achtergelaten thread zou na de deadline alsnog kunnen posten.
             posted_any = False
-            for site in sites:
-                base = site["base_url"].rstrip("/")
-                user = site["username"]
-                app_pw = site["application_password"]
-                status = site.get("status", "draft")
-                wp = WordPressClient(base, user, app_pw)
-
-                try:
-                    me = wp.whoami()
-                    log.info("[%s] Ingelogd als: %s (id=%s)", base, me.get("name") or me.get("slug"), me.get("id"))
-                except Exception as e:
-                    log.warning("[%s] Inloggen mislukt, sla site over: %s", base, e)
-                    continue
-
-                # --------- DEDUPE LAAG 2: WordPress (DISABLED - meta_query werkt niet betrouwbaar) ----------
-                # WordPress meta_query geeft altijd dezelfde post terug ongeacht funda_id
-                # We vertrouwen alleen op processed.json voor deduplicatie
-                # if funda_id:
-                #     try:
-                #         existing = wp.find_post_by_funda_id(funda_id)
-                #         if existing:
-                #             log.info("[%s] Skip: funda_id %s bestaat al (post %s)", base, funda_id, existing.get("id"))
-                #             posted_any = True  # we beschouwen dit als 'al aanwezig'
-                #             continue
-                #     except Exception as e:
-                #         log.debug("[%s] WP dedupe check niet gelukt: %s", base, e)
-
-                # Categorieën
-                cats_cfg = site.get("category_ids") or site.get("category_names")
-                if not cats_cfg:
-                    if "zwijsen.net" in base:
-                        cats_cfg = ["vrije kavel"]
-                    else:
-                        cats_cfg = ["Bouwgrond"]
-                cats = _resolve_categories(wp, cats_cfg)
-
-                # Media upload
-                featured_id = None
-                if featured_media_file:
+            unknown = False
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=max(1, len(sites)), thread_name_prefix="wp") as site_pool:
+                jobs = []
+                for site in sites:
+                    base = site["base_url"].rstrip("/")
+                    wp = wp_clients.get(base)
+                    if wp is None:
+                        wp = wp_clients[base] = WordPressClient(base, site["username"], site["application_password"])
+                    deadline = started + float(site.get("timeout_seconds", SITE_TIMEOUT))
+                    jobs.append((base, site_pool.submit(
+                        _publish_to_site, wp, site, title, content, featured_media_file, meta, funda_id,
+                        media_registry, deadline)))
+
+                for base, job in jobs:
                     try:
-                        media = wp.upload_media(featured_media_file, title=f"Kaart – {meta.get('place') or ''}".strip())
-                        featured_id = media.get("id")
-                        log.info("[%s] Kaart geüpload: media id=%s", base, featured_id)
+                        result = job.result()
                     except Exception as e:
-                        log.warning("[%s] Upload media mislukt: %s", base, e)
-
-                # Posten
-                try:
-                    # Als jouw WP meta ondersteunt, geef funda_id mee; anders laat meta weg.
-                    post = wp.create_post(
-                        title=title,
-                        content=content,
-                        status=status,
-                        categories=cats,
-                        featured_media=featured_id,
-                        meta={"funda_id": funda_id} if funda_id else None,
-                    )
-                    log.info("[%s] Post aangemaakt: id=%s link=%s", base, post.get("id"), post.get("link"))
-                    posted_any = True
-                except Exception as e:
-                    log.warning("[%s] Posten mislukt: %s", base, e)
+                        log.warning("[%s] Publiceren mislukt: %s", base, e)
+                        continue
+                    if result:
+                        posted_any = True
+                    elif result is None:
+                        unknown = True
 
             # --------- Sheet log ----------
+            sheet_status = "actief" if posted_any else ("onbekend" if unknown else "mislukt")
             try:
                 funda_for_sheet = _apply_utm(meta.get("url"), content_cfg) or meta.get("url")
-                post_to_google_sheet(meta, funda_for_sheet, webhook_cfg, status="actief" if posted_any else "mislukt")
+                post_to_google_sheet(meta, funda_for_sheet, webhook_cfg, status=sheet_status)
             except Exception:
                 pass
 
             # --------- Markeer verwerkt (URL + ID) ----------
             if posted_any:
+                # Direct wegschrijven: bij een crash mag een live post niet opnieuw gepubliceerd worden
                 store.mark_processed(url, funda_id)
+                store.flush()
+            elif unknown:
+                # Mogelijk toch geplaatst: blijvend blokkeren tot iemand WordPress heeft nagekeken
+                store.mark_unverified(url, funda_id)
+                log.warning("Publicatie onbekend (mogelijk geplaatst), listing geblokkeerd tot controle; "
+                            "zie python -m brikx --list-unverified: %s", url)
             else:
+                store.release(url, funda_id)
                 log.warning("Publicatie mislukte op alle sites; URL wordt niet als verwerkt gemarkeerd: %s", url)
 
 
@@ -457,10 +581,21 @@ def run_sync(config_path: str | os.PathLike | None = None, log_level: str | None
         maps_cfg["output_dir"] = _resolve_path(maps_cfg["output_dir"])
         cfg["maps"] = maps_cfg
 
+    geo_cfg = cfg.get("geocoding") or {}
+    if geo_cfg.get("index_file"):
+        geo_cfg["index_file"] = _resolve_path(geo_cfg["index_file"])
+        cfg["geocoding"] = geo_cfg
+
+    ppl_cfg = cfg.get("perplexity") or {}
+    if ppl_cfg.get("cache_file"):
+        ppl_cfg["cache_file"] = _resolve_path(ppl_cfg["cache_file"])
+        cfg["perplexity"] = ppl_cfg
+
     state_cfg = cfg.get("state") or {}
-    if state_cfg.get("processed_store"):
-        state_cfg["processed_store"] = _resolve_path(state_cfg["processed_store"])
-        cfg["state"] = state_cfg
+    for key in ("processed_store", "media_registry"):
+        if state_cfg.get(key):
+            state_cfg[key] = _resolve_path(state_cfg[key])
+            cfg["state"] = state_cfg
 
     level = _configure_logging(cfg, override_level=log_level)
     log.info("Brikx sync gestart (level=%s)", logging.getLevelName(level))
@@ -0,0 +1,55 @@
+# brikx/ratelimit.py
+import asyncio
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter: `rate` tokens per seconde, maximaal `capacity` op voorraad.
+    Bruikbaar vanuit threads (acquire) en vanuit asyncio (acquire_async); een instantie
+    kan proces-breed gedeeld worden.
+    """
+    def __init__(self, rate: float, capacity: float | None = None):
+        if rate <= 0:
+            raise ValueError("rate moet > 0 zijn")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute: float, burst: float | None = None) -> "TokenBucket":
+        return cls(requests_per_minute / 60.0, burst if burst is not None else 1.0)
+
+    def _take(self) -> float:
+        """Neem een token; retourneert 0 bij succes of het aantal seconden tot er één vrij is."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return 0.0
+            return (1.0 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Exponentiële backoff met 'full jitter' (attempt telt vanaf 0)."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
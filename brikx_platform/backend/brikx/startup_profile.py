@@ -0,0 +1,71 @@
+# brikx/startup_profile.py
+"""
+Importtijd per module meten (--profile-startup in `python -m brikx` en sync_worker.py).
+Vergelijkbaar met `python -X importtime`, maar als korte tabel van de duurste modules.
+
+    profiler = ImportProfiler().start()
+    import zware_module
+    print(profiler.report())
+"""
+import builtins
+import importlib.util
+import sys
+import threading
+import time
+
+
+class ImportProfiler:
+    def __init__(self):
+        self.timings: dict[str, list[float]] = {}  # module -> [inclusief, eigen tijd] in seconden
+        self._local = threading.local()
+        self._orig_import = None
+        self._started = 0.0
+
+    def start(self) -> "ImportProfiler":
+        if self._orig_import is None:
+            self._orig_import = builtins.__import__
+            self._started = time.perf_counter()
+            builtins.__import__ = self._import
+        return self
+
+    def stop(self) -> None:
+        if self._orig_import is not None:
+            builtins.__import__ = self._orig_import
+            self._orig_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        full = name
+        if level:
+            try:
+                full = importlib.util.resolve_name("." * level + name, (globals or {}).get("__package__"))
+            except (ImportError, ValueError):
+                full = name
+        if not full or full in sys.modules:
+            return self._orig_import(name, globals, locals, fromlist, level)
+
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)  # tijd van geneste imports
+        t0 = time.perf_counter()
+        try:
+            return self._orig_import(name, globals, locals, fromlist, level)
+        finally:
+            total = time.perf_counter() - t0
+            children = stack.pop()
+            if stack:
+                stack[-1] += total
+            rec = self.timings.setdefault(full, [0.0, 0.0])
+            rec[0] += total
+            rec[1] += total - children
+
+    def report(self, limit: int = 25) -> str:
+        elapsed = time.perf_counter() - self._started
+        own = sum(t[1] for t in self.timings.values())
+        lines = [
+            f"Startup profile: {len(self.timings)} modules, {own * 1000:.0f} ms importeren "
+            f"van {elapsed * 1000:.0f} ms sinds start",
+            f"{'cumulatief':>12} {'eigen':>10}  module",
+        ]
+        ranked = sorted(self.timings.items(), key=lambda kv: kv[1][0], reverse=True)
+        for name, (total, self_time) in ranked[:limit]:
+            lines.append(f"{total * 1000:>9.1f} ms {self_time * 1000:>7.1f} ms  {name}")
+        return "\n".join(lines)
@@ -1,10 +1,23 @@
 ﻿# brikx/state_store.py
 import json
+import logging
 import os
 import re
-from typing import Set, Optional
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
 from urllib.parse import urlparse, urlunparse
 
+from .bloom import BloomFilter
+
+log = logging.getLogger("brikx.state")
+
+CLAIM_TTL = 3600          # seconden; claims van gecrashte processen verlopen vanzelf
+BUSY_TIMEOUT_MS = 30000
+
 # --- helpers die publisher.py nu importeert ---
 FUNDA_ID_RE = re.compile(r"/(\d{6,})/?$")
 
@@ -28,56 +41,193 @@ def normalize_url(u: str) -> str:
     out = urlunparse(p2)
     return out[:-1] if out.endswith("/") else out
 
-# --- JSON store (backwards compatible) ---
+# --- SQLite store (zelfde API als de oude JSON store) ---
 class StateStore:
     """
-    JSON-gebaseerde store.
-    - Bewaart genormaliseerde URL's in 'processed_urls'
-    - (Nieuw) Bewaart Funda-ID's in 'processed_ids' (optioneel)
+    SQLite-gebaseerde store (WAL mode), drop-in voor de oude JSON store.
+    - Bewaart genormaliseerde URL's in tabel 'processed_urls'
+    - Bewaart Funda-ID's in tabel 'processed_ids'
+    - Lookups en marks zijn geïndexeerd (primary key) i.p.v. lineair over een JSON-lijst
     - Backwards compat: is_processed(url) en mark_processed(url)
+    - Wijst path naar een .json bestand (oude config), dan staat de database ernaast
+      als .sqlite en wordt de JSON eenmalig gemigreerd (het JSON-bestand blijft staan)
+    - flush_every: marks worden gebufferd en per N (of bij flush()/close()/einde van
+      een with-blok) in één transactie weggeschreven; 1 = direct (oude gedrag)
+    - claim()/release(): voorkomt dat parallelle pipelines dezelfde listing oppakken
+    - mark_unverified(): uitkomst onbekend (post mogelijk geplaatst); de listing wordt
+      niet meer geclaimd tot resolve_unverified() hem als geplaatst of mislukt afhandelt
+    - bloom=True: Bloom filter (<db>.bloom) voor is_processed_*; een miss slaat de
+      database-lookup over zolang de versie in de database gelijk is aan die van het
+      filter. Heeft een ander proces intussen geschreven, dan valt een miss terug op de
+      database (herbouwen gebeurt bij het laden); claim() raadpleegt altijd de database
+
+      with StateStore("state/processed.json", flush_every=20) as store:
+          if store.claim(url, funda_id):
+              ...
+              store.mark_processed(url, funda_id)
     """
-    def __init__(self, path: str):
+    def __init__(self, path: str, flush_every: int = 1, claim_ttl: float = CLAIM_TTL, bloom: bool = False):
         self.path = path
-        self._data = {"processed_urls": [], "processed_ids": []}
-        self._load()
+        self.flush_every = max(1, int(flush_every))
+        self.claim_ttl = claim_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._pending_urls: set[str] = set()
+        self._pending_ids: set[str] = set()
+        self._pending_marks = 0
+        root, ext = os.path.splitext(path)
+        self.db_path = root + ".sqlite" if ext.lower() == ".json" else path
+        self.legacy_path = root + ".json"
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # Andere processen die schrijven: wachten i.p.v. direct "database is locked"
+        self._db.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        self._db.execute("CREATE TABLE IF NOT EXISTS processed_urls (url TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE IF NOT EXISTS processed_ids (listing_id TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS claims (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pending_verification "
+            "(key TEXT PRIMARY KEY, url TEXT NOT NULL, listing_id TEXT, created_at REAL NOT NULL)"
+        )
+        self._migrate_json()
+        self.bloom: BloomFilter | None = None
+        self._bloom_version: int | None = None
+        if bloom:
+            self._load_bloom()
 
-    def _load(self):
-        if os.path.exists(self.path):
+    def _migrate_json(self):
+        if not os.path.exists(self.legacy_path):
+            return
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone():
+                return
             try:
-                self._data = json.load(open(self.path, "r", encoding="utf-8"))
-                if "processed_ids" not in self._data:
-                    self._data["processed_ids"] = []
+                data = json.load(open(self.legacy_path, "r", encoding="utf-8"))
             except Exception:
-                self._data = {"processed_urls": [], "processed_ids": []}
+                data = {}
+            urls = [normalize_url(u) for u in data.get("processed_urls", []) if u]
+            ids = [str(i) for i in data.get("processed_ids", []) if i]
+
+            def write():
+                self._db.executemany("INSERT OR IGNORE INTO processed_urls (url) VALUES (?)", [(u,) for u in urls])
+                self._db.executemany("INSERT OR IGNORE INTO processed_ids (listing_id) VALUES (?)", [(i,) for i in ids])
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_json', ?)", (self.legacy_path,))
+                self._bump_version()
+
+            self._transaction(write)
+        log.info("processed.json gemigreerd naar %s (%d URL's, %d ID's)", self.db_path, len(urls), len(ids))
+
+    # ---- Versie (telt elke schrijfactie, ook van andere processen) ----
+    def _bump_version(self) -> int:
+        """Verhoog de versie binnen de lopende transactie en geef de nieuwe waarde terug."""
+        self._db.execute(
+            "INSERT INTO meta (key, value) VALUES ('version', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+        return self._version()
+
+    def _version(self) -> int:
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return int(row[0]) if row else 0
+
+    # ---- Bloom filter ----
+    @property
+    def bloom_path(self) -> str:
+        return self.db_path + ".bloom"
 
-    def _save(self):
-        os.makedirs(os.path.dirname(self.path), exist_ok=True)
-        with open(self.path, "w", encoding="utf-8") as f:
-            json.dump(self._data, f, ensure_ascii=False, indent=2)
+    def _load_bloom(self):
+        with self._lock:
+            version = self._version()
+            bf = BloomFilter.load(self.bloom_path)
+            if bf is None or bf.meta.get("version") != version or bf.saturated:
+                urls = [f"url:{r[0]}" for r in self._db.execute("SELECT url FROM processed_urls")]
+                ids = [f"id:{r[0]}" for r in self._db.execute("SELECT listing_id FROM processed_ids")]
+                bf = BloomFilter.build([*urls, *ids])
+                log.info("Bloom filter opnieuw opgebouwd: %d items", len(bf))
+            self.bloom = bf
+            self._bloom_version = version
+
+    def _save_bloom(self):
+        """Alleen opslaan als het filter alle schrijfacties tot nu toe bevat."""
+        if self.bloom is None:
+            return
+        if self._bloom_version is not None and self._bloom_version == self._version():
+            self.bloom.meta["version"] = self._bloom_version
+            self.bloom.save(self.bloom_path)
+        else:
+            log.debug("Database gewijzigd door een ander proces; bloom filter wordt volgende keer herbouwd")
+        log.info("Bloom filter: %s", self.bloom.stats())
+
+    def _bloom_lookup(self, key: str, table: str, column: str, value: str) -> bool:
+        if self.bloom is not None:
+            if key not in self.bloom:
+                with self._lock:
+                    current = self._bloom_version is not None and self._bloom_version == self._version()
+                if current:
+                    return False
+                # Ander proces heeft geschreven: het filter kan deze key missen
+                present = self._exists(table, column, value)
+                if present:
+                    with self._lock:
+                        self.bloom.add(key)
+                return present
+            present = self._exists(table, column, value)
+            self.bloom.observe(present)
+            return present
+        return self._exists(table, column, value)
+
+    def _exists(self, table: str, column: str, value: str) -> bool:
+        with self._lock:
+            return self._db.execute(f"SELECT 1 FROM {table} WHERE {column} = ?", (value,)).fetchone() is not None
+
+    def _transaction(self, fn):
+        """Voer fn() uit binnen BEGIN IMMEDIATE (schrijflock) ... COMMIT; aanroepen met self._lock."""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn()
+            self._db.execute("COMMIT")
+            return result
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _claim_keys(url: str, listing_id: Optional[str]) -> list[str]:
+        keys = [f"url:{normalize_url(url)}"]
+        if listing_id:
+            keys.append(f"id:{listing_id}")
+        return keys
 
     # ---- URL-based ----
     def is_processed_url(self, url: str) -> bool:
         norm = normalize_url(url)
-        return norm in set(self._data.get("processed_urls", []))
+        return norm in self._pending_urls or self._bloom_lookup(f"url:{norm}", "processed_urls", "url", norm)
 
     def mark_processed_url(self, url: str):
-        norm = normalize_url(url)
-        s: Set[str] = set(self._data.get("processed_urls", []))
-        s.add(norm)
-        self._data["processed_urls"] = sorted(s)
+        with self._lock:
+            self._pending_urls.add(normalize_url(url))
+        self._after_mark()
 
     # ---- ID-based (Funda) ----
     def is_processed_id(self, listing_id: Optional[str]) -> bool:
         if not listing_id:
             return False
-        return listing_id in set(self._data.get("processed_ids", []))
+        listing_id = str(listing_id)
+        return listing_id in self._pending_ids or self._bloom_lookup(
+            f"id:{listing_id}", "processed_ids", "listing_id", listing_id
+        )
 
     def mark_processed_id(self, listing_id: Optional[str]):
         if not listing_id:
             return
-        s: Set[str] = set(self._data.get("processed_ids", []))
-        s.add(listing_id)
-        self._data["processed_ids"] = sorted(s)
+        with self._lock:
+            self._pending_ids.add(str(listing_id))
+        self._after_mark()
 
     # ---- Backwards compatible API ----
     def is_processed(self, url: str) -> bool:
@@ -85,8 +235,160 @@ class StateStore:
         return self.is_processed_url(url)
 
     def mark_processed(self, url: str, listing_id: Optional[str] = None):
-        # oude methode + uitbreiding: markeer URL én optioneel Funda-ID
-        self.mark_processed_url(url)
-        if listing_id:
-            self.mark_processed_id(listing_id)
-        self._save()
+        # oude methode + uitbreiding: markeer URL én optioneel Funda-ID (samen geflusht)
+        with self._lock:
+            self._pending_urls.add(normalize_url(url))
+            if listing_id:
+                self._pending_ids.add(str(listing_id))
+        self._after_mark()
+
+    # ---- Batching ----
+    def _after_mark(self):
+        with self._lock:
+            self._pending_marks += 1
+            due = self._pending_marks >= self.flush_every
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Schrijf gebufferde marks in één transactie weg en geef de bijbehorende claims vrij."""
+        with self._lock:
+            if not self._pending_urls and not self._pending_ids:
+                self._pending_marks = 0
+                return
+            urls, ids = sorted(self._pending_urls), sorted(self._pending_ids)
+            keys = [f"url:{u}" for u in urls] + [f"id:{i}" for i in ids]
+
+            def write():
+                self._db.executemany("INSERT OR IGNORE INTO processed_urls (url) VALUES (?)", [(u,) for u in urls])
+                self._db.executemany("INSERT OR IGNORE INTO processed_ids (listing_id) VALUES (?)", [(i,) for i in ids])
+                self._db.executemany("DELETE FROM claims WHERE key = ? AND owner = ?", [(k, self.owner) for k in keys])
+                return self._bump_version()
+
+            version = self._transaction(write)
+            if self.bloom is not None:
+                self.bloom.add_many(keys)
+                # Nog consistent als niemand anders tussendoor schreef
+                if self._bloom_version is not None and version == self._bloom_version + 1:
+                    self._bloom_version = version
+                else:
+                    self._bloom_version = None
+            self._pending_urls.clear()
+            self._pending_ids.clear()
+            self._pending_marks = 0
+        log.debug("StateStore flush: %d URL's, %d ID's", len(urls), len(ids))
+
+    # ---- Cross-process dedupe ----
+    def claim(self, url: str, listing_id: Optional[str] = None) -> bool:
+        """
+        Reserveer een listing voor dit proces. False als hij al verwerkt is of door een
+        ander proces is geclaimd (en die claim nog niet verlopen is).
+        Een claim verdwijnt bij flush() van de mark, release(), of na claim_ttl seconden.
+        """
+        if self.is_processed_url(url) or self.is_processed_id(listing_id):
+            return False
+        keys = self._claim_keys(url, listing_id)
+        now = time.time()
+
+        def take():
+            norm = normalize_url(url)
+            if self._db.execute("SELECT 1 FROM processed_urls WHERE url = ?", (norm,)).fetchone():
+                return False
+            if listing_id and self._db.execute(
+                "SELECT 1 FROM processed_ids WHERE listing_id = ?", (str(listing_id),)
+            ).fetchone():
+                return False
+            marks = ",".join("?" * len(keys))
+            if self._db.execute(f"SELECT 1 FROM pending_verification WHERE key IN ({marks}) LIMIT 1", keys).fetchone():
+                return False
+            taken = self._db.execute(
+                f"SELECT 1 FROM claims WHERE key IN ({marks}) AND owner != ? AND expires_at > ? LIMIT 1",
+                (*keys, self.owner, now),
+            ).fetchone()
+            if taken:
+                return False
+            self._db.executemany(
+                "INSERT OR REPLACE INTO claims (key, owner, expires_at) VALUES (?, ?, ?)",
+                [(k, self.owner, now + self.claim_ttl) for k in keys],
+            )
+            return True
+
+        with self._lock:
+            return self._transaction(take)
+
+    def release(self, url: str, listing_id: Optional[str] = None):
+        """Geef een claim vrij zonder te markeren (bijv. als publiceren mislukte)."""
+        keys = self._claim_keys(url, listing_id)
+        with self._lock:
+            self._transaction(lambda: self._db.executemany(
+                "DELETE FROM claims WHERE key = ? AND owner = ?", [(k, self.owner) for k in keys]
+            ))
+
+    def _release_all(self):
+        """Open claims van dit proces vrijgeven; onbekende uitkomsten staan in pending_verification en blijven."""
+        with self._lock:
+            self._transaction(lambda: self._db.execute("DELETE FROM claims WHERE owner = ?", (self.owner,)))
+
+    # ---- Onbekende uitkomst (mogelijk gepubliceerd) ----
+    def mark_unverified(self, url: str, listing_id: Optional[str] = None):
+        """
+        Publiceren gaf geen uitsluitsel (bijv. timeout op create_post): zet de claim om in een
+        blijvende blokkade, zodat geen enkele run de listing opnieuw publiceert tot hij is nagekeken.
+        """
+        keys = self._claim_keys(url, listing_id)
+        norm = normalize_url(url)
+        now = time.time()
+
+        def write():
+            self._db.executemany(
+                "INSERT OR REPLACE INTO pending_verification (key, url, listing_id, created_at) VALUES (?, ?, ?, ?)",
+                [(k, norm, str(listing_id) if listing_id else None, now) for k in keys],
+            )
+            self._db.executemany("DELETE FROM claims WHERE key = ? AND owner = ?", [(k, self.owner) for k in keys])
+
+        with self._lock:
+            self._transaction(write)
+
+    def is_unverified(self, url: str, listing_id: Optional[str] = None) -> bool:
+        keys = self._claim_keys(url, listing_id)
+        marks = ",".join("?" * len(keys))
+        with self._lock:
+            return self._db.execute(
+                f"SELECT 1 FROM pending_verification WHERE key IN ({marks}) LIMIT 1", keys
+            ).fetchone() is not None
+
+    def unverified(self) -> list[dict]:
+        """Listings met een onbekende uitkomst (oudste eerst), om in WordPress na te kijken."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT url, listing_id, MIN(created_at) FROM pending_verification GROUP BY url, listing_id ORDER BY 3"
+            ).fetchall()
+        return [{"url": url, "listing_id": listing_id, "since": created_at} for url, listing_id, created_at in rows]
+
+    def resolve_unverified(self, url: str, listing_id: Optional[str] = None, posted: bool = False):
+        """Na controle: posted=True markeert als verwerkt, anders mag een volgende run hem opnieuw proberen."""
+        keys = self._claim_keys(url, listing_id)
+        with self._lock:
+            self._transaction(lambda: self._db.executemany(
+                "DELETE FROM pending_verification WHERE key = ?", [(k,) for k in keys]
+            ))
+        if posted:
+            self.mark_processed(url, listing_id)
+            self.flush()
+
+    # ---- Lifecycle ----
+    def close(self):
+        try:
+            self.flush()
+            self._release_all()
+            with self._lock:
+                self._save_bloom()
+        finally:
+            with self._lock:
+                self._db.close()
+
+    def __enter__(self) -> "StateStore":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,121 @@
+# brikx/supabase_batch.py
+import logging
+import threading
+from typing import Any, Callable, Iterable
+
+log = logging.getLogger("brikx.supabase")
+
+
+class UpsertBuffer:
+    """
+    Write-behind buffer voor Supabase/PostgREST: verzamelt rijen en schrijft ze als
+    multi-row upserts (on_conflict=key, standaard ignore_duplicates -> idempotent).
+    - add() flusht automatisch per flush_every rijen; flush() expliciet per bericht/run
+    - Rijen met verschillende kolommen worden per kolomset gebatcht (PostgREST eist gelijke keys)
+    - Faalt een batch, dan wordt alleen die batch rij voor rij opnieuw geprobeerd
+    - on_written(rows) alleen voor rijen die PostgREST teruggeeft (echt ingevoegd/bijgewerkt);
+      keys van rijen die op een conflict genegeerd werden staan in .duplicates,
+      keys van definitief mislukte rijen in .failed
+
+      buffer = UpsertBuffer(supabase, "listings", key="kavel_id", flush_every=50)
+      buffer.add(row)
+      failed = buffer.flush()
+    """
+    def __init__(
+        self,
+        client,
+        table: str,
+        key: str = "kavel_id",
+        flush_every: int = 50,
+        ignore_duplicates: bool = True,
+        on_written: Callable[[list[dict[str, Any]]], None] | None = None,
+    ):
+        self.client = client
+        self.table = table
+        self.key = key
+        self.flush_every = max(1, int(flush_every))
+        self.ignore_duplicates = ignore_duplicates
+        self.on_written = on_written
+        self.failed: set[str] = set()
+        self.duplicates: set[str] = set()
+        self._rows: list[dict[str, Any]] = []
+        self._inflight: set[str] = set()
+        self._lock = threading.Lock()        # beschermt _rows/_inflight
+        self._flush_lock = threading.Lock()  # één flush tegelijk
+
+    def add(self, row: dict[str, Any]) -> None:
+        with self._lock:
+            self._rows.append(row)
+            due = len(self._rows) >= self.flush_every
+        if due:
+            self.flush()
+
+    def is_pending(self, key_value: str) -> bool:
+        """Staat deze key nog in de buffer (of wordt hij op dit moment geschreven)?"""
+        with self._lock:
+            return key_value in self._inflight or any(str(r.get(self.key)) == key_value for r in self._rows)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self) -> set[str]:
+        """Schrijf alle gebufferde rijen weg; retourneert de keys die (ook na retry) mislukten."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                self._inflight = {str(r.get(self.key)) for r in rows}
+            if not rows:
+                return set()
+            try:
+                written, duplicates, failed = self._write_grouped(rows)
+            finally:
+                with self._lock:
+                    self._inflight = set()
+        self.failed.update(failed)
+        self.duplicates.update(duplicates)
+        if written and self.on_written:
+            self.on_written(written)
+        log.info("Supabase %s: %d rij(en) weggeschreven in batch, %d bestonden al, %d mislukt",
+                 self.table, len(written), len(duplicates), len(failed))
+        return failed
+
+    def _write_grouped(self, rows: Iterable[dict[str, Any]]) -> tuple[list[dict[str, Any]], set[str], set[str]]:
+        groups: dict[tuple[str, ...], list[dict[str, Any]]] = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        written: list[dict[str, Any]] = []
+        duplicates: set[str] = set()
+        failed: set[str] = set()
+
+        def split(batch, returned):
+            for row in batch:
+                if str(row.get(self.key)) in returned:
+                    written.append(row)
+                else:
+                    duplicates.add(str(row.get(self.key)))
+
+        for batch in groups.values():
+            try:
+                split(batch, self._upsert(batch))
+                continue
+            except Exception as e:
+                if len(batch) == 1:
+                    log.error("Supabase upsert mislukt voor %s: %s", batch[0].get(self.key), e)
+                    failed.add(str(batch[0].get(self.key)))
+                    continue
+                log.warning("Batch upsert van %d rijen mislukt (%s), per rij opnieuw", len(batch), e)
+            for row in batch:
+                try:
+                    split([row], self._upsert([row]))
+                except Exception as e:
+                    log.error("Supabase upsert mislukt voor %s: %s", row.get(self.key), e)
+                    failed.add(str(row.get(self.key)))
+        return written, duplicates, failed
+
+    def _upsert(self, rows: list[dict[str, Any]]) -> set[str]:
+        """Upsert met returning=representation; retourneert de keys die PostgREST terugstuurt."""
+        result = self.client.table(self.table).upsert(
+            rows, on_conflict=self.key, ignore_duplicates=self.ignore_duplicates, returning="representation"
+        ).execute()
+        return {str(r.get(self.key)) for r in (result.data or [])}
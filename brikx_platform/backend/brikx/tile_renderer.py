@@ -0,0 +1,138 @@
+# brikx/tile_renderer.py
+"""
+Lokale kaartrenderer: haalt 256px (OSM-stijl) tiles op, cachet ze op schijf en
+stelt daar zelf de statische kaart + marker uit samen met Pillow.
+Buurkavels hergebruiken dezelfde tiles, dus na opwarmen is kaartgeneratie
+vrijwel netwerkvrij.
+
+Tile-bron: env BRIKX_TILE_URL (bijv. "http://localhost:8080/{z}/{x}/{y}.png" voor een
+lokale tile server) of anders de Geoapify tile API met GEOAPIFY_API_KEY.
+"""
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+from .disk_cache import default_cache_dir
+from .map_fetcher import _download_url, _parse_size
+
+log = logging.getLogger("brikx.map")
+
+TILE_SIZE = 256
+GEOAPIFY_TILE_URL = "https://maps.geoapify.com/v1/tile/{style}/{z}/{x}/{y}.png?apiKey={api_key}"
+MARKER_COLOR = (255, 111, 0)  # #ff6f00, gelijk aan de Geoapify marker
+ATTRIBUTION = "© OpenStreetMap contributors"
+# Tiles ouder dan dit worden conditioneel (ETag/If-Modified-Since) opnieuw gevalideerd
+TILE_MAX_AGE = float(os.getenv("BRIKX_TILE_MAX_AGE_DAYS", "30")) * 86400
+
+
+def tile_url_template(style: str = "osm-bright") -> str | None:
+    tpl = os.getenv("BRIKX_TILE_URL")
+    if tpl:
+        return tpl
+    api_key = os.getenv("GEOAPIFY_API_KEY")
+    if api_key:
+        return GEOAPIFY_TILE_URL.replace("{style}", style).replace("{api_key}", api_key)
+    return None
+
+
+def tile_cache_dir() -> Path:
+    env = os.getenv("BRIKX_TILE_CACHE")
+    return Path(env) if env else default_cache_dir() / "tiles"
+
+
+def _to_pixel(lat: float, lon: float, zoom: int) -> tuple[float, float]:
+    """WGS84 -> globale Web Mercator pixelcoördinaten op dit zoomniveau."""
+    scale = TILE_SIZE * (2 ** zoom)
+    x = (lon + 180.0) / 360.0 * scale
+    lat_rad = math.radians(max(min(lat, 85.05112878), -85.05112878))
+    y = (1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * scale
+    return x, y
+
+
+def _fetch_tile(template: str, cache_root: Path, style: str, z: int, x: int, y: int) -> Path | None:
+    path = cache_root / style / str(z) / str(x) / f"{y}.png"
+    cached = path.exists()
+    if cached and time.time() - path.stat().st_mtime < TILE_MAX_AGE:
+        return path
+    url = template.replace("{z}", str(z)).replace("{x}", str(x)).replace("{y}", str(y))
+    try:
+        _download_url(url, str(path))
+        return path
+    except Exception as e:
+        if cached:
+            log.debug("Tile %s/%s/%s revalideren mislukt, gebruik cache: %s", z, x, y, e)
+            return path
+        log.warning("Tile %s/%s/%s ophalen mislukt: %s", z, x, y, e)
+        return None
+
+
+def _draw_marker(draw: ImageDraw.ImageDraw, cx: float, cy: float) -> None:
+    """Pin-marker met de punt op (cx, cy)."""
+    r = 11
+    head_y = cy - 24
+    draw.polygon([(cx - r * 0.8, head_y + r * 0.5), (cx + r * 0.8, head_y + r * 0.5), (cx, cy)],
+                 fill=MARKER_COLOR, outline=(255, 255, 255))
+    draw.ellipse([cx - r, head_y - r, cx + r, head_y + r], fill=MARKER_COLOR, outline=(255, 255, 255), width=2)
+    draw.ellipse([cx - 4, head_y - 4, cx + 4, head_y + 4], fill=(255, 255, 255))
+
+
+def render_static_map(
+    lat: float,
+    lon: float,
+    size: str = "800x500",
+    zoom: int = 15,
+    out_path: str = "map.png",
+    style: str = "osm-bright",
+    tile_url: str | None = None,
+    cache_dir: str | os.PathLike | None = None,
+) -> str | None:
+    """
+    Stel een statische kaart samen uit (gecachte) tiles en teken de marker lokaal.
+    Retourneert out_path, of None als er geen tile-bron is of een tile ontbreekt: een kaart
+    met gaten zou in de MapStore gecachet en geüpload worden, dan liever de fallback.
+    """
+    template = tile_url or tile_url_template(style)
+    if not template:
+        log.debug("Geen tile-bron (BRIKX_TILE_URL/GEOAPIFY_API_KEY) → tile renderer overgeslagen.")
+        return None
+    cache_root = Path(cache_dir) if cache_dir else tile_cache_dir()
+
+    w, h = _parse_size(size)
+    cx, cy = _to_pixel(lat, lon, zoom)
+    left, top = cx - w / 2, cy - h / 2
+    n = 2 ** zoom
+
+    tiles = [
+        (tx, ty)
+        for tx in range(math.floor(left / TILE_SIZE), math.floor((left + w - 1) / TILE_SIZE) + 1)
+        for ty in range(math.floor(top / TILE_SIZE), math.floor((top + h - 1) / TILE_SIZE) + 1)
+        if 0 <= ty < n
+    ]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        paths = list(pool.map(lambda t: _fetch_tile(template, cache_root, style, zoom, t[0] % n, t[1]), tiles))
+    missing = sum(1 for path in paths if not path)
+    if missing:
+        log.warning("Kaart (%s, %s): %d van %d tiles ontbreken → tile renderer overgeslagen.", lat, lon, missing, len(tiles))
+        return None
+
+    canvas = Image.new("RGB", (w, h), (229, 227, 223))
+    for (tx, ty), path in zip(tiles, paths):
+        with Image.open(path) as tile:
+            canvas.paste(tile.convert("RGB"), (round(tx * TILE_SIZE - left), round(ty * TILE_SIZE - top)))
+
+    draw = ImageDraw.Draw(canvas)
+    _draw_marker(draw, w / 2, h / 2)
+    tw = draw.textlength(ATTRIBUTION)
+    draw.rectangle([w - tw - 8, h - 16, w, h], fill=(255, 255, 255))
+    draw.text((w - tw - 4, h - 14), ATTRIBUTION, fill=(60, 60, 60))
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tmp_path = f"{out_path}.tmp"
+    canvas.save(tmp_path, format="PNG", optimize=True)
+    os.replace(tmp_path, out_path)
+    return out_path
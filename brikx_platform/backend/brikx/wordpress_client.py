@@ -1,14 +1,25 @@
 # brikx/wordpress_client.py
 import os
+import re
 import mimetypes
+import threading
 import requests
 
 class WordPressClient:
+    """
+    REST client voor één WordPress site. Bedoeld om per run één keer aan te maken:
+    - whoami() wordt na de eerste geslaagde call gecachet
+    - categorie/tag naam->ID (en slug->ID) mappen worden één keer opgehaald en
+      bijgewerkt bij aanmaken; bij een term_exists conflict wordt de map opnieuw geladen
+    """
     def __init__(self, base_url: str, username: str, application_password: str):
         self.base = base_url.rstrip("/")
         self.s = requests.Session()
         self.s.auth = (username, application_password)
         self.s.headers.update({"User-Agent": "BrikxBot/0.1 (+contact)"})
+        self._me: dict | None = None
+        self._terms: dict[str, dict[str, dict[str, int]]] = {}  # taxonomy -> {"name"/"slug": {key: id}}
+        self._lock = threading.Lock()
 
     # -----------------------
     # Low-level helpers
@@ -37,42 +48,61 @@ class WordPressClient:
     # -----------------------
     # Users
     # -----------------------
-    def whoami(self) -> dict:
-        return self._get("/wp-json/wp/v2/users/me").json()
+    def whoami(self, refresh: bool = False) -> dict:
+        if self._me is None or refresh:
+            self._me = self._get("/wp-json/wp/v2/users/me").json()
+        return self._me
 
     # -----------------------
-    # Categories
+    # Taxonomieën (gedeeld door categorieën en tags)
     # -----------------------
-    def ensure_category(self, name: str, slug: str | None = None) -> int:
-        params = {"per_page": 100}
-        if slug:
-            params["slug"] = slug
-        r = self._get("/wp-json/wp/v2/categories", params=params)
-        items = r.json()
-        if slug and items:
-            return items[0]["id"]
-        if not slug:
-            for it in items:
-                if it.get("name", "").casefold() == name.casefold():
-                    return it["id"]
-        payload = {"name": name}
-        if slug:
-            payload["slug"] = slug
-        
-        try:
-            r = self._post("/wp-json/wp/v2/categories", json=payload)
-            return r.json()["id"]
-        except requests.HTTPError as e:
-            # If category already exists, extract the term_id from the error response
-            if "term_exists" in str(e):
-                try:
-                    import re
+    def _term_map(self, taxonomy: str) -> dict[str, dict[str, int]]:
+        """Alle termen van een taxonomie (gepagineerd), één keer per client opgehaald."""
+        if taxonomy not in self._terms:
+            names: dict[str, int] = {}
+            slugs: dict[str, int] = {}
+            page = 1
+            while True:
+                r = self._get(f"/wp-json/wp/v2/{taxonomy}", params={"per_page": 100, "page": page})
+                for it in r.json():
+                    names.setdefault(it.get("name", "").casefold(), it["id"])
+                    slugs[it.get("slug", "")] = it["id"]
+                total_pages = int(r.headers.get("X-WP-TotalPages", "1") or 1)
+                if page >= total_pages:
+                    break
+                page += 1
+            self._terms[taxonomy] = {"name": names, "slug": slugs}
+        return self._terms[taxonomy]
+
+    def _ensure_term(self, taxonomy: str, name: str, slug: str | None = None) -> int:
+        with self._lock:
+            terms = self._term_map(taxonomy)
+            found = terms["slug"].get(slug) if slug else terms["name"].get(name.casefold())
+            if found:
+                return found
+            payload = {"name": name}
+            if slug:
+                payload["slug"] = slug
+
+            try:
+                item = self._post(f"/wp-json/wp/v2/{taxonomy}", json=payload).json()
+            except requests.HTTPError as e:
+                # Bestaat al (bijv. aangemaakt door een andere run): map is verouderd
+                self._terms.pop(taxonomy, None)
+                if "term_exists" in str(e):
                     match = re.search(r"'term_id':\s*(\d+)", str(e))
                     if match:
                         return int(match.group(1))
-                except:
-                    pass
-            raise
+                raise
+            terms["name"].setdefault(item.get("name", name).casefold(), item["id"])
+            terms["slug"][item.get("slug") or slug or ""] = item["id"]
+            return item["id"]
+
+    # -----------------------
+    # Categories
+    # -----------------------
+    def ensure_category(self, name: str, slug: str | None = None) -> int:
+        return self._ensure_term("categories", name, slug)
 
     def ensure_categories(self, names: list[str]) -> list[int]:
         ids: list[int] = []
@@ -84,36 +114,7 @@ class WordPressClient:
     # Tags
     # -----------------------
     def ensure_tag(self, name: str, slug: str | None = None) -> int:
-        params = {"per_page": 100}
-        if slug:
-            params["slug"] = slug
-        r = self._get("/wp-json/wp/v2/tags", params=params)
-        items = r.json()
-        if slug and items:
-            return items[0]["id"]
-        if not slug:
-            for it in items:
-                if it.get("name", "").casefold() == name.casefold():
-                    return it["id"]
-        payload = {"name": name}
-        if slug:
-            payload["slug"] = slug
-        
-        try:
-            r = self._post("/wp-json/wp/v2/tags", json=payload)
-            return r.json()["id"]
-        except requests.HTTPError as e:
-            # If tag already exists, extract the term_id from the error response
-            if "term_exists" in str(e):
-                try:
-                    # Extract term_id from error message
-                    import re
-                    match = re.search(r"'term_id':\s*(\d+)", str(e))
-                    if match:
-                        return int(match.group(1))
-                except:
-                    pass
-            raise
+        return self._ensure_term("tags", name, slug)
 
     def ensure_tags(self, names: list[str]) -> list[int]:
         ids: list[int] = []
@@ -144,6 +145,27 @@ class WordPressClient:
             r = self._post(url, headers=headers, files=files, data=data)
         return r.json()
 
+    def update_media(
+        self,
+        media_id: int,
+        title: str | None = None,
+        alt_text: str | None = None,
+        caption: str | None = None,
+    ) -> dict:
+        payload: dict = {}
+        if title is not None: payload["title"] = title
+        if alt_text is not None: payload["alt_text"] = alt_text
+        if caption is not None: payload["caption"] = caption
+        return self._post(f"/wp-json/wp/v2/media/{media_id}", json=payload).json()
+
+    def get_media(self, media_id: int) -> dict | None:
+        """Media-item opvragen; None als het niet (meer) bestaat."""
+        r = self.s.get(f"{self.base}/wp-json/wp/v2/media/{media_id}", params={"_fields": "id,source_url"}, timeout=30)
+        if r.status_code in (404, 410):
+            return None
+        self._raise_for_status(r)
+        return r.json()
+
     # -----------------------
     # Posts
     # -----------------------
@@ -2,7 +2,8 @@ import os
 import sys
 import argparse
 import logging
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlparse
 from dotenv import load_dotenv
 from supabase import create_client
@@ -10,6 +11,7 @@ from supabase import create_client
 # Add backend to path to import brikx modules
 sys.path.append(os.path.join(os.path.dirname(__file__)))
 from brikx.wordpress_client import WordPressClient
+from brikx.media_registry import MediaRegistry
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,24 +20,48 @@ logger = logging.getLogger(__name__)
 # Load env
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
-def publish_listing(listing_id):
-    # 1. Connect to Supabase
-    supabase_url = os.getenv('SUPABASE_URL')
-    supabase_key = os.getenv('SUPABASE_KEY')
-    if not supabase_url or not supabase_key:
-        logger.error("Supabase credentials missing")
-        return False
-    
-    supabase = create_client(supabase_url, supabase_key)
-    
-    # 2. Fetch listing
-    res = supabase.table('listings').select('*').eq('kavel_id', listing_id).execute()
-    if not res.data:
-        logger.error(f"Listing {listing_id} not found")
-        return False
-    
-    listing = res.data[0]
-    logger.info(f"Processing listing: {listing.get('adres')}")
+DEFAULT_CATEGORY = ("Vrije kavel", "vrije-kavel")
+DEFAULT_TAGS = ["bouwgrond", "bouwkavel", "nieuwbouwwoning", "architect", "vergunning"]
+# Bulk mode: aantal posts tegelijk en IDs per Supabase in_() query
+PUBLISH_WORKERS = int(os.getenv('PUBLISH_WORKERS', '4'))
+FETCH_CHUNK_SIZE = 100
+
+
+class PublishContext:
+    """Gedeelde clients voor één run: Supabase, WordPress, media registry en taxonomie-IDs"""
+    def __init__(self, supabase, wp):
+        self.supabase = supabase
+        self.wp = wp
+        self.media_registry = MediaRegistry()
+        self._taxonomy = None
+        self._lock = threading.Lock()
+
+    def taxonomy(self):
+        """(categorie-ID, tag-IDs), één keer per run opgehaald"""
+        with self._lock:
+            if self._taxonomy is None:
+                logger.info("Ensuring category 'Vrije kavel'...")
+                cat_id = self.wp.ensure_category(*DEFAULT_CATEGORY)
+                logger.info(f"Category ID: {cat_id}")
+                
+                # Ensure tags from config
+                logger.info("Ensuring tags...")
+                tag_ids = self.wp.ensure_tags(DEFAULT_TAGS)
+                logger.info(f"Tag IDs: {tag_ids}")
+                self._taxonomy = (cat_id, tag_ids)
+            return self._taxonomy
+
+
+def create_context(supabase=None):
+    # 1. Connect to Supabase (de sync daemon geeft zijn warme client mee)
+    if supabase is None:
+        supabase_url = os.getenv('SUPABASE_URL')
+        supabase_key = os.getenv('SUPABASE_KEY')
+        if not supabase_url or not supabase_key:
+            logger.error("Supabase credentials missing")
+            return None
+        
+        supabase = create_client(supabase_url, supabase_key)
     
     # 3. Connect to WordPress
     wp_url = os.getenv('WP_ZWIJSEN_URL')
@@ -44,9 +70,16 @@ def publish_listing(listing_id):
     
     if not wp_url or not wp_user or not wp_pass:
         logger.error("WordPress credentials missing")
-        return False
+        return None
         
-    wp = WordPressClient(wp_url, wp_user, wp_pass)
+    return PublishContext(supabase, WordPressClient(wp_url, wp_user, wp_pass))
+
+
+def publish_to_wordpress(listing, ctx):
+    """Maak de WordPress post voor één listing; retourneert de post (None bij een fout)"""
+    listing_id = listing.get('kavel_id')
+    wp = ctx.wp
+    logger.info(f"Processing listing: {listing.get('adres')}")
     
     # 4. Prepare Content
     title = listing.get('seo_title') or f"Bouwkavel te koop: {listing.get('adres')}, {listing.get('plaats')}"
@@ -122,15 +155,20 @@ def publish_listing(listing_id):
         try:
             parsed = urlparse(map_url)
             filename = os.path.basename(parsed.path)
-            local_path = os.path.join(os.path.dirname(__file__), '..', 'public', 'maps', filename)
+            maps_dir = os.path.join(os.path.dirname(__file__), '..', 'public', 'maps')
+            local_path = os.path.join(maps_dir, filename)
+            if not os.path.exists(local_path):
+                # Supabase URLs use the content-addressed blob name; the local copy is stored per listing ID
+                local_path = os.path.join(maps_dir, f"{listing_id}.png")
             
             if os.path.exists(local_path):
                 logger.info(f"Uploading map: {local_path}")
                 # Use focus keyword in alt text if available
                 alt_text = focus_keyword if focus_keyword else f"Kaart {listing.get('adres')}"
-                media = wp.upload_media(local_path, title=f"Kaart {listing.get('adres')}", caption=alt_text)
+                # Zelfde kaart al eerder naar deze site geüpload? Dan dat media-ID hergebruiken
+                media = ctx.media_registry.upload(wp, local_path, title=f"Kaart {listing.get('adres')}", caption=alt_text)
                 featured_media_id = media.get('id')
-                logger.info(f"Map uploaded, ID: {featured_media_id}")
+                logger.info(f"Map available, ID: {featured_media_id}")
             else:
                 logger.warning(f"Map file not found at {local_path}")
         except Exception as e:
@@ -138,16 +176,7 @@ def publish_listing(listing_id):
 
     # 6. Create Post
     try:
-        logger.info("Ensuring category 'Vrije kavel'...")
-        # Ensure category "Vrije kavel"
-        cat_id = wp.ensure_category("Vrije kavel", slug="vrije-kavel")
-        logger.info(f"Category ID: {cat_id}")
-        
-        # Ensure tags from config
-        logger.info("Ensuring tags...")
-        default_tags = ["bouwgrond", "bouwkavel", "nieuwbouwwoning", "architect", "vergunning"]
-        tag_ids = wp.ensure_tags(default_tags)
-        logger.info(f"Tag IDs: {tag_ids}")
+        cat_id, tag_ids = ctx.taxonomy()
         
         # Prepare meta fields
         meta_fields = {
@@ -180,15 +209,44 @@ def publish_listing(listing_id):
         
         post_link = post.get('link')
         logger.info(f"Post created: {post_link}")
+        return post
         
-        # 7. Update Supabase
-        logger.info("Updating Supabase status...")
+    except Exception as e:
+        logger.error(f"Failed to create post for {listing_id}: {e}")
+        return None
+
+
+def publish_listing(listing_id, supabase=None):
+    ctx = create_context(supabase)
+    if ctx is None:
+        return False
+    
+    # 2. Fetch listing
+    res = ctx.supabase.table('listings').select('*').eq('kavel_id', listing_id).execute()
+    if not res.data:
+        logger.error(f"Listing {listing_id} not found" + (f" with status '{status}'" if status else ""))
+        return False
+    
+    post = publish_to_wordpress(res.data[0], ctx)
+    if post is None:
+        return False
+    
+    # 7. Update Supabase
+    return mark_published(ctx.supabase, listing_id, post)
+
+
+def mark_published(supabase, listing_id, post):
+    """
+    Zet status/published_url direct na het aanmaken van de post. Alleen deze twee
+    kolommen: de rest van de rij kan intussen door een sync of admin gewijzigd zijn.
+    """
+    try:
+        logger.info(f"Updating Supabase status for {listing_id}...")
         res = supabase.table('listings').update({
             'status': 'published',
-            'published_url': post_link
+            'published_url': post.get('link')
         }).eq('kavel_id', listing_id).execute()
         logger.info(f"Supabase updated: {res}")
-        
         return True
         
     except Exception as e:
@@ -196,17 +254,83 @@ def publish_listing(listing_id):
             logger.info("Supabase update returned 204 (Success)")
             return True
             
-        logger.error(f"Failed in step 6/7: {e}")
+        logger.error(f"Failed to update Supabase for {listing_id}: {e}")
         import traceback
         traceback.print_exc()
         return False
 
+
+def fetch_listings(supabase, listing_ids=None, status=None, limit=None):
+    """Listings op ID (één in_() query per chunk, met status als extra filter) of op status (oudste eerst)"""
+    if listing_ids:
+        ids = list(dict.fromkeys(str(i) for i in listing_ids))
+        rows = []
+        for start in range(0, len(ids), FETCH_CHUNK_SIZE):
+            chunk = ids[start:start + FETCH_CHUNK_SIZE]
+            query = supabase.table('listings').select('*').in_('kavel_id', chunk)
+            if status:
+                query = query.eq('status', status)
+            rows.extend(query.execute().data or [])
+        order = {kavel_id: n for n, kavel_id in enumerate(ids)}
+        return sorted(rows, key=lambda row: order.get(str(row.get('kavel_id')), len(order)))
+    query = supabase.table('listings').select('*').eq('status', status).order('created_at')
+    if limit:
+        query = query.limit(limit)
+    return query.execute().data or []
+
+
+def publish_many(listing_ids=None, status=None, limit=None, workers=PUBLISH_WORKERS, supabase=None):
+    """
+    Publiceer meerdere listings met gedeelde clients: taxonomie één keer en posts met
+    begrensde concurrency. Elke post wordt direct na aanmaken in Supabase gemarkeerd,
+    zodat een afgebroken run geen live posts achterlaat die nog 'pending' staan.
+    """
+    ctx = create_context(supabase)
+    if ctx is None:
+        return {'published': 0, 'failed': len(listing_ids or []), 'missing': 0}
+    
+    listings = fetch_listings(ctx.supabase, listing_ids=listing_ids, status=status, limit=limit)
+    missing = set(str(i) for i in listing_ids or []) - {str(row.get('kavel_id')) for row in listings}
+    for listing_id in sorted(missing):
+        logger.error(f"Listing {listing_id} not found")
+    logger.info(f"Publishing {len(listings)} listing(s) with {workers} worker(s)")
+    
+    try:
+        ctx.taxonomy()
+    except Exception as e:
+        logger.error(f"Failed to resolve categories/tags: {e}")
+        return {'published': 0, 'failed': len(listings), 'missing': len(missing)}
+    
+    published = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='publish') as pool:
+        futures = {pool.submit(publish_to_wordpress, listing, ctx): listing for listing in listings}
+        for future in as_completed(futures):
+            post = future.result()
+            if post is not None and mark_published(ctx.supabase, futures[future]['kavel_id'], post):
+                published += 1
+    return {'published': published, 'failed': len(listings) - published, 'missing': len(missing)}
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('listing_id', help="The Funda/Kavel ID of the listing to publish")
+    parser.add_argument('listing_ids', nargs='*', help="Funda/Kavel ID(s) of the listing(s) to publish")
+    parser.add_argument('--status', help="Publish listings with this status instead (e.g. pending)")
+    parser.add_argument('--limit', type=int, default=50, help="Max listings for --status (default: 50)")
+    parser.add_argument('--workers', type=int, default=PUBLISH_WORKERS,
+                        help=f"Posts created concurrently in bulk mode (default: {PUBLISH_WORKERS})")
     args = parser.parse_args()
     
-    success = publish_listing(args.listing_id)
+    if not args.listing_ids and not args.status:
+        parser.error("give one or more listing IDs or --status")
+    if args.listing_ids and args.status:
+        parser.error("give listing IDs or --status, not both")
+    
+    if len(args.listing_ids) == 1 and not args.status:
+        success = publish_listing(args.listing_ids[0])
+    else:
+        summary = publish_many(args.listing_ids or None, status=args.status, limit=args.limit, workers=args.workers)
+        logger.info(f"Bulk publish finished: {summary}")
+        success = summary['failed'] == 0 and summary['missing'] == 0
     if success:
         sys.exit(0)
     else:
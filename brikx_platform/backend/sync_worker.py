@@ -8,11 +8,13 @@ Leest Gmail, extraheert Funda listings, en schrijft naar Supabase
 import sys
 import os
 import re
+import json
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Optional, Set
 from urllib.parse import urlparse
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 # Setup logging
 logging.basicConfig(
@@ -25,13 +27,22 @@ logger = logging.getLogger(__name__)
 backend_dir = Path(__file__).parent
 sys.path.insert(0, str(backend_dir))
 
+# --profile-startup: importtijd meten vóór de zware imports hieronder
+startup_profiler = None
+if '--profile-startup' in sys.argv:
+    from brikx.startup_profile import ImportProfiler
+    startup_profiler = ImportProfiler().start()
+
 # Import dependencies
 try:
     from dotenv import load_dotenv
-    from brikx.gmail_client import GmailClient
-    from brikx.perplexity_client import PerplexityClient
-    import requests
-    from bs4 import BeautifulSoup
+    from brikx.gmail_client import GmailClient, HistoryExpiredError, message_sender
+    from brikx.perplexity_client import PerplexityClient, unavailable_reason
+    from brikx.disk_cache import DiskCache
+    from brikx.geocoder import Geocoder
+    from brikx.map_store import MapStore
+    from brikx.bloom import BloomFilter
+    from brikx.supabase_batch import UpsertBuffer
 except ImportError as e:
     logger.error(f"Missing dependency: {e}")
     logger.error("Run: pip install -r requirements.txt")
@@ -56,10 +67,54 @@ GMAIL_TOKEN = str(backend_dir / 'secrets' / 'token.json')
 # Updated query: removed strict "zoekopdracht" requirement since emails have "zoekopdrachten" (plural)
 # Now matches any Funda notification email about search results
 GMAIL_QUERY = 'from:notificaties@service.funda.nl newer_than:21d -label:Brikx/Verwerkt'
+# Verhoog om na downtime in te halen; berichten worden per 100 in één batch opgehaald
+GMAIL_MAX_RESULTS = int(os.getenv('GMAIL_MAX_RESULTS', '20'))
+GMAIL_SENDER = 'notificaties@service.funda.nl'
+GMAIL_PROCESSED_LABEL = 'Brikx/Verwerkt'
+# Incrementele modus: laatst verwerkte historyId
+HISTORY_CHECKPOINT = backend_dir / 'state' / 'gmail_history.json'
+
+# Aantal listings dat tegelijk verrijkt wordt (Perplexity, Geoapify en Supabase I/O overlappen)
+SYNC_WORKERS = int(os.getenv('SYNC_WORKERS', '4'))
+
+# Perplexity resultaten op schijf cachen: retries en re-imports kosten geen LLM call
+PERPLEXITY_CACHE = backend_dir / 'state' / 'perplexity_cache.sqlite'
+PERPLEXITY_CACHE_TTL_DAYS = float(os.getenv('PERPLEXITY_CACHE_TTL_DAYS', '30'))
+PERPLEXITY_CACHE_MAX_ENTRIES = int(os.getenv('PERPLEXITY_CACHE_MAX_ENTRIES', '5000'))
+
+# Geocoding: provider-keten (komma-gescheiden) en pad naar de offline centroid-index
+GEOCODE_PROVIDERS = [p.strip() for p in os.getenv('GEOCODE_PROVIDERS', '').split(',') if p.strip()] or None
+GEOCODE_INDEX = os.getenv('GEOCODE_INDEX') or None
+
+# Content-addressed kaartopslag: identieke locaties worden één keer gedownload en geüpload
+MAP_STORE_DIR = os.getenv('MAP_STORE_DIR') or str(backend_dir / 'state' / 'maps')
+MAP_UPLOAD_TARGET = 'supabase:maps'
 
 # Initialize clients (will be initialized in main function)
 supabase = None
 perplexity_client = None
+geocoder = None
+map_store = None
+refresh_enrichment = False  # --refresh: negeer de Perplexity cache
+stream_enrichment = os.getenv('PERPLEXITY_STREAM', '').lower() in ('1', 'true', 'yes')  # --stream
+
+# Bestaande listings: één in_() query per chunk i.p.v. één select per URL
+EXISTS_CHUNK_SIZE = 100
+known_ids: Set[str] = set()    # IDs die zeker in Supabase staan
+checked_ids: Set[str] = set()  # IDs waarvan we het antwoord (bestaat wel/niet) al weten
+
+# Optioneel (--bloom): Bloom filter over alle funda_ids in Supabase. Een miss is
+# definitief nieuw en slaat de Supabase lookup over. Bijgewerkt met een delta-query
+# op created_at; volledig herbouwd met --bloom-rebuild of als het filter vol is.
+LISTING_BLOOM = backend_dir / 'state' / 'listings.bloom'
+BLOOM_PAGE_SIZE = 1000
+listing_filter = None
+
+# Write-behind voor inserts en 'skipped' markers tijdens een Gmail sync: multi-row
+# upserts per SYNC_WRITE_BATCH rijen en aan het einde van elk bericht. Buiten een
+# sync (--url, daemon /process_url) blijft de insert direct.
+WRITE_BATCH_SIZE = int(os.getenv('SYNC_WRITE_BATCH', '50'))
+listing_buffer = None
 
 
 import hashlib
@@ -104,14 +159,114 @@ def scrape_listing_details(url: str) -> Dict[str, Any]:
     #     ...
 
 
+def preload_existing_ids(funda_ids: Iterable[str]) -> Set[str]:
+    """
+    Bepaal in één keer welke IDs al in Supabase staan.
+    Doet één `in_()` query per EXISTS_CHUNK_SIZE IDs en vult de in-memory
+    known_ids / checked_ids sets, zodat listing_exists() daarna geen
+    round trip meer nodig heeft.
+    """
+    ids = sorted({i for i in funda_ids if i and i not in checked_ids})
+    if listing_filter is not None:
+        # Definitieve misses hoeven niet naar Supabase
+        misses = {i for i in ids if i not in listing_filter}
+        checked_ids.update(misses)
+        ids = [i for i in ids if i not in misses]
+    found: Set[str] = set()
+    for start in range(0, len(ids), EXISTS_CHUNK_SIZE):
+        chunk = ids[start:start + EXISTS_CHUNK_SIZE]
+        try:
+            result = supabase.table('listings').select('funda_id').in_('funda_id', chunk).execute()
+        except Exception as e:
+            # Chunk blijft onbekend; listing_exists() valt terug op een losse query
+            logger.error(f"Error preloading existing listings: {e}")
+            continue
+        chunk_found = {str(row['funda_id']) for row in (result.data or []) if row.get('funda_id')}
+        if listing_filter is not None:
+            for i in chunk:
+                listing_filter.observe(i in chunk_found)
+        found.update(chunk_found)
+        checked_ids.update(chunk)
+    known_ids.update(found)
+    logger.info(f"Preloaded {len(ids)} listing IDs, {len(found)} already exist")
+    return found
+
+
+def _fetch_listing_ids(since: Optional[str] = None):
+    """Alle (of sinds `since` aangemaakte) funda_ids uit Supabase, gepagineerd; geeft (ids, max created_at)"""
+    ids: List[str] = []
+    watermark = since
+    offset = 0
+    while True:
+        query = supabase.table('listings').select('funda_id, created_at')
+        if since:
+            query = query.gte('created_at', since)
+        result = query.order('created_at').range(offset, offset + BLOOM_PAGE_SIZE - 1).execute()
+        rows = result.data or []
+        for row in rows:
+            if row.get('funda_id'):
+                ids.append(str(row['funda_id']))
+            if row.get('created_at') and (watermark is None or row['created_at'] > watermark):
+                watermark = row['created_at']
+        if len(rows) < BLOOM_PAGE_SIZE:
+            return ids, watermark
+        offset += BLOOM_PAGE_SIZE
+
+
+def load_listing_filter(rebuild: bool = False):
+    """Laad het Bloom filter en werk het bij met listings die sinds de vorige run zijn aangemaakt"""
+    global listing_filter
+    bf = None if rebuild else BloomFilter.load(LISTING_BLOOM)
+    if bf is not None and not bf.saturated:
+        ids, watermark = _fetch_listing_ids(since=bf.meta.get('watermark'))
+        bf.add_many(ids)
+        logger.info(f"Loaded listing Bloom filter ({len(bf)} items, +{len(ids)} since last run)")
+    else:
+        ids, watermark = _fetch_listing_ids()
+        bf = BloomFilter.build(ids)
+        logger.info(f"Rebuilt listing Bloom filter from Supabase ({len(ids)} listings)")
+    bf.meta['watermark'] = watermark
+    listing_filter = bf
+    return bf
+
+
+def save_listing_filter():
+    """Sla het filter op en log het gemeten false-positive percentage"""
+    if listing_filter is None:
+        return
+    listing_filter.save(LISTING_BLOOM)
+    logger.info(f"Listing Bloom filter stats: {listing_filter.stats()}")
+
+
+def remember_listing(funda_id: str):
+    """Markeer een ID als bestaand na een geslaagde insert"""
+    known_ids.add(funda_id)
+    checked_ids.add(funda_id)
+    if listing_filter is not None:
+        listing_filter.add(funda_id)
+
+
 def listing_exists(funda_id: str) -> bool:
     """Check if listing already exists in Supabase"""
+    if funda_id in known_ids:
+        return True
+    if funda_id in checked_ids:
+        return False
+    if listing_filter is not None and funda_id not in listing_filter:
+        checked_ids.add(funda_id)
+        return False
     try:
         result = supabase.table('listings').select('kavel_id').eq('funda_id', funda_id).execute()
-        return len(result.data) > 0
+        exists = len(result.data) > 0
     except Exception as e:
         logger.error(f"Error checking if listing exists: {e}")
         return False
+    checked_ids.add(funda_id)
+    if exists:
+        known_ids.add(funda_id)
+    if listing_filter is not None:
+        listing_filter.observe(exists)
+    return exists
 
 
 def insert_listing(listing_data: Dict[str, Any]) -> bool:
@@ -124,6 +279,48 @@ def insert_listing(listing_data: Dict[str, Any]) -> bool:
         return False
 
 
+def _listing_written(listing_data: Dict[str, Any]):
+    """Na een geslaagde write: onthouden en pas dan melden"""
+    funda_id = listing_data['funda_id']
+    remember_listing(funda_id)
+    if listing_data.get('status') == 'skipped':
+        logger.info(f"Marked {funda_id} as skipped in database")
+        return
+    logger.info(f"✅ Inserted listing {funda_id}")
+    print(f"[SYNC] New listing: {listing_data.get('adres', 'Unknown')} - {listing_data.get('plaats', 'Unknown')}", flush=True)
+
+
+def _on_listings_written(rows: List[Dict[str, Any]]):
+    for row in rows:
+        _listing_written(row)
+
+
+def write_listing(listing_data: Dict[str, Any]) -> bool:
+    """
+    Schrijf een listing (of skipped marker) weg: in de write-behind buffer als
+    die actief is, anders direct. Onthouden en melden volgen pas na een geslaagde write.
+    """
+    if listing_buffer is not None:
+        listing_buffer.add(listing_data)
+        return True
+    if insert_listing(listing_data):
+        _listing_written(listing_data)
+        return True
+    return False
+
+
+def listing_pending(funda_id: str) -> bool:
+    """Staat deze listing nog in de write-behind buffer?"""
+    return listing_buffer is not None and listing_buffer.is_pending(funda_id)
+
+
+def flush_listings() -> Set[str]:
+    """Flush de write-behind buffer; retourneert de IDs die niet weggeschreven konden worden"""
+    if listing_buffer is None:
+        return set()
+    return listing_buffer.flush()
+
+
 def process_single_listing(url: str, listing_info: Dict[str, Any] = None) -> bool:
     """Process a single listing URL"""
     global perplexity_client
@@ -168,48 +365,40 @@ def process_single_listing(url: str, listing_info: Dict[str, Any] = None) -> boo
             logger.info(f"Enriching {funda_id} with Perplexity AI...")
             # Pass the scraped description if available to avoid "read more" issues
             description_text = scraped_details.get('description', '')
-            pplx_data = perplexity_client.extract_listing(url, description_text)
+            # Alleen feiten + beschikbaarheid; het artikel wordt pas bij publiceren gegenereerd
+            if stream_enrichment:
+                # Breek de stream af zodra titel/beschikbaarheid aangeven dat de kavel weg is
+                pplx_data = perplexity_client.stream_facts(
+                    url, description_text,
+                    should_abort=lambda fields: bool(unavailable_reason(fields)),
+                    refresh=refresh_enrichment,
+                )
+            else:
+                pplx_data = perplexity_client.extract_facts(url, description_text, refresh=refresh_enrichment)
             logger.info("Perplexity enrichment successful")
             
             # Check if listing is no longer available
-            article = (pplx_data.get('article_nl') or '').lower()
-            summary = (pplx_data.get('summary_nl') or '').lower()
-            title = (pplx_data.get('title') or '').lower()
-            
-            unavailable_phrases = [
-                'niet meer beschikbaar',
-                'niet gevonden',
-                'pagina niet gevonden',
-                'verkocht',
-                'verwijderd',
-                'offline gehaald',
-                'geen resultaten'
-            ]
-            
-            for phrase in unavailable_phrases:
-                if phrase in article or phrase in summary or phrase in title:
-                    logger.warning(f"⚠️ Listing {funda_id} appears to be unavailable (found: '{phrase}'). Skipping.")
-                    # Mark as skipped in database
-                    try:
-                        supabase.table('listings').insert({
-                            'kavel_id': funda_id,
-                            'funda_id': funda_id,
-                            'status': 'skipped',
-                            'source_url': url,
-                            'adres': 'Niet beschikbaar',
-                            'plaats': 'Onbekend',
-                            'provincie': 'Onbekend',
-                            'prijs': 0,
-                            'oppervlakte': 0,
-                            'seo_summary': f'Deze kavel is niet meer beschikbaar ({phrase})',
-                            'created_at': datetime.utcnow().isoformat(),
-                            'updated_at': datetime.utcnow().isoformat(),
-                        }).execute()
-                        logger.info(f"Marked {funda_id} as skipped in database")
-                    except Exception as e:
-                        logger.error(f"Failed to mark as skipped: {e}")
-                    
-                    return False
+            phrase = unavailable_reason(pplx_data)
+            if phrase:
+                logger.warning(f"⚠️ Listing {funda_id} appears to be unavailable (found: '{phrase}'). Skipping.")
+                # Mark as skipped in database
+                if not write_listing({
+                    'kavel_id': funda_id,
+                    'funda_id': funda_id,
+                    'status': 'skipped',
+                    'source_url': url,
+                    'adres': 'Niet beschikbaar',
+                    'plaats': 'Onbekend',
+                    'provincie': 'Onbekend',
+                    'prijs': 0,
+                    'oppervlakte': 0,
+                    'seo_summary': f'Deze kavel is niet meer beschikbaar ({phrase})',
+                    'created_at': datetime.utcnow().isoformat(),
+                    'updated_at': datetime.utcnow().isoformat(),
+                }):
+                    logger.error(f"Failed to mark {funda_id} as skipped")
+                
+                return False
             
         except Exception as e:
             logger.error(f"Perplexity enrichment failed: {e}")
@@ -309,13 +498,12 @@ def process_single_listing(url: str, listing_info: Dict[str, Any] = None) -> boo
     lat = scraped_details.get('lat')
     lon = scraped_details.get('lon')
     
-    # If no coords, try geocoding the address
+    # If no coords, try geocoding the address (offline index first, then remote providers)
     if not lat or not lon:
-        if adres and plaats:
+        if (adres and plaats) or postcode:
             try:
-                from brikx.map_fetcher import geocode_address
-                geo_addr = f"{adres}, {plaats}"
-                coords = geocode_address(geo_addr)
+                geo_addr = ", ".join(p for p in (adres, plaats) if p) or None
+                coords = geocoder.geocode(geo_addr, postcode=postcode, place=plaats)
                 if coords:
                     lat, lon = coords
                     logger.info(f"Geocoded '{geo_addr}' to ({lat}, {lon})")
@@ -324,35 +512,41 @@ def process_single_listing(url: str, listing_info: Dict[str, Any] = None) -> boo
 
     if lat and lon:
         try:
-            from brikx.map_fetcher import download_static_map
             map_filename = f"{funda_id}.png"
             map_path = os.path.join("public", "maps", map_filename)
             
-            # Ensure directory exists
-            os.makedirs(os.path.dirname(map_path), exist_ok=True)
-            
-            saved_path = download_static_map(lat, lon, out_path=map_path)
-            if saved_path:
-                # Upload to Supabase Storage
-                try:
-                    with open(saved_path, 'rb') as f:
-                        file_bytes = f.read()
-
-                    # Upload to Supabase storage bucket 'maps'
-                    storage_path = f"maps/{map_filename}"
-                    supabase.storage.from_('maps').upload(
-                        storage_path,
-                        file_bytes,
-                        file_options={"content-type": "image/png", "upsert": "true"}
-                    )
-
-                    # Get public URL from Supabase
-                    map_url = supabase.storage.from_('maps').get_public_url(storage_path)
-                    logger.info(f"Uploaded map to Supabase: {map_url}")
-                except Exception as upload_err:
-                    # Fallback to local URL if upload fails
-                    logger.warning(f"Failed to upload map to Supabase: {upload_err}, using local URL")
-                    map_url = f"http://localhost:8765/maps/{map_filename}"
+            # Same location/render params -> same blob; only render when it is new
+            stored = map_store.get_or_render(lat, lon, ref_id=funda_id)
+            if stored:
+                blob, _ = stored
+                # Keep the local copy under the listing ID (used by publish_worker/upload_existing_maps)
+                map_store.materialize(blob, map_path)
+                
+                map_url = map_store.uploaded_url(blob, MAP_UPLOAD_TARGET)
+                if map_url:
+                    logger.info(f"Reusing uploaded map for {funda_id}: {map_url}")
+                else:
+                    # Upload to Supabase Storage
+                    try:
+                        with open(map_store.blob_path(blob), 'rb') as f:
+                            file_bytes = f.read()
+
+                        # Upload to Supabase storage bucket 'maps' under the blob key
+                        storage_path = f"maps/{blob}.png"
+                        supabase.storage.from_('maps').upload(
+                            storage_path,
+                            file_bytes,
+                            file_options={"content-type": "image/png", "upsert": "true"}
+                        )
+
+                        # Get public URL from Supabase
+                        map_url = supabase.storage.from_('maps').get_public_url(storage_path)
+                        map_store.record_upload(blob, MAP_UPLOAD_TARGET, map_url)
+                        logger.info(f"Uploaded map to Supabase: {map_url}")
+                    except Exception as upload_err:
+                        # Fallback to local URL if upload fails
+                        logger.warning(f"Failed to upload map to Supabase: {upload_err}, using local URL")
+                        map_url = f"http://localhost:8765/maps/{map_filename}"
         except Exception as e:
             logger.error(f"Failed to generate map: {e}")
 
@@ -399,49 +593,417 @@ def process_single_listing(url: str, listing_info: Dict[str, Any] = None) -> boo
     }
     
     # Insert into Supabase
-    if insert_listing(listing_data):
-        logger.info(f"✅ Inserted listing {funda_id}")
-        print(f"[SYNC] New listing: {listing_data.get('adres', 'Unknown')} - {listing_data.get('plaats', 'Unknown')}", flush=True)
+    if write_listing(listing_data):
         return True
     else:
         return False
 
 
+def load_history_checkpoint() -> Optional[str]:
+    """Lees de laatst opgeslagen Gmail historyId (None als er nog geen checkpoint is)"""
+    try:
+        with open(HISTORY_CHECKPOINT, 'r', encoding='utf-8') as f:
+            return str(json.load(f).get('history_id') or '') or None
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Could not read history checkpoint: {e}")
+        return None
+
+
+def save_history_checkpoint(history_id: str):
+    """Schrijf de historyId atomair weg (tmp-bestand + rename)"""
+    HISTORY_CHECKPOINT.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = HISTORY_CHECKPOINT.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'history_id': history_id, 'updated_at': datetime.utcnow().isoformat()}, f)
+    os.replace(tmp_path, HISTORY_CHECKPOINT)
+
+
+def fetch_messages(gmail: GmailClient, incremental: bool = False):
+    """
+    Haal te verwerken Funda-mails op.
+    Incrementeel: alleen berichten toegevoegd sinds het history-checkpoint (één
+    history.list call als er niets nieuws is). Zonder (geldig) checkpoint valt dit
+    terug op de volledige GMAIL_QUERY.
+    Retourneert (messages, history_id) — history_id is None buiten incrementele modus,
+    en ook als de terugval-zoekactie op GMAIL_MAX_RESULTS is afgekapt of berichten niet
+    opgehaald konden worden: dan blijft het checkpoint staan en pakt de volgende run de rest op.
+    """
+    if incremental:
+        start_history_id = load_history_checkpoint()
+        if start_history_id:
+            try:
+                ids, latest = gmail.list_added_message_ids(start_history_id)
+                logger.info(f"History since {start_history_id}: {len(ids)} added message(s)")
+                messages = [
+                    m for m in gmail.get_messages(ids)
+                    if GMAIL_SENDER in message_sender(m).lower()
+                    and not gmail.has_label(m, GMAIL_PROCESSED_LABEL)
+                ]
+                if gmail.failed_ids:
+                    # Niet-opgehaalde mail zou anders achter het checkpoint verdwijnen
+                    logger.warning(f"{len(gmail.failed_ids)} message(s) could not be fetched; history checkpoint not advanced this run")
+                    latest = None
+                return messages, latest
+            except HistoryExpiredError as e:
+                logger.warning(f"{e}; falling back to full query")
+        # historyId vóór de zoekactie vastleggen zodat tussentijds binnengekomen mail niet wegvalt
+        latest = gmail.get_history_id()
+    else:
+        latest = None
+
+    logger.info(f"Searching Gmail with query: {GMAIL_QUERY}")
+    messages = gmail.search_messages(query=GMAIL_QUERY, max_results=GMAIL_MAX_RESULTS)
+    if latest and len(messages) + len(gmail.failed_ids) >= GMAIL_MAX_RESULTS:
+        logger.warning(f"Query hit GMAIL_MAX_RESULTS ({GMAIL_MAX_RESULTS}); history checkpoint not advanced this run")
+        latest = None
+    elif latest and gmail.failed_ids:
+        logger.warning(f"{len(gmail.failed_ids)} message(s) could not be fetched; history checkpoint not advanced this run")
+        latest = None
+    return messages, latest
+
+
+def sync_listing(url: str, listing_info: Dict[str, Any]) -> str:
+    """
+    Verwerk één listing en classificeer de uitkomst:
+    'new' (ingevoegd), 'skipped' (bestond al / niet beschikbaar) of 'error'.
+    Draait in een worker thread; raakt alleen thread-safe clients aan.
+    """
+    try:
+        if process_single_listing(url, listing_info):
+            return 'new'
+    except Exception as e:
+        logger.error(f"Unexpected error processing {url}: {e}")
+        return 'error'
+    # Check if it was skipped because it exists
+    funda_id = extract_listing_id(url.split('?')[0])
+    if funda_id and (listing_pending(funda_id) or listing_exists(funda_id)):
+        return 'skipped'
+    return 'error'
+
+
+def report_startup_profile():
+    """Print de importtijden (--profile-startup) naar stderr"""
+    if startup_profiler is not None:
+        startup_profiler.stop()
+        print(startup_profiler.report(), file=sys.stderr, flush=True)
+
+
+def init_clients(use_bloom: bool = False, rebuild_bloom: bool = False):
+    """Initialiseer Supabase, geocoder, kaartopslag, Bloom filter en Perplexity (één keer per proces)"""
+    global supabase, perplexity_client, geocoder, map_store
+    
+    # Import Supabase here to avoid module-level import errors
+    from supabase import create_client, Client
+    
+    # Initialize Supabase client
+    logger.info("Initializing Supabase client...")
+    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    logger.info("Supabase client initialized successfully")
+    
+    geocoder = Geocoder(providers=GEOCODE_PROVIDERS, index_path=GEOCODE_INDEX)
+    map_store = MapStore(MAP_STORE_DIR)
+    
+    if use_bloom or rebuild_bloom:
+        try:
+            load_listing_filter(rebuild=rebuild_bloom)
+        except Exception as e:
+            logger.warning(f"Bloom filter unavailable, falling back to Supabase lookups: {e}")
+    
+    # Initialize Perplexity client
+    if PERPLEXITY_API_KEY:
+        logger.info("Initializing Perplexity client...")
+        cache = DiskCache(
+            PERPLEXITY_CACHE,
+            ttl=PERPLEXITY_CACHE_TTL_DAYS * 86400,
+            max_entries=PERPLEXITY_CACHE_MAX_ENTRIES,
+        )
+        perplexity_client = PerplexityClient(PERPLEXITY_API_KEY, cache=cache)
+    else:
+        logger.warning("⚠️ Geen PERPLEXITY_API_KEY gevonden in .env - AI verrijking uitgeschakeld")
+
+
+def run_gmail_sync(gmail: GmailClient, incremental: bool = False, workers: int = SYNC_WORKERS) -> Dict[str, int]:
+    """Haal Funda mails op, verwerk alle listings en archiveer de verwerkte mails"""
+    global listing_buffer
+    listing_buffer = UpsertBuffer(
+        supabase, 'listings', key='kavel_id',
+        flush_every=WRITE_BATCH_SIZE, on_written=_on_listings_written,
+    )
+    try:
+        return _run_gmail_sync(gmail, incremental, workers)
+    finally:
+        flush_listings()
+        listing_buffer = None
+
+
+def _final_outcome(key: str, outcome: str) -> str:
+    """
+    Een listing die in de buffer stond maar niet weggeschreven kon worden telt als 'error';
+    een 'new' listing die bij de upsert al bleek te bestaan (conflict genegeerd) als 'skipped'
+    """
+    if outcome == 'error' or listing_buffer is None:
+        return outcome
+    if key in listing_buffer.failed:
+        return 'error'
+    if outcome == 'new' and key in listing_buffer.duplicates:
+        return 'skipped'
+    return outcome
+
+
+def _run_gmail_sync(gmail: GmailClient, incremental: bool, workers: int) -> Dict[str, int]:
+    # Search for Funda emails
+    messages, history_id = fetch_messages(gmail, incremental=incremental)
+    logger.info(f"Found {len(messages)} messages")
+    
+    # Extract all listings up front so existence can be resolved in bulk
+    message_listings = [(msg, gmail.extract_listings(msg)) for msg in messages]
+    for _, listings in message_listings:
+        logger.info(f"Extracted {len(listings)} listings from message")
+    preload_existing_ids(
+        extract_listing_id(listing['url'].split('?')[0])
+        for _, listings in message_listings
+        for listing in listings
+        if listing.get('url')
+    )
+    
+    # Verwerk alle listings in een begrensde worker pool. Dezelfde listing in
+    # meerdere mails wordt één keer verwerkt; de mails delen de uitkomst.
+    workers = max(1, workers)
+    logger.info(f"Processing listings with {workers} worker(s)")
+    listing_futures = {}
+    message_futures = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sync') as pool:
+        for msg, listings in message_listings:
+            futures = []
+            for listing in listings:
+                url = listing.get('url')
+                if not url:
+                    continue
+                key = extract_listing_id(url.split('?')[0])
+                if key not in listing_futures:
+                    listing_futures[key] = pool.submit(sync_listing, url, listing)
+                futures.append((key, listing_futures[key]))
+            message_futures.append((msg, futures))
+        
+        # Archive each message once all of its listings are done
+        processed_message_ids = []
+        for msg, futures in message_futures:
+            results = [(key, f.result()) for key, f in futures]
+            # Buffer legen voordat de mail gearchiveerd wordt: alleen echt weggeschreven telt
+            flush_listings()
+            outcomes = [_final_outcome(key, outcome) for key, outcome in results]
+            logger.info(f"Processed {len(outcomes)} listings from message")
+            
+            # Only archive when none of its listings failed
+            if 'error' not in outcomes and msg.get('id'):
+                processed_message_ids.append(msg['id'])
+    
+    # Archive + label all processed messages in one batchModify call
+    if processed_message_ids:
+        if gmail.modify_messages(processed_message_ids, add=["Brikx/Verwerkt"], remove=["INBOX"]):
+            logger.info(f"📧 Archived and labeled {len(processed_message_ids)} message(s) as 'Brikx/Verwerkt'")
+        else:
+            logger.warning("Failed to archive/label processed messages (see brikx.gmail error above)")
+    
+    flush_listings()
+    save_listing_filter()
+    
+    outcomes = [_final_outcome(key, f.result()) for key, f in listing_futures.items()]
+    
+    # Checkpoint alleen doorschuiven als alle mails verwerkt zijn; anders
+    # worden mislukte mails bij de volgende run opnieuw opgepakt. Archiveren telt
+    # niet mee: het label en de Supabase-check voorkomen dubbel verwerken al.
+    if history_id:
+        if len(processed_message_ids) == len(messages):
+            save_history_checkpoint(history_id)
+            logger.info(f"Saved Gmail history checkpoint {history_id}")
+        else:
+            logger.warning("Not all messages were processed; history checkpoint not advanced")
+    
+    return {
+        'messages': len(messages),
+        'new': outcomes.count('new'),
+        'skipped': outcomes.count('skipped'),
+        'errors': outcomes.count('error'),
+    }
+
+
+def process_url(url: str) -> str:
+    """Verwerk één handmatig aangeleverde URL: 'new', 'exists' of 'error'"""
+    funda_id = extract_listing_id(url.split('?')[0])
+    if funda_id and listing_exists(funda_id):
+        logger.info(f"Listing {funda_id} already exists, skipping")
+        return 'exists'
+    try:
+        success = process_single_listing(url)
+    except Exception as e:
+        logger.error(f"Unexpected error processing {url}: {e}")
+        success = False
+    save_listing_filter()
+    return 'new' if success else 'error'
+
+
+def reset_listing_cache():
+    """Vergeet de in-memory bestaat/bestaat-niet antwoorden (daemon: per request verse Supabase stand)"""
+    known_ids.clear()
+    checked_ids.clear()
+
+
+def serve(host: str, port: int, use_bloom: bool = False):
+    """
+    Langlopende daemon voor server.js: clients worden één keer opgezet en blijven warm.
+    Endpoints: GET /health, POST /sync (202, asynchroon), GET /sync/status,
+    POST /process_url, POST /publish.
+    Eén lock: er draait nooit meer dan één sync/verwerking tegelijk; is hij bezet,
+    dan antwoordt elk endpoint direct met 409 in plaats van te wachten.
+    """
+    import threading
+    import uvicorn
+    from fastapi import FastAPI, HTTPException
+    from pydantic import BaseModel
+    
+    init_clients(use_bloom=use_bloom)
+    report_startup_profile()
+    gmail = None
+    run_lock = threading.Lock()
+    sync_state: Dict[str, Any] = {'state': 'idle'}
+    
+    class SyncRequest(BaseModel):
+        incremental: bool = False
+        workers: int = SYNC_WORKERS
+    
+    class UrlRequest(BaseModel):
+        url: str
+    
+    class PublishRequest(BaseModel):
+        listing_id: Optional[str] = None
+        listing_ids: List[str] = []   # bulk: meerdere IDs ...
+        status: Optional[str] = None  # ... of alle listings met deze status
+        limit: int = 50
+    
+    app = FastAPI(title='Brikx sync worker')
+    
+    @app.get('/health')
+    def health():
+        return {'status': 'ok', 'busy': run_lock.locked()}
+    
+    # Gewone (sync) handlers: FastAPI draait ze in een threadpool, zodat /health bereikbaar blijft
+    def acquire_or_409():
+        if not run_lock.acquire(blocking=False):
+            raise HTTPException(status_code=409, detail='Sync worker busy')
+    
+    def run_sync(req: SyncRequest):
+        nonlocal gmail
+        try:
+            reset_listing_cache()
+            if use_bloom:
+                load_listing_filter()
+            if gmail is None:
+                gmail = GmailClient(GMAIL_CREDENTIALS, GMAIL_TOKEN)
+            summary = run_gmail_sync(gmail, incremental=req.incremental, workers=req.workers)
+            sync_state.update(state='done', summary=summary)
+        except Exception as e:
+            logger.error(f"Sync failed: {e}")
+            sync_state.update(state='error', error=str(e))
+        finally:
+            sync_state['finished_at'] = datetime.utcnow().isoformat()
+            run_lock.release()
+    
+    # Een sync duurt minuten: direct 202 en de uitkomst via GET /sync/status,
+    # zodat geen enkele HTTP timeout een lopende sync laat lijken alsof hij mislukt is
+    @app.post('/sync', status_code=202)
+    def sync(req: SyncRequest):
+        acquire_or_409()
+        sync_state.clear()
+        sync_state.update(state='running', started_at=datetime.utcnow().isoformat())
+        threading.Thread(target=run_sync, args=(req,), name='sync', daemon=True).start()
+        return {'accepted': True, **sync_state}
+    
+    @app.get('/sync/status')
+    def sync_status():
+        return dict(sync_state)
+    
+    @app.post('/process_url')
+    def process_url_endpoint(req: UrlRequest):
+        acquire_or_409()
+        try:
+            reset_listing_cache()
+            status = process_url(req.url)
+        finally:
+            run_lock.release()
+        return {'success': status == 'new', 'status': status}
+    
+    @app.post('/publish')
+    def publish(req: PublishRequest):
+        from publish_worker import publish_listing, publish_many
+        if not req.listing_id and not req.listing_ids and not req.status:
+            raise HTTPException(status_code=400, detail='listing_id, listing_ids or status is required')
+        acquire_or_409()
+        try:
+            if req.listing_id and not req.listing_ids and not req.status:
+                return {'success': bool(publish_listing(req.listing_id, supabase=supabase))}
+            summary = publish_many(req.listing_ids or None, status=req.status, limit=req.limit, supabase=supabase)
+        finally:
+            run_lock.release()
+        return {'success': summary['failed'] == 0 and summary['missing'] == 0, **summary}
+    
+    logger.info(f"Sync daemon listening on http://{host}:{port}")
+    uvicorn.run(app, host=host, port=port, log_level='info')
+
+
 def main():
     """Main sync process"""
-    global supabase, perplexity_client
+    global refresh_enrichment, stream_enrichment
     import argparse
     
     parser = argparse.ArgumentParser(description='Sync Funda listings')
     parser.add_argument('--url', help='Process a single Funda URL instead of syncing from Gmail')
+    parser.add_argument('--incremental', action='store_true',
+                        default=os.getenv('GMAIL_INCREMENTAL', '').lower() in ('1', 'true', 'yes'),
+                        help='Only fetch mail added since the last historyId checkpoint')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Bypass the Perplexity cache and re-enrich listings')
+    parser.add_argument('--stream', action='store_true', default=stream_enrichment,
+                        help='Stream Perplexity responses and abort early for unavailable listings')
+    parser.add_argument('--workers', type=int, default=SYNC_WORKERS,
+                        help=f'Number of listings enriched concurrently (default: {SYNC_WORKERS})')
+    parser.add_argument('--bloom', action='store_true',
+                        default=os.getenv('SYNC_BLOOM', '').lower() in ('1', 'true', 'yes'),
+                        help='Use a persisted Bloom filter to skip Supabase lookups for new listings')
+    parser.add_argument('--bloom-rebuild', action='store_true',
+                        help='Rebuild the Bloom filter from Supabase before syncing (implies --bloom)')
+    parser.add_argument('--serve', action='store_true',
+                        help='Run as a long-lived HTTP daemon (see SYNC_DAEMON_URL in server.js)')
+    parser.add_argument('--host', default=os.getenv('SYNC_DAEMON_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('SYNC_DAEMON_PORT', '8766')))
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Report import time per module (after client initialisation)')
     args = parser.parse_args()
+    refresh_enrichment = args.refresh
+    stream_enrichment = args.stream
+    
+    if args.serve:
+        serve(args.host, args.port, use_bloom=args.bloom)
+        return 0
     
     try:
         print("[SYNC] Starting Funda sync...", flush=True)
         
-        # Import Supabase here to avoid module-level import errors
-        from supabase import create_client, Client
-        
-        # Initialize Supabase client
-        logger.info("Initializing Supabase client...")
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-        logger.info("Supabase client initialized successfully")
-        
-        # Initialize Perplexity client
-        if PERPLEXITY_API_KEY:
-            logger.info("Initializing Perplexity client...")
-            perplexity_client = PerplexityClient(PERPLEXITY_API_KEY)
-        else:
-            logger.warning("⚠️ Geen PERPLEXITY_API_KEY gevonden in .env - AI verrijking uitgeschakeld")
+        init_clients(use_bloom=args.bloom, rebuild_bloom=args.bloom_rebuild)
+        report_startup_profile()
             
         # If URL provided, process only that URL
         if args.url:
             logger.info(f"Processing single URL: {args.url}")
-            success = process_single_listing(args.url)
-            if success:
+            status = process_url(args.url)
+            if status == 'new':
                 print(f"[SYNC] Successfully processed URL: {args.url}", flush=True)
                 return 0
             else:
+                if status == 'exists':
+                    print(f"[SYNC] Listing already exists: {args.url}", flush=True)
                 print(f"[SYNC] Failed to process URL: {args.url}", flush=True)
                 return 1
         
@@ -450,58 +1012,13 @@ def main():
         
         # Initialize Gmail client
         gmail = GmailClient(GMAIL_CREDENTIALS, GMAIL_TOKEN)
-        
-        # Search for Funda emails
-        logger.info(f"Searching Gmail with query: {GMAIL_QUERY}")
-        messages = gmail.search_messages(query=GMAIL_QUERY, max_results=20)
-        logger.info(f"Found {len(messages)} messages")
-        
-        new_listings_count = 0
-        skipped_count = 0
-        error_count = 0
-        
-        # Process each message
-        for msg in messages:
-            listings = gmail.extract_listings(msg)
-            logger.info(f"Extracted {len(listings)} listings from message")
-            
-            message_processed_successfully = True  # Track if we should archive this message
-            
-            for listing in listings:
-                url = listing.get('url')
-                if not url:
-                    continue
-                
-                if process_single_listing(url, listing):
-                    new_listings_count += 1
-                else:
-                    # Check if it was skipped because it exists
-                    funda_id = extract_listing_id(url)
-                    if funda_id and listing_exists(funda_id):
-                        skipped_count += 1
-                    else:
-                        error_count += 1
-                        message_processed_successfully = False
-            
-            # Archive message after processing all its listings
-            if message_processed_successfully:
-                try:
-                    msg_id = msg.get('id')
-                    if msg_id:
-                        # Archive the message
-                        if gmail.archive_message(msg_id):
-                            logger.info(f"📧 Archived processed message {msg_id}")
-                        # Add label for tracking
-                        if gmail.add_label(msg_id, "Brikx/Verwerkt"):
-                            logger.info(f"🏷️ Labeled message as 'Brikx/Verwerkt'")
-                except Exception as e:
-                    logger.warning(f"Failed to archive/label message: {e}")
+        summary = run_gmail_sync(gmail, incremental=args.incremental, workers=args.workers)
         
         # Print summary
         print(f"[SYNC] Sync completed successfully!", flush=True)
-        print(f"[SYNC] New listings: {new_listings_count}", flush=True)
-        print(f"[SYNC] Skipped (already exist): {skipped_count}", flush=True)
-        print(f"[SYNC] Errors: {error_count}", flush=True)
+        print(f"[SYNC] New listings: {summary['new']}", flush=True)
+        print(f"[SYNC] Skipped (already exist): {summary['skipped']}", flush=True)
+        print(f"[SYNC] Errors: {summary['errors']}", flush=True)
         
         return 0
         
@@ -0,0 +1,102 @@
+"""
+StateStore claims en onbekende publicaties over runs heen.
+
+    python -m unittest discover -s tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from brikx import publisher  # noqa: E402
+from brikx.state_store import StateStore  # noqa: E402
+
+URL = "https://www.funda.nl/detail/koop/utrecht/bouwgrond-kavel-1/43000001/"
+FUNDA_ID = "43000001"
+
+
+class FakeGmail:
+    def __init__(self, listings):
+        self.listings = listings
+
+    def extract_listings(self, msg):
+        return [dict(meta) for meta in self.listings]
+
+
+class FakeGeocoder:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def geocode(self, *args, **kwargs):
+        return None
+
+
+class UnverifiedPublishTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.db = str(self.tmp / "processed.sqlite")
+        patcher = mock.patch.dict(os.environ, {"BRIKX_CACHE_DIR": str(self.tmp / "cache")})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unverified_survives_close_and_blocks_claims(self):
+        with StateStore(self.db) as first:
+            self.assertTrue(first.claim(URL, FUNDA_ID))
+            first.mark_unverified(URL, FUNDA_ID)
+
+        with StateStore(self.db) as second:
+            self.assertTrue(second.is_unverified(URL, FUNDA_ID))
+            self.assertFalse(second.claim(URL, FUNDA_ID))
+            self.assertEqual([item["listing_id"] for item in second.unverified()], [FUNDA_ID])
+
+    def test_resolve_unverified(self):
+        with StateStore(self.db) as store:
+            store.mark_unverified(URL, FUNDA_ID)
+            store.resolve_unverified(URL, FUNDA_ID, posted=False)
+            self.assertTrue(store.claim(URL, FUNDA_ID))
+            store.mark_unverified(URL, FUNDA_ID)
+            store.resolve_unverified(URL, FUNDA_ID, posted=True)
+            self.assertTrue(store.is_processed_id(FUNDA_ID))
+            self.assertFalse(store.is_unverified(URL, FUNDA_ID))
+
+    def test_bloom_miss_sees_writes_from_other_process(self):
+        with StateStore(self.db, bloom=True) as reader, StateStore(self.db) as writer:
+            self.assertFalse(reader.is_processed_id(FUNDA_ID))
+            writer.mark_processed(URL, FUNDA_ID)
+            self.assertTrue(reader.is_processed_id(FUNDA_ID))
+            self.assertTrue(reader.is_processed_url(URL))
+
+    def run_pipeline_once(self, outcome):
+        calls = []
+
+        def publish_to_site(*args, **kwargs):
+            calls.append(args[1]["base_url"])
+            return outcome
+
+        gmail = FakeGmail([{"url": URL, "address": "Kavelweg 1, Utrecht", "province": "Utrecht"}])
+        sites = [{"base_url": "https://example.test", "username": "u", "application_password": "p"}]
+        store = StateStore(self.db)
+        with mock.patch.object(publisher, "_publish_to_site", publish_to_site), \
+                mock.patch.object(publisher, "Geocoder", FakeGeocoder):
+            try:
+                publisher._run_messages({}, gmail, [{"id": "m1"}], store, self.tmp / "artifacts", {}, sites, None)
+            finally:
+                store.close()
+        return calls
+
+    def test_unknown_outcome_is_not_republished_next_run(self):
+        self.assertEqual(self.run_pipeline_once(None), ["https://example.test"])
+        self.assertEqual(self.run_pipeline_once(True), [])
+
+    def test_failed_outcome_is_retried_next_run(self):
+        self.assertEqual(self.run_pipeline_once(False), ["https://example.test"])
+        self.assertEqual(self.run_pipeline_once(True), ["https://example.test"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+"""
+UpsertBuffer tegen een nep-PostgREST client.
+
+    python -m unittest discover -s tests
+"""
+import sys
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from brikx.supabase_batch import UpsertBuffer  # noqa: E402
+
+
+class FakeTable:
+    """Gedraagt zich als upsert met resolution=ignore-duplicates: bestaande keys komen niet terug."""
+
+    def __init__(self, existing):
+        self.existing = set(existing)
+        self.calls = []
+
+    def table(self, name):
+        return self
+
+    def upsert(self, rows, **kwargs):
+        self.calls.append(kwargs)
+        self._rows = rows
+        return self
+
+    def execute(self):
+        inserted = [r for r in self._rows if r["kavel_id"] not in self.existing]
+        self.existing.update(r["kavel_id"] for r in inserted)
+        return SimpleNamespace(data=inserted)
+
+
+class UpsertBufferTest(unittest.TestCase):
+    def test_reports_only_inserted_rows(self):
+        client = FakeTable(existing={"2"})
+        written = []
+        buffer = UpsertBuffer(client, "listings", on_written=written.extend)
+        for kavel_id in ("1", "2", "3"):
+            buffer.add({"kavel_id": kavel_id})
+        self.assertEqual(buffer.flush(), set())
+        self.assertEqual([r["kavel_id"] for r in written], ["1", "3"])
+        self.assertEqual(buffer.duplicates, {"2"})
+        self.assertEqual(client.calls[0]["returning"], "representation")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Tile renderer tegen een lokale tile server (stand-in voor Geoapify/OSM).
+
+    python -m unittest discover -s tests
+"""
+import io
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from brikx.tile_renderer import MARKER_COLOR, render_static_map  # noqa: E402
+
+TILE_COLOR = (200, 220, 240)
+
+
+def _tile_png() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (256, 256), TILE_COLOR).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class TileServer:
+    """Serveert /{z}/{x}/{y}.png; paden in `missing` geven een 404."""
+
+    def __init__(self):
+        self.requests: list[str] = []
+        self.missing: set[str] = set()
+        tile = _tile_png()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.path)
+                if self.path in server.missing:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(tile)))
+                self.end_headers()
+                self.wfile.write(tile)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/{{z}}/{{x}}/{{y}}.png"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class RenderStaticMapTest(unittest.TestCase):
+    def setUp(self):
+        self.server = TileServer()
+        self.addCleanup(self.server.close)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.cache = self.tmp / "tiles"
+
+    def render(self, name: str, lat: float = 52.0907, lon: float = 5.1214):
+        return render_static_map(lat, lon, size="800x500", zoom=15, out_path=str(self.tmp / name),
+                                 tile_url=self.server.url, cache_dir=self.cache)
+
+    def test_composites_tiles_and_marker(self):
+        out = self.render("map.png")
+        self.assertEqual(out, str(self.tmp / "map.png"))
+        with Image.open(out) as img:
+            self.assertEqual(img.size, (800, 500))
+            self.assertEqual(img.getpixel((10, 10)), TILE_COLOR)
+            self.assertEqual(img.getpixel((400, 218)), MARKER_COLOR)  # pinkop boven het midden
+
+    def test_neighbour_reuses_cached_tiles(self):
+        self.render("a.png")
+        fetched = len(self.server.requests)
+        self.assertGreater(fetched, 0)
+        self.assertIsNotNone(self.render("b.png", lon=5.1216))
+        self.assertEqual(len(self.server.requests), fetched)
+
+    def test_missing_tile_returns_none(self):
+        self.render("warm.png")
+        self.server.missing.add(self.server.requests[0])
+        for path in self.cache.rglob("*"):
+            if path.is_file():
+                path.unlink()
+        self.assertIsNone(self.render("holes.png"))
+        self.assertFalse(os.path.exists(self.tmp / "holes.png"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,15 +5,36 @@ Upload existing local map images to Supabase Storage.
 This script uploads all PNG files from the public/maps/ directory
 to the Supabase 'maps' storage bucket and updates the listings
 in the database with the new public URLs.
+
+Maps use the same content-addressed layout as sync_worker: each
+public/maps/<kavel_id>.png is resolved to its MapStore blob and uploaded
+once as maps/<blob>.png, so listings on the same location share one object.
+
+Bulk mode:
+- Remote blobs (storage eTag = md5) are listed once; blobs already in the bucket are not re-uploaded
+- Uploads and listing updates run in a thread pool (--workers / MAP_UPLOAD_WORKERS)
+- Listings are fetched with one in_() query per chunk; only the URL fields are updated
+- Progress is appended to a JSONL journal, so an interrupted run resumes where it stopped
 """
 
 import os
 import sys
+import json
+import shutil
+import hashlib
 import logging
+import argparse
+import threading
 from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
+sys.path.insert(0, str(Path(__file__).parent))
+from brikx.map_store import MapStore
+from brikx.disk_cache import make_key
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -24,103 +45,282 @@ logger = logging.getLogger("upload_maps")
 # Load environment variables
 load_dotenv()
 
-# Initialize Supabase client
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    logger.error("Missing SUPABASE_URL or SUPABASE_KEY in environment")
-    sys.exit(1)
+MAPS_DIR = Path("public/maps")
+BUCKET = 'maps'
+STORAGE_PREFIX = 'maps'
+# Same store and upload target as sync_worker.py, so both reuse each other's uploads
+MAP_STORE_DIR = os.getenv('MAP_STORE_DIR') or str(Path(__file__).parent / 'state' / 'maps')
+MAP_UPLOAD_TARGET = 'supabase:maps'
+JOURNAL_FILE = Path("state/upload_maps.jsonl")
+UPLOAD_WORKERS = int(os.getenv("MAP_UPLOAD_WORKERS", "8"))
+LIST_PAGE_SIZE = 1000
+FETCH_CHUNK_SIZE = 100
+
+
+def file_md5(path: Path) -> str:
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Journal:
+    """Append-only JSONL progress log: one line per uploaded file and per written listing."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        """filename -> latest state {'md5', 'url', 'db'}"""
+        state = {}
+        if not self.path.exists():
+            return state
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # half-written line from an interrupted run
+                current = state.setdefault(entry['file'], {})
+                if current.get('md5') != entry.get('md5'):
+                    current.clear()
+                current.update(entry)
+        return state
+
+    def append(self, **entry):
+        entry['ts'] = datetime.utcnow().isoformat()
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+def list_remote_checksums(supabase: Client) -> dict:
+    """blob filename -> md5 of the objects already in the bucket (paginated storage list)"""
+    bucket = supabase.storage.from_(BUCKET)
+    checksums = {}
+    offset = 0
+    while True:
+        items = bucket.list(STORAGE_PREFIX, {"limit": LIST_PAGE_SIZE, "offset": offset}) or []
+        for item in items:
+            # Multipart eTags ("<hash>-<parts>") are not a plain md5; keep the name, drop the checksum
+            etag = ((item.get('metadata') or {}).get('eTag') or '').strip('"')
+            if item.get('name'):
+                checksums[item['name']] = etag if '-' not in etag else ''
+        if len(items) < LIST_PAGE_SIZE:
+            return checksums
+        offset += LIST_PAGE_SIZE
+
+
+def fetch_listings(supabase: Client, kavel_ids: list) -> dict:
+    """kavel_id -> URL fields (+ specs), one in_() query per chunk"""
+    rows = {}
+    for start in range(0, len(kavel_ids), FETCH_CHUNK_SIZE):
+        chunk = kavel_ids[start:start + FETCH_CHUNK_SIZE]
+        query = supabase.table('listings').select('kavel_id, map_url, image_url, specs').in_('kavel_id', chunk)
+        for row in query.execute().data or []:
+            rows[str(row['kavel_id'])] = row
+    return rows
+
+
+def resolve_blob(store: MapStore, map_file: Path, md5: str, listing: dict = None) -> str:
+    """
+    MapStore blob key for a local map: the recorded reference or the location key from
+    the listing's coordinates (same defaults as sync_worker), but only when the store
+    rendered that blob itself. Anything else is a legacy map and is filed under a key
+    derived from its content; a location key is never seeded with a file the store did
+    not render, so sync_worker keeps rendering its own map for that location.
+    """
+    kavel_id = map_file.stem
+    candidates = [store.blob_for(kavel_id)]
+    specs = (listing or {}).get('specs') or {}
+    try:
+        candidates.append(MapStore.blob_key(float(specs['lat']), float(specs['lon'])))
+    except (KeyError, TypeError, ValueError):
+        pass
+    key = next((k for k in candidates if k and store.blob_path(k).exists()), None)
+    if not key:
+        key = make_key("map-file", md5)
+        blob_path = store.blob_path(key)
+        if not blob_path.exists():
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = blob_path.with_name(blob_path.name + ".tmp")
+            shutil.copyfile(map_file, tmp)
+            os.replace(tmp, blob_path)
+    if key != candidates[0]:
+        store.add_ref(kavel_id, key)
+    return key
+
+
+def upload_blob(supabase: Client, store: MapStore, key: str, source: Path, remote_md5: str = None) -> tuple:
+    """Upload one blob unless the bucket already has it; returns (public_url, uploaded)"""
+    storage_path = f"{STORAGE_PREFIX}/{key}.png"
+    bucket = supabase.storage.from_(BUCKET)
+    # Blob keys are immutable: an object under this name is the same map (sync_worker never overwrites)
+    uploaded = remote_md5 is None
+    if uploaded:
+        with open(source, 'rb') as f:
+            bucket.upload(
+                storage_path,
+                f.read(),
+                file_options={"content-type": "image/png", "upsert": "true"}
+            )
+    elif remote_md5 and remote_md5 != file_md5(source):
+        logger.info(f"  Remote blob {key} differs from the local file; keeping the remote copy")
+    public_url = bucket.get_public_url(storage_path)
+    store.record_upload(key, MAP_UPLOAD_TARGET, public_url)
+    return public_url, uploaded
+
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+def update_listing(supabase: Client, listing: dict, public_url: str) -> bool:
+    """Point the listing at the blob URL; only the three URL fields are written"""
+    specs = listing.get('specs') or {}
+    if listing.get('map_url') == public_url and listing.get('image_url') == public_url \
+            and specs.get('map_url') == public_url:
+        return True
+    specs['map_url'] = public_url
+    try:
+        supabase.table('listings').update({
+            'map_url': public_url,
+            'image_url': public_url,  # Also update image_url if it was using the old local URL
+            'specs': specs
+        }).eq('kavel_id', listing['kavel_id']).execute()
+        return True
+    except Exception as db_err:
+        if 'PGRST204' in str(db_err):
+            return True
+        logger.warning(f"  Failed to update database for {listing['kavel_id']}: {db_err}")
+        return False
 
-def upload_maps_to_supabase():
+
+def upload_maps_to_supabase(maps_dir: Path = MAPS_DIR, workers: int = UPLOAD_WORKERS,
+                            journal_file: Path = JOURNAL_FILE, force: bool = False):
     """Upload all local map images to Supabase storage."""
-    maps_dir = Path("public/maps")
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        logger.error("Missing SUPABASE_URL or SUPABASE_KEY in environment")
+        sys.exit(1)
+    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
     if not maps_dir.exists():
         logger.warning(f"Maps directory '{maps_dir}' does not exist")
         return
 
     # Find all PNG files
-    map_files = list(maps_dir.glob("*.png"))
-    logger.info(f"Found {len(map_files)} map files to upload")
-
-    uploaded_count = 0
-    failed_count = 0
-
-    for map_file in map_files:
-        try:
-            filename = map_file.name
-            funda_id = map_file.stem  # filename without extension
+    map_files = sorted(maps_dir.glob("*.png"))
+    logger.info(f"Found {len(map_files)} map files")
 
-            logger.info(f"Processing {filename} (kavel_id: {funda_id})...")
+    journal = Journal(journal_file)
+    progress = {} if force else journal.load()
+    checksums = {map_file.name: file_md5(map_file) for map_file in map_files}
 
-            # Read file bytes
-            with open(map_file, 'rb') as f:
-                file_bytes = f.read()
+    # Resume: files whose upload and database update are both journaled (same content) are done
+    pending = [
+        map_file for map_file in map_files
+        if not (progress.get(map_file.name, {}).get('md5') == checksums[map_file.name]
+                and progress[map_file.name].get('db'))
+    ]
+    logger.info(f"{len(map_files) - len(pending)} already done according to {journal_file}, {len(pending)} to process")
+    if not pending:
+        return
 
-            # Upload to Supabase storage
-            storage_path = f"maps/{filename}"
+    # Listings first: their coordinates point at a blob the store may already have rendered
+    listings = {}
+    try:
+        listings = fetch_listings(supabase, [map_file.stem for map_file in pending])
+    except Exception as db_err:
+        logger.warning(f"Failed to fetch listings: {db_err}")
 
-            try:
-                supabase.storage.from_('maps').upload(
-                    storage_path,
-                    file_bytes,
-                    file_options={"content-type": "image/png", "upsert": "true"}
-                )
-            except Exception as e:
-                # If file exists, try to update it
-                if "duplicate" in str(e).lower() or "already exists" in str(e).lower():
-                    logger.info(f"  File exists, updating...")
-                    supabase.storage.from_('maps').update(
-                        storage_path,
-                        file_bytes,
-                        file_options={"content-type": "image/png"}
-                    )
-                else:
-                    raise
-
-            # Get public URL
-            public_url = supabase.storage.from_('maps').get_public_url(storage_path)
-            logger.info(f"  Uploaded: {public_url}")
-
-            # Update listing in database if it exists
-            try:
-                # Check if listing exists
-                response = supabase.table('listings').select('kavel_id, specs').eq('kavel_id', funda_id).execute()
+    store = MapStore(MAP_STORE_DIR)
+    blobs = {}  # blob key -> local file to upload (several listings can share one)
+    keys = {}   # filename -> blob key
+    for map_file in pending:
+        key = resolve_blob(store, map_file, checksums[map_file.name], listings.get(map_file.stem))
+        keys[map_file.name] = key
+        blobs.setdefault(key, store.blob_path(key))
 
-                if response.data and len(response.data) > 0:
-                    listing = response.data[0]
-                    specs = listing.get('specs', {})
+    remote = {}
+    if not force:
+        try:
+            remote = list_remote_checksums(supabase)
+            logger.info(f"Found {len(remote)} blobs in the '{BUCKET}' bucket")
+        except Exception as e:
+            logger.warning(f"Could not list remote maps ({e}); uploading everything")
 
-                    # Update map_url in specs
-                    specs['map_url'] = public_url
+    urls = {}  # blob key -> public URL
+    uploaded_count = 0
+    unchanged_count = 0
+    failed_count = 0
+    workers = max(1, workers)
 
-                    # Update the listing
-                    supabase.table('listings').update({
-                        'map_url': public_url,
-                        'image_url': public_url,  # Also update image_url if it was using the old local URL
-                        'specs': specs
-                    }).eq('kavel_id', funda_id).execute()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload') as pool:
+        futures = {}
+        for key, source in blobs.items():
+            known = None if force else store.uploaded_url(key, MAP_UPLOAD_TARGET)
+            if known and f"{key}.png" in remote:
+                urls[key] = known
+                unchanged_count += 1
+                continue
+            futures[pool.submit(upload_blob, supabase, store, key, source, remote.get(f"{key}.png"))] = key
 
-                    logger.info(f"  Updated listing {funda_id} with new map URL")
-                else:
-                    logger.warning(f"  No listing found for kavel_id {funda_id}")
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                public_url, uploaded = future.result()
+            except Exception as e:
+                logger.error(f"Failed to upload blob {key}: {e}")
+                failed_count += 1
+                continue
+            if uploaded:
+                uploaded_count += 1
+                logger.info(f"  Uploaded: {public_url}")
+            else:
+                unchanged_count += 1
+            urls[key] = public_url
 
-            except Exception as db_err:
-                logger.warning(f"  Failed to update database for {funda_id}: {db_err}")
+        for map_file in pending:
+            if keys[map_file.name] in urls:
+                journal.append(file=map_file.name, md5=checksums[map_file.name],
+                               blob=keys[map_file.name], url=urls[keys[map_file.name]])
 
-            uploaded_count += 1
+        # Update listings in the database (filename without extension = kavel_id)
+        updates = {}
+        for map_file in pending:
+            public_url = urls.get(keys[map_file.name])
+            if not public_url:
+                continue
+            listing = listings.get(map_file.stem)
+            if listing is None:
+                logger.warning(f"  No listing found for kavel_id {map_file.stem}")
+                continue
+            updates[pool.submit(update_listing, supabase, listing, public_url)] = (map_file, public_url)
 
-        except Exception as e:
-            logger.error(f"Failed to upload {map_file.name}: {e}")
-            failed_count += 1
+        updated_count = 0
+        for future in as_completed(updates):
+            map_file, public_url = updates[future]
+            if future.result():
+                updated_count += 1
+                journal.append(file=map_file.name, md5=checksums[map_file.name],
+                               blob=keys[map_file.name], url=public_url, db=True)
 
     logger.info(f"\n✅ Upload complete!")
     logger.info(f"   Uploaded: {uploaded_count}")
+    logger.info(f"   Unchanged: {unchanged_count}")
+    logger.info(f"   Listings up to date: {updated_count}")
     logger.info(f"   Failed: {failed_count}")
 
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Upload local map images to Supabase Storage')
+    parser.add_argument('--dir', type=Path, default=MAPS_DIR, help='Directory with <kavel_id>.png maps')
+    parser.add_argument('--workers', type=int, default=UPLOAD_WORKERS, help='Parallel uploads')
+    parser.add_argument('--journal', type=Path, default=JOURNAL_FILE, help='JSONL progress journal')
+    parser.add_argument('--force', action='store_true', help='Ignore journal and remote checksums, upload everything')
+    args = parser.parse_args()
+
     logger.info("Starting map upload to Supabase storage...")
-    upload_maps_to_supabase()
+    upload_maps_to_supabase(args.dir, workers=args.workers, journal_file=args.journal, force=args.force)
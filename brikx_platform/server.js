@@ -22,6 +22,53 @@ const __dirname = path.dirname(fileURLToPath(import.meta.url));
 // VERWIJZING NAAR HET NIEUWE SYNC SCRIPT
 const SYNC_SCRIPT = path.join(__dirname, 'backend', 'sync_worker.py');
 
+// Optioneel: langlopende sync daemon (python backend/sync_worker.py --serve).
+// Bespaart per request het opstarten van Python; valt alleen terug op exec als de daemon
+// niet bereikbaar is. Een timeout of andere fout betekent dat de daemon mogelijk nog bezig
+// is: dan geen tweede run via exec starten.
+const SYNC_DAEMON_URL = process.env.SYNC_DAEMON_URL;
+// Onder de 300s headers timeout van fetch; /sync zelf is asynchroon (202 + /sync/status)
+const SYNC_DAEMON_TIMEOUT_MS = Number(process.env.SYNC_DAEMON_TIMEOUT_MS || 240000);
+const SYNC_POLL_INTERVAL_MS = 2000;
+// Maximale wachttijd op een door de daemon gestarte sync; daarna 504 (de sync loopt door)
+const SYNC_DAEMON_MAX_WAIT_MS = Number(process.env.SYNC_DAEMON_MAX_WAIT_MS || 900000);
+const DAEMON_UNREACHABLE = new Set(['ECONNREFUSED', 'ENOTFOUND', 'EAI_AGAIN']);
+
+async function callSyncDaemon(endpoint, body, method = 'POST') {
+    if (!SYNC_DAEMON_URL) return null;
+    try {
+        const response = await fetch(`${SYNC_DAEMON_URL.replace(/\/$/, '')}${endpoint}`, {
+            method,
+            headers: { 'Content-Type': 'application/json' },
+            body: method === 'GET' ? undefined : JSON.stringify(body || {}),
+            signal: AbortSignal.timeout(SYNC_DAEMON_TIMEOUT_MS)
+        });
+        const data = await response.json().catch(() => ({}));
+        return { status: response.status, data };
+    } catch (error) {
+        // localhost met IPv4+IPv6 geeft een AggregateError met de codes per adres
+        const code = error.cause?.code || error.cause?.errors?.[0]?.code;
+        if (DAEMON_UNREACHABLE.has(code)) {
+            console.warn(`⚠️  Sync daemon niet bereikbaar (${code}), val terug op Python proces`);
+            return null;
+        }
+        console.error(`❌ Sync daemon request ${endpoint} mislukt: ${error.message}`);
+        return { status: 504, data: { detail: error.message } };
+    }
+}
+
+// Wacht tot de door POST /sync gestarte sync klaar is, hooguit SYNC_DAEMON_MAX_WAIT_MS
+async function waitForDaemonSync() {
+    const deadline = Date.now() + SYNC_DAEMON_MAX_WAIT_MS;
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, SYNC_POLL_INTERVAL_MS));
+        const poll = await callSyncDaemon('/sync/status', null, 'GET');
+        if (!poll) return { state: 'error', error: 'Sync daemon niet meer bereikbaar' };
+        if (poll.status === 200 && poll.data.state !== 'running') return poll.data;
+    }
+    return { state: 'timeout', error: `Sync niet klaar na ${SYNC_DAEMON_MAX_WAIT_MS} ms` };
+}
+
 // Supabase Setup
 const supabaseUrl = process.env.SUPABASE_URL;
 const supabaseKey = process.env.SUPABASE_KEY;
@@ -222,6 +269,19 @@ app.post('/api/listings/manual', async (req, res) => {
 
     try {
         console.log(`Processing manual URL: ${url}`);
+
+        const daemon = await callSyncDaemon('/process_url', { url });
+        if (daemon) {
+            if (daemon.data.status === 'new') {
+                return res.json({ success: true, message: "Kavel succesvol toegevoegd" });
+            } else if (daemon.data.status === 'exists') {
+                return res.status(409).json({ success: false, message: "Kavel bestaat al" });
+            } else if (daemon.status === 409) {
+                return res.status(409).json({ success: false, message: "Er loopt al een sync, probeer het zo opnieuw" });
+            }
+            return res.status(500).json({ success: false, message: "Kon kavel niet verwerken. Zie logs." });
+        }
+
         // Use path.join and replace backslashes with forward slashes for Python
         const scriptPath = path.join(process.cwd(), 'backend', 'sync_worker.py').replace(/\\/g, '/');
         const { stdout, stderr } = await execPromise(`python "${scriptPath}" --url "${url}"`);
@@ -587,12 +647,41 @@ app.get('/api/stats', async (req, res) => {
 });
 
 // 8. Sync Trigger (Check Funda)
-app.post('/api/sync', (req, res) => {
+app.post('/api/sync', async (req, res) => {
     console.log("🔄 Sync aangevraagd...");
+    const previousSyncStatus = { ...currentSyncStatus };
     currentSyncStatus.message = "Bezig met ophalen...";
     currentSyncStatus.status = "warning";
     currentSyncStatus.lastCheck = new Date().toISOString();
 
+    const daemon = await callSyncDaemon('/sync', {});
+    if (daemon) {
+        if (daemon.status === 409) {
+            // De lopende sync werkt de status zelf bij; niet op "Bezig" laten hangen
+            currentSyncStatus = previousSyncStatus;
+            return res.status(409).json({ success: false, message: "Er loopt al een sync" });
+        }
+        if (daemon.status !== 202) {
+            console.error(`❌ Sync daemon error: ${JSON.stringify(daemon.data)} `);
+            currentSyncStatus = { status: 'error', message: 'Sync mislukt', lastCheck: new Date().toISOString() };
+            return res.status(500).json({ success: false });
+        }
+        const result = await waitForDaemonSync();
+        if (result.state === 'timeout') {
+            console.error(`❌ Sync daemon: ${result.error} `);
+            currentSyncStatus = { status: 'warning', message: 'Sync duurt te lang', lastCheck: new Date().toISOString() };
+            return res.status(504).json({ success: false, message: result.error });
+        }
+        if (result.state !== 'done') {
+            console.error(`❌ Sync daemon error: ${JSON.stringify(result)} `);
+            currentSyncStatus = { status: 'error', message: 'Sync mislukt', lastCheck: new Date().toISOString() };
+            return res.status(500).json({ success: false });
+        }
+        console.log(`✅ Sync daemon: ${JSON.stringify(result.summary)} `);
+        currentSyncStatus = { status: 'ok', message: 'Nieuwe kavels opgehaald', lastCheck: new Date().toISOString() };
+        return res.json({ success: true });
+    }
+
     if (!fs.existsSync(SYNC_SCRIPT)) {
         console.error(`❌ Kan sync script niet vinden: ${SYNC_SCRIPT} `);
         return res.status(500).json({ success: false, message: "Script niet gevonden" });